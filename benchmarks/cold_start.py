@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Cold-start benchmark for the API.
+
+Measures, over several fresh interpreters:
+  * import time of server.app
+  * time until the lifespan startup hands control to uvicorn
+  * time until /ready would report ready, with per-phase timings
+
+Run from the project root. MongoDB should be reachable at MONGO_URI for the
+readiness numbers to be meaningful; without it the index phases report the
+server selection timeout instead.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RUNS = int(os.getenv("COLD_START_RUNS", "5"))
+
+_CHILD = r"""
+import asyncio, json, os, time
+os.environ.setdefault("POLLER_MODE", "off")
+t0 = time.perf_counter()
+import server.app as api
+t_import = time.perf_counter() - t0
+
+async def main():
+    t1 = time.perf_counter()
+    async with api.app.router.lifespan_context(api.app):
+        t_serving = time.perf_counter() - t1
+        deadline = time.perf_counter() + float(os.getenv("COLD_START_READY_TIMEOUT", "35"))
+        while not api._ready and time.perf_counter() < deadline:
+            await asyncio.sleep(0.005)
+        t_ready = time.perf_counter() - t1
+    print(json.dumps({
+        "import_ms": t_import * 1000,
+        "serving_ms": t_serving * 1000,
+        "ready_ms": t_ready * 1000,
+        "phases": api.startup_timings,
+    }))
+
+asyncio.run(main())
+"""
+
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for _ in range(RUNS):
+        out = subprocess.run(
+            [sys.executable, "-c", _CHILD], cwd=root, capture_output=True, text=True, check=True
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    for key in ("import_ms", "serving_ms", "ready_ms"):
+        values = [r[key] for r in results]
+        print(f"{key:12s} median={statistics.median(values):8.1f}  min={min(values):8.1f}  max={max(values):8.1f}")
+    print("phases (last run):")
+    for name, ms in results[-1]["phases"].items():
+        print(f"  {name:20s} {ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+Ingest benchmark comparing logging setups.
+
+Drives POST /api/readings in-process (no HTTP server) with a fixed number of
+concurrent clients, once per logging setup:
+
+  basic   logging.basicConfig: every insert logged, formatted and written to
+          the sink on the event loop (the previous behaviour)
+  queue   server/logconfig.py: sampled records handed to a background
+          writer through a bounded queue
+
+The sink discards output but can be made slow with --sink-delay (seconds
+per write) to stand in for a congested log driver. Readings are stored in
+memory by default so the numbers show the ingest path itself; --store mongo
+uses a scratch database at MONGO_URI that is dropped afterwards.
+
+Examples:
+
+  python benchmarks/ingest_logging.py --requests 20000 --concurrency 100
+  python benchmarks/ingest_logging.py --sink-delay 0.0005
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("POLLER_MODE", "off")
+os.environ.setdefault("INGEST_MAX_QUEUE", "100000")
+
+from server import app as api  # noqa: E402
+from server import logconfig  # noqa: E402
+from powerstrip_load import asgi_request  # noqa: E402
+
+
+class Sink:
+    """A write-only stream that optionally stalls on every write."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        if self.delay:
+            time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+
+class _Result:
+    def __init__(self, upserted_id):
+        self.upserted_id = upserted_id
+
+
+class MemoryReadings:
+    """Just enough of a collection for create_reading."""
+
+    def __init__(self):
+        self.keys = set()
+
+    async def update_one(self, query, update, upsert=False):
+        key = query["dedup_key"]
+        if key in self.keys:
+            return _Result(None)
+        self.keys.add(key)
+        return _Result(len(self.keys))
+
+
+def use_logging(mode: str, sink: Sink):
+    if mode == "basic":
+        logconfig.stop()
+        logging.basicConfig(level=logging.INFO, stream=sink, force=True)
+        logconfig.set_rules(",".join(f"{c}=all" for c in logconfig.DEFAULT_SAMPLING))
+    else:
+        logconfig.configure(level="INFO", stream=sink)
+        logconfig.set_rules(",".join(f"{c}={r}" for c, r in logconfig.DEFAULT_SAMPLING.items()))
+
+
+async def run_load(args, rng):
+    start_ts = datetime(2026, 1, 1)
+    latencies = []
+    statuses = {}
+    remaining = args.requests
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            n = remaining
+            body = {
+                "id": rng.randrange(args.tanks),
+                "temp": round(rng.uniform(20, 35), 2),
+                "humidity": round(rng.uniform(20, 80), 2),
+                "light": rng.random() < 0.5,
+                "timestamp": (start_ts + timedelta(seconds=n)).isoformat(),
+            }
+            started = time.perf_counter()
+            status = await asgi_request("POST", "/api/readings", body)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    wall = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    return time.perf_counter() - wall, latencies, statuses
+
+
+def report(mode, elapsed, cpu, latencies, statuses, sink):
+    ms = sorted(x * 1000 for x in latencies)
+    q = statistics.quantiles(ms, n=100) if len(ms) > 1 else ms * 99
+    print(f"[{mode}]")
+    print(f"  requests    {len(ms)} in {elapsed:.2f} s  ({len(ms) / elapsed:.1f} req/s)")
+    print(f"  cpu         {cpu / len(ms) * 1e6:.1f} us/request")
+    print(f"  latency ms  p50={q[49]:.2f}  p95={q[94]:.2f}  p99={q[98]:.2f}  max={ms[-1]:.2f}")
+    print("  status      " + "  ".join(f"{k}={v}" for k, v in sorted(statuses.items())))
+    print(f"  log lines   {sink.writes} written, {logconfig.dropped} dropped")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Ingest path benchmark, before/after queued logging")
+    parser.add_argument("--modes", default="basic,queue", help="comma-separated: basic, queue")
+    parser.add_argument("--store", choices=("memory", "mongo"), default="memory")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--tanks", type=int, default=100)
+    parser.add_argument("--sink-delay", type=float, default=0.0, help="seconds each log write blocks")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    client = db = None
+    if args.store == "mongo":
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(api.MONGO_URI, serverSelectionTimeoutMS=3000)
+        db = client[f"ingest_logging_{os.getpid()}"]
+    try:
+        for mode in args.modes.split(","):
+            if client is not None:
+                await db.drop_collection("readings")
+                api.collection = db["readings"]
+                await api.collection.create_index("dedup_key", unique=True)
+            else:
+                api.collection = MemoryReadings()
+            sink = Sink(args.sink_delay)
+            logconfig.dropped = 0
+            use_logging(mode, sink)
+            cpu = time.process_time()
+            elapsed, latencies, statuses = await run_load(args, random.Random(args.seed))
+            logconfig.stop()  # flush, so writer time and the write count are included
+            cpu = time.process_time() - cpu
+            logging.basicConfig(level=logging.WARNING, force=True)
+            report(mode, elapsed, cpu, latencies, statuses, sink)
+    finally:
+        if client is not None:
+            await client.drop_database(db.name)
+            client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
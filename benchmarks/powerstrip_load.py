@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+Load harness for the powerstrip endpoints, against emulated Kasa strips.
+
+Drives the FastAPI app in-process (no HTTP server) with a fixed number of
+concurrent clients and reports throughput, latency percentiles and status
+codes. Strips come from tools/kasa_emulator.py:
+
+  --mode inprocess   fake devices patched in for kasa.Discover (default)
+  --mode network     the UDP/TCP responder on 127.0.0.2, 127.0.0.3, ...
+                     driven by the real python-kasa client
+
+Scenarios:
+
+  legacy     GET/POST /api/powerstrip/{index}, with KASA_DEVICE_IP pointing
+             at the first strip (--broadcast, in-process only: unset, so
+             every request runs a broadcast discovery across all strips)
+  registry   GET/POST /api/tanks/{id}/outlets across all strips through the
+             powerstrip registry; needs MongoDB at MONGO_URI and uses a
+             scratch database that is dropped afterwards
+
+Examples:
+
+  python benchmarks/powerstrip_load.py --strips 20 --latency 0.05 --jitter 0.05
+  python benchmarks/powerstrip_load.py --scenario registry --strips 50 --failure-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("POLLER_MODE", "off")
+
+from server import app as api  # noqa: E402
+from server import powerstrip_interface  # noqa: E402
+from server import powerstrip_registry  # noqa: E402
+from tools import kasa_emulator  # noqa: E402
+
+
+async def asgi_request(method: str, path: str, body=None) -> int:
+    """Call the ASGI app directly and return the response status."""
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.Future()  # never disconnects
+
+    status = 0
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await api.app(scope, receive, send)
+    return status
+
+
+def legacy_requests(args, rng):
+    def make():
+        index = rng.randint(1, args.relays)
+        if rng.random() < args.write_ratio:
+            return "POST", f"/api/powerstrip/{index}", {"action": "toggle"}
+        return "GET", f"/api/powerstrip/{index}", None
+    return make
+
+
+def registry_requests(args, rng):
+    def make():
+        tank_id = rng.randrange(args.tanks)
+        if rng.random() < args.write_ratio:
+            return "POST", f"/api/tanks/{tank_id}/outlets/lights", {"action": "toggle"}
+        return "GET", f"/api/tanks/{tank_id}/outlets", None
+    return make
+
+
+async def setup_registry(args, strips):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(api.MONGO_URI, serverSelectionTimeoutMS=3000)
+    db = client[f"powerstrip_load_{os.getpid()}"]
+    await powerstrip_registry.initialize(db)
+    # probe each emulated address directly rather than waiting out a broadcast
+    for strip in strips:
+        await powerstrip_registry.discover(f"{strip.host}/32")
+    # two roles per tank, spread over the strips so one tank touches two devices
+    devices = [s.mac for s in strips]
+    for tank_id in range(args.tanks):
+        for n, role in enumerate(("lights", "basking_lamp")):
+            device_id = devices[(tank_id + n) % len(devices)]
+            await powerstrip_registry.assign_outlet(tank_id, role, device_id, tank_id % args.relays + 1)
+    return client, db
+
+
+async def run_load(make_request, total: int, concurrency: int):
+    latencies = []
+    statuses = Counter()
+    remaining = total
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            method, path, body = make_request()
+            start = time.perf_counter()
+            try:
+                status = await asgi_request(method, path, body)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, statuses
+
+
+def report(elapsed, latencies, statuses, strips):
+    ms = sorted(x * 1000 for x in latencies)
+    q = statistics.quantiles(ms, n=100) if len(ms) > 1 else ms * 99
+    print(f"requests    {len(ms)} in {elapsed:.2f} s  ({len(ms) / elapsed:.1f} req/s)")
+    print(f"latency ms  p50={q[49]:.1f}  p95={q[94]:.1f}  p99={q[98]:.1f}  max={ms[-1]:.1f}")
+    print("status      " + "  ".join(f"{k}={v}" for k, v in sorted(statuses.items(), key=str)))
+    sent = sum(s.counters["requests"] for s in strips)
+    failed = sum(s.counters["failures"] for s in strips)
+    print(f"strips      {len(strips)} strips, {sent} device requests, {failed} injected failures")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Powerstrip endpoint load harness")
+    parser.add_argument("--scenario", choices=("legacy", "registry"), default="legacy")
+    parser.add_argument("--mode", choices=("inprocess", "network"), default="inprocess")
+    parser.add_argument("--strips", type=int, default=10)
+    parser.add_argument("--relays", type=int, default=6)
+    parser.add_argument("--tanks", type=int, default=50, help="registry scenario: tanks to spread over the strips")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="fraction of requests that toggle an outlet")
+    parser.add_argument("--broadcast", action="store_true", help="legacy scenario: discover by broadcast per request")
+    parser.add_argument("--discovery-timeout", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    strips = kasa_emulator.make_strips(args.strips, relays=args.relays, latency=args.latency,
+                                       jitter=args.jitter, failure_rate=args.failure_rate)
+    powerstrip_interface.IP_ADDRESS = None if args.broadcast else strips[0].host
+    powerstrip_registry.DISCOVERY_TIMEOUT = args.discovery_timeout
+
+    responder = None
+    if args.mode == "network":
+        responder = await kasa_emulator.KasaResponder(strips).start()
+        installed = None
+    else:
+        installed = kasa_emulator.installed(kasa_emulator.EmulatedDiscover(strips))
+        installed.__enter__()
+
+    client = db = None
+    try:
+        if args.scenario == "registry":
+            client, db = await setup_registry(args, strips)
+            make_request = registry_requests(args, rng)
+        else:
+            make_request = legacy_requests(args, rng)
+        for s in strips:
+            s.counters.update(requests=0, failures=0)
+        elapsed, latencies, statuses = await run_load(make_request, args.requests, args.concurrency)
+        report(elapsed, latencies, statuses, strips)
+    finally:
+        if client is not None:
+            await powerstrip_registry.cleanup()
+            await client.drop_database(db.name)
+            client.close()
+        if responder is not None:
+            await responder.stop()
+        if installed is not None:
+            installed.__exit__(None, None, None)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
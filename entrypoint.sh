@@ -1,12 +1,23 @@
 #!/bin/bash
 # entrypoint.sh - Start both API and sensor simulator
 
-# Start the API in the background
-uvicorn server.app:app --host 0.0.0.0 --port 8000 &
+READY_URL="${READY_URL:-http://localhost:8000/ready}"
+READY_TIMEOUT_SECONDS="${READY_TIMEOUT_SECONDS:-60}"
 
-# Wait for the API to be ready
-sleep 5
+# Start the API in the background; the simulator runs as its own process below
+POLLER_MODE=off uvicorn server.app:app --host 0.0.0.0 --port 8000 &
 
-# Start the sensor simulator
-python sensor_interface.py
+# Wait for the API to report ready instead of sleeping a fixed time. It stays
+# 503 while required startup phases (index creation) keep failing, and the
+# simulator must not write readings before the dedup index exists.
+deadline=$((SECONDS + READY_TIMEOUT_SECONDS))
+until python -c "import sys, urllib.request; sys.exit(urllib.request.urlopen('$READY_URL', timeout=2).status != 200)" 2>/dev/null; do
+  if [ "$SECONDS" -ge "$deadline" ]; then
+    echo "API not ready after ${READY_TIMEOUT_SECONDS}s, still waiting (see $READY_URL)" >&2
+    deadline=$((SECONDS + READY_TIMEOUT_SECONDS))
+  fi
+  sleep 0.5
+done
 
+# Start the sensor simulator
+python -m server.poller
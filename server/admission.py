@@ -0,0 +1,125 @@
+# Admission control for ingest traffic.
+#
+# Reading ingest goes through a gate with a bounded number of in-flight
+# requests and a bounded wait queue. When both are full, or a queued
+# request waits longer than INGEST_QUEUE_TIMEOUT_SECONDS, the request is
+# shed with 429 and a Retry-After estimated from recent service times.
+# Sensors already spool and replay on failure, so shedding delays readings
+# rather than losing them.
+#
+# Every other route (powerstrip control, dashboard, health, readiness)
+# bypasses the gate entirely, and the in-flight bound is kept well below
+# the Mongo connection pool, so control traffic is never queued behind an
+# ingest burst.
+import asyncio
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+logger = logging.getLogger("admission")
+
+INGEST_MAX_IN_FLIGHT = int(os.getenv("INGEST_MAX_IN_FLIGHT", "32"))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "256"))
+INGEST_QUEUE_TIMEOUT_SECONDS = float(os.getenv("INGEST_QUEUE_TIMEOUT_SECONDS", "2"))
+
+# (method, path) pairs that go through the ingest gate
+INGEST_ROUTES = {
+    ("POST", "/api/readings"),
+    ("POST", "/api/readings/bulk"),
+    ("POST", "/api/readings/binary"),
+    ("POST", "/api/reptiles/import"),
+}
+
+
+class Saturated(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    def __init__(self, name: str, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.queued = 0
+        # EWMA of seconds a request holds a slot, for Retry-After
+        self._service_time = 0.05
+        self.counters = {"admitted": 0, "shed_queue_full": 0, "shed_timeout": 0, "peak_queued": 0}
+
+    def _sem(self) -> asyncio.Semaphore:
+        # created lazily so it binds to the serving event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained."""
+        backlog = self.queued + self.in_flight
+        return max(1, math.ceil(backlog * self._service_time / self.max_in_flight))
+
+    @staticmethod
+    def _abandon(sem: asyncio.Semaphore, acquire: asyncio.Future):
+        """Give up a queued acquire, handing back the permit if it was granted anyway."""
+        acquire.cancel()
+        acquire.add_done_callback(lambda t: t.cancelled() or t.exception() or sem.release())
+
+    @asynccontextmanager
+    async def admit(self):
+        sem = self._sem()
+        if sem.locked():
+            if self.queued >= self.max_queue:
+                self.counters["shed_queue_full"] += 1
+                raise Saturated(self.retry_after())
+            self.queued += 1
+            self.counters["peak_queued"] = max(self.counters["peak_queued"], self.queued)
+            # an explicit waiter rather than wait_for, which before 3.12 can
+            # drop a permit granted just as the request is cancelled
+            acquire = asyncio.ensure_future(sem.acquire())
+            try:
+                await asyncio.wait({acquire}, timeout=self.queue_timeout)
+            except asyncio.CancelledError:
+                self._abandon(sem, acquire)
+                raise
+            finally:
+                self.queued -= 1
+            if not acquire.done():
+                self._abandon(sem, acquire)
+                self.counters["shed_timeout"] += 1
+                raise Saturated(self.retry_after())
+        else:
+            await sem.acquire()
+        self.in_flight += 1
+        self.counters["admitted"] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            sem.release()
+            self._service_time = 0.9 * self._service_time + 0.1 * (time.perf_counter() - start)
+
+    def status(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "avg_service_ms": round(self._service_time * 1000, 1),
+            "shed": self.counters["shed_queue_full"] + self.counters["shed_timeout"],
+            **self.counters,
+        }
+
+
+ingest_gate = AdmissionGate("ingest", INGEST_MAX_IN_FLIGHT, INGEST_MAX_QUEUE, INGEST_QUEUE_TIMEOUT_SECONDS)
+
+
+def gate_for(method: str, path: str) -> Optional[AdmissionGate]:
+    """The gate a request must pass, or None for exempt routes."""
+    return ingest_gate if (method, path.rstrip("/") or "/") in INGEST_ROUTES else None
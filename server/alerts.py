@@ -0,0 +1,475 @@
+# Alert dispatch pipeline.
+#
+# Conditions are tracked per (tank, condition) by a small state machine:
+# a condition fires when a value leaves its critical range, repeats at most
+# once per ALERT_COOLDOWN_SECONDS while it stays out (intermediate hits are
+# counted, not sent), and resolves only once the value is back inside the
+# range by a hysteresis margin, so a reading hovering on the threshold
+# doesn't flap.
+#
+# The condition states of each tank (firing, last sent, suppressed count)
+# live in one `alert_state` document shared by every API worker. Readings
+# are queued in memory and every ALERT_FLUSH_SECONDS each worker evaluates
+# its queue per tank against the stored states and writes them back only if
+# the document's version is unchanged, re-reading and re-evaluating
+# otherwise. Only the worker whose write lands sends the resulting events,
+# so a condition fires, repeats and resolves once however the readings are
+# spread across workers, and cooldowns survive restarts.
+#
+# Raising an alert never blocks the caller: events go onto a bounded queue
+# (dropped and counted when full) and a dispatcher task groups them into
+# batches. Each sink has its own bounded queue of batches and its own
+# delivery task, so a slow sink (a webhook timing out) only delays itself.
+# A failed delivery is retried with exponential backoff a bounded number of
+# times, in order, before that sink gives the batch up.
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger("alerts")
+
+ALERT_COOLDOWN_SECONDS = float(os.getenv("ALERT_COOLDOWN_SECONDS", "900"))
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "1000"))
+ALERT_BATCH_SIZE = int(os.getenv("ALERT_BATCH_SIZE", "50"))
+ALERT_BATCH_WINDOW_SECONDS = float(os.getenv("ALERT_BATCH_WINDOW_SECONDS", "2"))
+ALERT_SINK_TIMEOUT_SECONDS = float(os.getenv("ALERT_SINK_TIMEOUT_SECONDS", "5"))
+ALERT_SINK_QUEUE_BATCHES = int(os.getenv("ALERT_SINK_QUEUE_BATCHES", "100"))
+ALERT_SINK_RETRIES = int(os.getenv("ALERT_SINK_RETRIES", "3"))
+ALERT_SINK_RETRY_SECONDS = float(os.getenv("ALERT_SINK_RETRY_SECONDS", "1"))
+ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL", "")
+# how far past the target range a value must go to be critical
+ALERT_CRITICAL_MARGIN = {
+    "temp": float(os.getenv("ALERT_TEMP_MARGIN", "2")),
+    "humidity": float(os.getenv("ALERT_HUMIDITY_MARGIN", "10")),
+}
+# how far back inside the critical range a value must come to resolve
+ALERT_HYSTERESIS = {
+    "temp": float(os.getenv("ALERT_TEMP_HYSTERESIS", "0.5")),
+    "humidity": float(os.getenv("ALERT_HUMIDITY_HYSTERESIS", "2")),
+}
+# a legacy send_alert() condition not repeated for this long counts as cleared
+ALERT_STALE_SECONDS = float(os.getenv("ALERT_STALE_SECONDS", "60"))
+ALERT_FLUSH_SECONDS = float(os.getenv("ALERT_FLUSH_SECONDS", "1"))
+# attempts at storing a tank's state before a flush gives its readings up
+ALERT_STATE_RETRIES = 5
+
+ALERT_STATE_COLLECTION = "alert_state"
+
+_collection = None
+# tank_id -> (timestamp, metric, value, low, high) queued since the last flush
+_pending: Dict[int, List[tuple]] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+
+# ---- sinks -----------------------------------------------------------------
+
+class LogSink:
+    name = "log"
+
+    async def deliver(self, batch: List[dict]):
+        for alert in batch:
+            logger.warning("ALERT tank=%s %s %s value=%s", alert["tank_id"], alert["condition"],
+                           alert["state"], alert.get("value"))
+
+
+class WebhookSink:
+    name = "webhook"
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def _post(self, batch: List[dict]):
+        resp = requests.post(self.url, json={"alerts": batch}, timeout=ALERT_SINK_TIMEOUT_SECONDS)
+        resp.raise_for_status()
+
+    async def deliver(self, batch: List[dict]):
+        await asyncio.to_thread(self._post, batch)
+
+
+class WebSocketSink:
+    """Pushes batches to every connected /ws/alerts client; slow clients are dropped."""
+    name = "websocket"
+
+    def __init__(self):
+        self.clients = set()
+
+    async def deliver(self, batch: List[dict]):
+        if not self.clients:
+            return
+        message = json.dumps({"alerts": batch})
+
+        async def send(ws):
+            try:
+                await asyncio.wait_for(ws.send_text(message), timeout=ALERT_SINK_TIMEOUT_SECONDS)
+            except Exception:
+                self.clients.discard(ws)
+
+        await asyncio.gather(*(send(ws) for ws in list(self.clients)))
+
+
+class _SinkWorker:
+    """One sink's queue of batches and the task delivering them."""
+
+    def __init__(self, sink, queue_batches: int = ALERT_SINK_QUEUE_BATCHES):
+        self.sink = sink
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_batches)
+        self.task: Optional[asyncio.Task] = None
+        self.counters = {"delivered": 0, "retries": 0, "failed": 0, "dropped": 0}
+
+    def offer(self, batch: List[dict]):
+        try:
+            self.queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            self.counters["dropped"] += len(batch)
+
+    async def _attempt(self, batch: List[dict]) -> bool:
+        try:
+            await asyncio.wait_for(self.sink.deliver(batch), timeout=ALERT_SINK_TIMEOUT_SECONDS)
+            return True
+        except Exception as e:
+            logger.warning("Alert sink %s failed: %s", self.sink.name, str(e) or type(e).__name__)
+            return False
+
+    async def run(self):
+        while True:
+            batch = await self.queue.get()
+            delivered = await self._attempt(batch)
+            for attempt in range(ALERT_SINK_RETRIES):
+                if delivered:
+                    break
+                self.counters["retries"] += 1
+                await asyncio.sleep(ALERT_SINK_RETRY_SECONDS * 2 ** attempt)
+                delivered = await self._attempt(batch)
+            if delivered:
+                self.counters["delivered"] += len(batch)
+            else:
+                self.counters["failed"] += len(batch)
+                logger.error("Alert sink %s gave up on %d alert(s)", self.sink.name, len(batch))
+
+
+# ---- state machine ---------------------------------------------------------
+
+class _ConditionState:
+    __slots__ = ("firing", "last_sent", "last_seen", "suppressed")
+
+    def __init__(self):
+        self.firing = False
+        self.last_sent = 0.0
+        self.last_seen = 0.0
+        self.suppressed = 0
+
+    def to_doc(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "_ConditionState":
+        st = cls()
+        for name in cls.__slots__:
+            if name in doc:
+                setattr(st, name, doc[name])
+        return st
+
+
+def _event(tank_id, condition: str, state: str, value, threshold=None, suppressed: int = 0) -> dict:
+    return {
+        "tank_id": tank_id,
+        "condition": condition,
+        "state": state,
+        "value": value,
+        "threshold": threshold,
+        "suppressed": suppressed,
+        "at": datetime.utcnow().isoformat(),
+    }
+
+
+class _TankConditions:
+    """Condition states of one tank, and the events their transitions raised."""
+
+    __slots__ = ("tank_id", "states", "events", "suppressed")
+
+    def __init__(self, tank_id, states: Optional[Dict[str, _ConditionState]] = None):
+        self.tank_id = tank_id
+        self.states = states or {}
+        self.events: List[dict] = []
+        self.suppressed = 0
+
+    def to_doc(self) -> dict:
+        return {condition: st.to_doc() for condition, st in self.states.items()}
+
+    @classmethod
+    def from_doc(cls, tank_id, doc: dict) -> "_TankConditions":
+        return cls(tank_id, {condition: _ConditionState.from_doc(st) for condition, st in doc.items()})
+
+    def _state(self, condition: str) -> _ConditionState:
+        st = self.states.get(condition)
+        if st is None:
+            st = self.states[condition] = _ConditionState()
+        return st
+
+    def _emit(self, condition: str, state: str, value, threshold=None, suppressed: int = 0):
+        self.events.append(_event(self.tank_id, condition, state, value, threshold, suppressed))
+
+    def _raise(self, st: _ConditionState, condition, value, threshold, now):
+        if not st.firing:
+            st.firing = True
+            st.last_sent = now
+            st.suppressed = 0
+            self._emit(condition, "firing", value, threshold)
+        elif now - st.last_sent >= ALERT_COOLDOWN_SECONDS:
+            st.last_sent = now
+            self._emit(condition, "repeat", value, threshold, st.suppressed)
+            st.suppressed = 0
+        else:
+            st.suppressed += 1
+            self.suppressed += 1
+
+    def observe(self, metric: str, value: float, low: float, high: float, now: float):
+        condition = f"critical_{metric}"
+        st = self._state(condition)
+        if value < low or value > high:
+            self._raise(st, condition, value, low if value < low else high, now)
+        elif st.firing:
+            h = ALERT_HYSTERESIS.get(metric, 0.0)
+            if low + h <= value <= high - h:
+                st.firing = False
+                self._emit(condition, "resolved", value, None, st.suppressed)
+                st.suppressed = 0
+
+    def send(self, condition: str, value, now: float):
+        st = self._state(condition)
+        if st.firing and now - st.last_seen > ALERT_STALE_SECONDS:
+            st.firing = False  # not raised for a while; treat this as a new occurrence
+        st.last_seen = now
+        self._raise(st, condition, value, None, now)
+
+
+class AlertService:
+    def __init__(self, sinks=None, queue_size: int = ALERT_QUEUE_SIZE):
+        self.sinks = list(sinks or [])
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._workers: List[_SinkWorker] = []
+        self._tanks: Dict[int, _TankConditions] = {}
+        self.counters = {"raised": 0, "suppressed": 0, "dropped": 0, "dispatched": 0}
+
+    # -- producer side (sync, never blocks) --
+
+    def publish(self, conditions: _TankConditions):
+        """Queue the events raised on `conditions` and reset its tallies."""
+        self.counters["suppressed"] += conditions.suppressed
+        conditions.suppressed = 0
+        events, conditions.events = conditions.events, []
+        for event in events:
+            self.counters["raised"] += 1
+            if self._queue is None:
+                logger.warning("Alert dispatcher not running; dropping %s for tank %s",
+                               event["condition"], event["tank_id"])
+                self.counters["dropped"] += 1
+                continue
+            try:
+                self._queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.counters["dropped"] += 1
+
+    def _conditions(self, tank_id) -> _TankConditions:
+        conditions = self._tanks.get(tank_id)
+        if conditions is None:
+            conditions = self._tanks[tank_id] = _TankConditions(tank_id)
+        return conditions
+
+    def observe(self, tank_id, metric: str, value: float, low: float, high: float,
+                now: Optional[float] = None):
+        """Evaluate one reading of `metric` against its critical [low, high] range."""
+        conditions = self._conditions(tank_id)
+        conditions.observe(metric, value, low, high, time.time() if now is None else now)
+        self.publish(conditions)
+
+    def send_alert(self, tank_id, condition: str, value):
+        """Legacy interface used by RuntimeAdjustmentController; deduplicated and non-blocking."""
+        conditions = self._conditions(tank_id)
+        conditions.send(condition, value, time.time())
+        self.publish(conditions)
+
+    # -- dispatcher --
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._workers = [_SinkWorker(sink) for sink in self.sinks]
+            for worker in self._workers:
+                worker.task = asyncio.create_task(worker.run())
+            self._task = asyncio.create_task(self._dispatch_loop())
+
+    async def stop(self):
+        if self._task:
+            pending = {self._task, *(w.task for w in self._workers)}
+            while pending:
+                # before 3.12, asyncio.wait_for drops a cancel that races a
+                # delivery finishing; cancel again until every task is done
+                for task in pending:
+                    task.cancel()
+                _, pending = await asyncio.wait(pending, timeout=1.0)
+            self._task = None
+            self._queue = None
+            self._workers = []
+
+    async def _next_batch(self) -> List[dict]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + ALERT_BATCH_WINDOW_SECONDS
+        while len(batch) < ALERT_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _dispatch_loop(self):
+        while True:
+            batch = await self._next_batch()
+            for worker in self._workers:
+                worker.offer(batch)
+            self.counters["dispatched"] += len(batch)
+
+    def status(self, firing: Optional[List[dict]] = None) -> dict:
+        """Pipeline counters; `firing` defaults to the conditions tracked in this process."""
+        if firing is None:
+            firing = [
+                {"tank_id": t, "condition": c, "suppressed": st.suppressed}
+                for t, conditions in self._tanks.items() for c, st in conditions.states.items() if st.firing
+            ]
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "firing": firing,
+            **self.counters,
+            "sinks": {
+                w.sink.name: {"queued_batches": w.queue.qsize(), **w.counters} for w in self._workers
+            },
+        }
+
+
+def critical_ranges(target: Dict[str, Tuple[float, float]]) -> Dict[str, Tuple[float, float]]:
+    """Widen target ranges (see tank_stats.target_ranges) by the critical margins."""
+    return {
+        metric: (lo - ALERT_CRITICAL_MARGIN.get(metric, 0.0), hi + ALERT_CRITICAL_MARGIN.get(metric, 0.0))
+        for metric, (lo, hi) in target.items()
+    }
+
+
+def evaluate_reading(doc: dict, critical: Dict[str, Tuple[float, float]]):
+    """Check one accepted reading; with shared state it is evaluated on the next flush."""
+    for metric, (lo, hi) in critical.items():
+        if doc.get(metric) is None:
+            continue
+        if _collection is None:
+            alert_service.observe(doc["tank_id"], metric, float(doc[metric]), lo, hi)
+        else:
+            _pending.setdefault(doc["tank_id"], []).append(
+                (_naive_utc(doc["timestamp"]), metric, float(doc[metric]), lo, hi)
+            )
+
+
+def _naive_utc(ts: datetime) -> datetime:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+# ---- shared state ------------------------------------------------------------
+
+async def _store(tank_id, version: int, conditions: _TankConditions) -> bool:
+    """Write a tank's condition states if nobody else did since `version` was read."""
+    state = {"version": version + 1, "conditions": conditions.to_doc()}
+    if version == 0:
+        try:
+            await _collection.insert_one({"_id": tank_id, **state})
+            return True
+        except DuplicateKeyError:
+            return False
+    res = await _collection.replace_one({"_id": tank_id, "version": version}, state)
+    return res.matched_count == 1
+
+
+async def _apply(tank_id, readings: List[tuple]):
+    for _ in range(ALERT_STATE_RETRIES):
+        doc = await _collection.find_one({"_id": tank_id})
+        conditions = _TankConditions.from_doc(tank_id, doc["conditions"] if doc else {})
+        now = time.time()
+        for _ts, metric, value, lo, hi in readings:
+            conditions.observe(metric, value, lo, hi, now)
+        if await _store(tank_id, doc["version"] if doc else 0, conditions):
+            # only the worker whose transition was stored sends its events
+            alert_service.publish(conditions)
+            return
+    raise RuntimeError("alert state kept changing concurrently")
+
+
+async def flush():
+    """Evaluate the readings queued since the last flush against the shared state."""
+    global _pending
+    pending, _pending = _pending, {}
+    for tank_id, readings in pending.items():
+        readings.sort(key=lambda r: r[0])
+        try:
+            await _apply(tank_id, readings)
+        except Exception as e:
+            logger.warning("Failed to evaluate alerts for tank %s: %s", tank_id, str(e) or type(e).__name__)
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(ALERT_FLUSH_SECONDS)
+        await flush()
+
+
+async def status() -> dict:
+    """Pipeline counters of this process, with firing conditions from the shared state."""
+    firing = None
+    if _collection is not None:
+        firing = [
+            {"tank_id": doc["_id"], "condition": condition, "suppressed": st.get("suppressed", 0)}
+            async for doc in _collection.find({})
+            for condition, st in doc.get("conditions", {}).items() if st.get("firing")
+        ]
+    return alert_service.status(firing)
+
+
+websocket_sink = WebSocketSink()
+alert_service = AlertService([LogSink(), websocket_sink])
+if ALERT_WEBHOOK_URL:
+    alert_service.sinks.append(WebhookSink(ALERT_WEBHOOK_URL))
+
+
+async def initialize(db=None):
+    """Start dispatching; with `db`, condition state is shared by every worker through it."""
+    global _collection, _flush_task
+    await alert_service.start()
+    if db is not None:
+        _collection = db[ALERT_STATE_COLLECTION]
+        if _flush_task is None:
+            _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def cleanup():
+    global _collection, _flush_task
+    if _flush_task:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    if _collection is not None:
+        await flush()
+    _collection = None
+    await alert_service.stop()
@@ -0,0 +1,227 @@
+# Compact binary ingest formats for constrained sensor nodes.
+#
+# Two encodings are accepted on POST /api/readings/binary:
+#
+#   * packed struct (Content-Type: application/octet-stream)
+#       The body is one or more frames. Each frame is a 5 byte header
+#       (magic b"RB", version u8, count u16) followed by `count` records of
+#       11 bytes each, little endian:
+#           tank_id   u16
+#           timestamp u32   seconds since the unix epoch (UTC)
+#           temp      i16   degrees Celsius * 100
+#           humidity  i16   percent * 100
+#           flags     u8    bit 0 = light
+#
+#   * MessagePack (Content-Type: application/msgpack)
+#       An array of readings, each either the same five fields as an array
+#       [tank_id, timestamp, temp, humidity, light] (temp/humidity scaled by
+#       100) or a map using the JSON field names (id, temp, humidity, light,
+#       timestamp) with unscaled values.
+#
+# Either body may be gzip compressed (Content-Encoding: gzip).
+import gzip
+import logging
+import struct
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+    logging.warning("msgpack module not available - MessagePack ingest disabled")
+
+logger = logging.getLogger("binary-ingest")
+
+FRAME_MAGIC = b"RB"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<2sBH")
+RECORD = struct.Struct("<HIhhB")
+VALUE_SCALE = 100.0
+LIGHT_BIT = 0x01
+
+# Hard caps so a bad or hostile body can't exhaust memory
+MAX_BODY_BYTES = 4 * 1024 * 1024
+MAX_READINGS_PER_REQUEST = 50000
+
+PACKED_CONTENT_TYPES = ("application/octet-stream", "application/x-reading-frames")
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+class UnsupportedMediaType(ValueError):
+    """The Content-Type or Content-Encoding isn't one this endpoint accepts."""
+
+
+class BodyTooLarge(ValueError):
+    """The body, as sent or once inflated, is over MAX_BODY_BYTES."""
+
+
+def check_length(content_length: Optional[str]):
+    """Refuse a declared Content-Length over the cap before reading anything."""
+    if content_length is None:
+        return
+    try:
+        length = int(content_length)
+    except ValueError:
+        raise ValueError(f"Invalid Content-Length '{content_length}'")
+    if length > MAX_BODY_BYTES:
+        raise BodyTooLarge("Request body exceeds size limit")
+
+
+async def read_capped(chunks: AsyncIterator[bytes]) -> bytes:
+    """Collect a streamed body, giving up as soon as it passes MAX_BODY_BYTES."""
+    body = bytearray()
+    async for chunk in chunks:
+        body += chunk
+        if len(body) > MAX_BODY_BYTES:
+            raise BodyTooLarge("Request body exceeds size limit")
+    return bytes(body)
+
+
+def decompress_body(body: bytes, content_encoding: str = "") -> bytes:
+    """Undo Content-Encoding: gzip, refusing bodies that inflate past MAX_BODY_BYTES."""
+    if not content_encoding or content_encoding.lower() == "identity":
+        return body
+    if content_encoding.lower() not in ("gzip", "x-gzip"):
+        raise UnsupportedMediaType(f"Unsupported Content-Encoding '{content_encoding}'")
+    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        out = decomp.decompress(body, MAX_BODY_BYTES + 1)
+    except zlib.error as e:
+        raise ValueError(f"Invalid gzip body: {e}") from e
+    if len(out) > MAX_BODY_BYTES or decomp.unconsumed_tail:
+        raise BodyTooLarge("Decompressed body exceeds size limit")
+    return out
+
+
+def encode_frame(readings: List[dict]) -> bytes:
+    """Encode readings as a single packed frame (used by tests and the simulator)."""
+    if len(readings) > 0xFFFF:
+        raise ValueError("A frame holds at most 65535 readings")
+    parts = [FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, len(readings))]
+    for r in readings:
+        ts = r.get("timestamp") or datetime.now(timezone.utc)
+        if isinstance(ts, datetime):
+            if ts.tzinfo is None:
+                ts = ts.replace(tzinfo=timezone.utc)
+            ts = int(ts.timestamp())
+        parts.append(RECORD.pack(
+            int(r["id"]),
+            int(ts),
+            int(round(r["temp"] * VALUE_SCALE)),
+            int(round(r["humidity"] * VALUE_SCALE)),
+            LIGHT_BIT if r["light"] else 0,
+        ))
+    return b"".join(parts)
+
+
+def gzip_body(body: bytes) -> bytes:
+    return gzip.compress(body)
+
+
+def _ts(seconds) -> datetime:
+    # Reading.timestamp is stored as naive UTC elsewhere in the API
+    try:
+        return datetime.fromtimestamp(int(seconds), tz=timezone.utc).replace(tzinfo=None)
+    except (OverflowError, OSError, ValueError) as e:
+        raise ValueError(f"Timestamp {seconds!r} is out of range") from e
+
+
+def decode_frames(body: bytes) -> List[dict]:
+    """Decode one or more concatenated packed frames into reading dicts."""
+    view = memoryview(body)
+    offset = 0
+    readings: List[dict] = []
+    while offset < len(view):
+        if len(view) - offset < FRAME_HEADER.size:
+            raise ValueError(f"Truncated frame header at byte {offset}")
+        magic, version, count = FRAME_HEADER.unpack_from(view, offset)
+        if magic != FRAME_MAGIC:
+            raise ValueError(f"Bad frame magic at byte {offset}")
+        if version != FRAME_VERSION:
+            raise ValueError(f"Unsupported frame version {version}")
+        offset += FRAME_HEADER.size
+        end = offset + count * RECORD.size
+        if end > len(view):
+            raise ValueError(f"Frame at byte {offset - FRAME_HEADER.size} is truncated")
+        if len(readings) + count > MAX_READINGS_PER_REQUEST:
+            raise ValueError("Too many readings in one request")
+        # iter_unpack decodes the whole frame in one pass over the buffer
+        readings.extend(
+            {
+                "id": tank_id,
+                "timestamp": _ts(ts),
+                "temp": temp / VALUE_SCALE,
+                "humidity": humidity / VALUE_SCALE,
+                "light": bool(flags & LIGHT_BIT),
+            }
+            for tank_id, ts, temp, humidity, flags in RECORD.iter_unpack(view[offset:end])
+        )
+        offset = end
+    return readings
+
+
+def decode_msgpack(body: bytes) -> List[dict]:
+    """Decode a MessagePack array of readings (arrays or maps) into reading dicts."""
+    if not MSGPACK_AVAILABLE:
+        raise RuntimeError("msgpack module not available")
+    try:
+        items = msgpack.unpackb(body, raw=False, strict_map_key=False)
+    except Exception as e:
+        raise ValueError(f"Invalid MessagePack body: {e}") from e
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list):
+        raise ValueError("MessagePack body must be an array of readings")
+    if len(items) > MAX_READINGS_PER_REQUEST:
+        raise ValueError("Too many readings in one request")
+
+    readings: List[dict] = []
+    for i, item in enumerate(items):
+        try:
+            readings.append(_msgpack_reading(item))
+        except (TypeError, ValueError) as e:
+            # client data: None/strings where numbers belong, bad timestamps
+            raise ValueError(f"Reading {i}: {e}") from e
+    return readings
+
+
+def _msgpack_reading(item) -> dict:
+    if isinstance(item, (list, tuple)):
+        if len(item) != 5:
+            raise ValueError("must have 5 fields")
+        tank_id, ts, temp, humidity, light = item
+        return {
+            "id": tank_id,
+            "timestamp": _ts(ts),
+            "temp": temp / VALUE_SCALE,
+            "humidity": humidity / VALUE_SCALE,
+            "light": bool(light),
+        }
+    if isinstance(item, dict):
+        reading = dict(item)
+        ts = reading.get("timestamp")
+        if isinstance(ts, (int, float)):
+            reading["timestamp"] = _ts(ts)
+        return reading
+    raise ValueError("must be an array or a map")
+
+
+def decode_body(body: bytes, content_type: str, content_encoding: str = "") -> List[dict]:
+    """Decode a request body according to its content type and encoding.
+
+    Raises ValueError for malformed bodies, UnsupportedMediaType (a
+    ValueError) for content types/encodings that aren't accepted and
+    RuntimeError when the requested codec isn't installed.
+    """
+    if len(body) > MAX_BODY_BYTES:
+        raise BodyTooLarge("Request body exceeds size limit")
+    body = decompress_body(body, content_encoding)
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in MSGPACK_CONTENT_TYPES:
+        return decode_msgpack(body)
+    if media_type in PACKED_CONTENT_TYPES or not media_type:
+        return decode_frames(body)
+    raise UnsupportedMediaType(f"Unsupported Content-Type '{content_type}'")
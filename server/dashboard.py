@@ -0,0 +1,244 @@
+# Aggregate state for the dashboard, served from memory in one response.
+#
+# Every tank's latest reading, outlet states, species targets and in-range
+# status in one body. The latest reading per tank and the last known state
+# of each outlet are shared between processes through the small
+# `dashboard_state` collection: ingest (any API worker) and outlet commands
+# (any worker or the standalone poller) are coalesced in memory and written
+# there by a background flush every DASHBOARD_FLUSH_SECONDS, which bumps
+# the "dashboard" invalidation counter once per flush rather than once per
+# reading. Each process reloads the collection once per change, so a poll
+# touches neither MongoDB nor the powerstrips.
+#
+# The data version is the sum of the shared "dashboard", "species_profiles"
+# and "powerstrip_registry" counters, so it is the same on every worker and
+# moves whenever any input changes. The rendered body is cached per version
+# and carries it as the ETag; polls sending If-None-Match get a bodiless 304
+# from whichever worker answers.
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from server import invalidation
+from server import powerstrip_interface
+from server import scheduler
+from server import sensor_interface
+from server import tank_stats
+
+logger = logging.getLogger("dashboard")
+
+DASHBOARD_FLUSH_SECONDS = float(os.getenv("DASHBOARD_FLUSH_SECONDS", "1"))
+
+STATE_COLLECTION = "dashboard_state"
+_VERSION_NAMES = ("dashboard", "species_profiles", "powerstrip_registry")
+
+_collection = None
+# shared state as of the last reload
+_latest: Dict[int, dict] = {}
+_outlets: Dict[Tuple[Optional[str], int], Optional[bool]] = {}
+_stale = True
+# (data version, body) of the last rendered response
+_rendered: Optional[Tuple[int, bytes]] = None
+# changes observed in this process since the last flush
+_pending_latest: Dict[int, dict] = {}
+_pending_outlets: Dict[Tuple[Optional[str], int], Optional[bool]] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+
+def _invalidate():
+    global _stale
+    _stale = True
+
+
+def initialize(db):
+    """Share dashboard state through `db`; also needed in the standalone poller."""
+    global _collection, _flush_task
+    _collection = db[STATE_COLLECTION]
+    _invalidate()
+    for name in _VERSION_NAMES:
+        invalidation.register(name, _invalidate)
+    if _outlet_changed not in powerstrip_interface.state_listeners:
+        powerstrip_interface.state_listeners.append(_outlet_changed)
+    if _flush_task is None:
+        _flush_task = asyncio.get_running_loop().create_task(_flush_loop())
+
+
+async def cleanup():
+    global _collection, _flush_task
+    for name in _VERSION_NAMES:
+        invalidation.unregister(name, _invalidate)
+    if _outlet_changed in powerstrip_interface.state_listeners:
+        powerstrip_interface.state_listeners.remove(_outlet_changed)
+    if _flush_task:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    if _collection is not None:
+        await flush()
+    _collection = None
+
+
+def data_version() -> int:
+    """Version of everything the dashboard shows, identical across processes."""
+    return sum(invalidation.version(name) for name in _VERSION_NAMES)
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def not_modified(if_none_match: Optional[str]) -> bool:
+    """Evaluate If-None-Match against the current data version."""
+    if not if_none_match:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return "*" in tags or etag(data_version()) in tags
+
+
+# ---- writers -------------------------------------------------------------------
+
+def observe(docs: List[dict]):
+    """Note the newest reading per tank out of a batch of accepted readings."""
+    if _collection is None:
+        return
+    for doc in docs:
+        reading = {
+            "temp": doc.get("temp"),
+            "humidity": doc.get("humidity"),
+            "light": doc.get("light"),
+            "timestamp": tank_stats._naive_utc(doc["timestamp"]),
+        }
+        current = _pending_latest.get(doc["tank_id"])
+        if current is None or reading["timestamp"] >= current["timestamp"]:
+            _pending_latest[doc["tank_id"]] = reading
+
+
+def _outlet_changed(device_id: Optional[str], index: int, state: Optional[bool]):
+    # called synchronously by powerstrip_interface.remember_state
+    if _collection is not None:
+        _pending_outlets[(device_id, index)] = state
+
+
+async def flush():
+    """Publish the changes observed since the last flush, then bump the version once."""
+    if _collection is None or not (_pending_latest or _pending_outlets):
+        return
+    latest = dict(_pending_latest)
+    outlets = dict(_pending_outlets)
+    _pending_latest.clear()
+    _pending_outlets.clear()
+    changed = False
+    for tank_id, reading in latest.items():
+        known = _latest.get(tank_id)
+        if known is not None and known["timestamp"] > reading["timestamp"]:
+            continue
+        try:
+            # only replaces an older reading; a newer one makes the upsert collide
+            await _collection.update_one(
+                {"_id": f"latest:{tank_id}", "reading.timestamp": {"$not": {"$gt": reading["timestamp"]}}},
+                {"$set": {"kind": "latest", "tank_id": tank_id, "reading": reading}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            continue
+        except Exception as e:
+            logger.warning("Failed to publish latest reading of tank %s: %s", tank_id, str(e))
+            continue
+        changed = True
+    for (device_id, index), state in outlets.items():
+        try:
+            await _collection.update_one(
+                {"_id": f"outlet:{device_id or ''}:{index}"},
+                {"$set": {"kind": "outlet", "device_id": device_id, "outlet": index, "state": state}},
+                upsert=True,
+            )
+        except Exception as e:
+            logger.warning("Failed to publish outlet state: %s", str(e))
+            continue
+        changed = True
+    if changed:
+        await invalidation.bump("dashboard")
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(DASHBOARD_FLUSH_SECONDS)
+        try:
+            await flush()
+        except Exception as e:
+            logger.warning("Dashboard flush failed: %s", str(e))
+
+
+# ---- rendering -----------------------------------------------------------------
+
+async def _reload():
+    global _stale, _latest, _outlets
+    _stale = False
+    try:
+        docs = await _collection.find({}).to_list(length=None)
+    except Exception:
+        _stale = True
+        raise
+    _latest = {d["tank_id"]: d["reading"] for d in docs if d.get("kind") == "latest"}
+    _outlets = {(d["device_id"], d["outlet"]): d["state"] for d in docs if d.get("kind") == "outlet"}
+
+
+async def _tank_entry(tank_id: int) -> dict:
+    profile = await tank_stats.profile_for_tank(tank_id)
+    reading = _latest.get(tank_id)
+    targets = tank_stats.target_ranges(profile) if profile else None
+    in_range = None
+    if targets and reading:
+        in_range = {
+            metric: lo <= reading[metric] <= hi
+            for metric, (lo, hi) in targets.items() if reading.get(metric) is not None
+        }
+    outlets = [
+        {"role": role, "device_id": device_id, "outlet": index, "state": _outlets.get((device_id, index))}
+        for role, (device_id, index) in sorted(scheduler.outlets_for_tank(tank_id).items())
+    ]
+    return {
+        "tank_id": tank_id,
+        "species": profile["species_name"] if profile else tank_stats.species_for_tank(tank_id),
+        "latest": reading,
+        "targets": {metric: list(bounds) for metric, bounds in targets.items()} if targets else None,
+        "in_range": in_range,
+        "outlets": outlets,
+    }
+
+
+def _tank_ids() -> List[int]:
+    return sorted(set(sensor_interface.TANKS) | set(_latest) | set(scheduler.scheduled_tanks()))
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def render() -> Tuple[int, bytes]:
+    """(version, body) for the current data, rendered at most once per version."""
+    global _rendered
+    version = data_version()
+    if _rendered is not None and _rendered[0] == version and not _stale:
+        return _rendered
+    if _stale and _collection is not None:
+        try:
+            await _reload()
+        except Exception as e:
+            logger.warning("Failed to reload dashboard state: %s", str(e))
+    tanks = await asyncio.gather(*(_tank_entry(t) for t in _tank_ids()))
+    body = json.dumps({"version": version, "tanks": tanks}, default=_json_default).encode()
+    # something may have changed while rendering; only cache if nothing moved
+    if data_version() == version and not _stale:
+        _rendered = (version, body)
+    return version, body
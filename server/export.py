@@ -0,0 +1,290 @@
+# Streaming export of sensor reading history.
+#
+# Readings are pulled from a Motor cursor in fixed-size batches and encoded
+# one batch at a time, so an export never holds more than EXPORT_BATCH_SIZE
+# documents in memory regardless of how much history is requested.
+# Days already expired by retention are read back from the archive one
+# day at a time and merged in timestamp order with the live readings.
+import csv
+import heapq
+import io
+import json
+import logging
+import os
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List, Optional
+
+from server import retention
+
+# pyarrow is heavy to import, so it's loaded on the first parquet export
+pa = None
+pq = None
+PYARROW_AVAILABLE = None  # unknown until _load_pyarrow() has run
+
+
+def _load_pyarrow() -> bool:
+    global pa, pq, PYARROW_AVAILABLE
+    if PYARROW_AVAILABLE is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+            pa, pq = pyarrow, pyarrow.parquet
+            PYARROW_AVAILABLE = True
+        except ImportError:
+            PYARROW_AVAILABLE = False
+            logging.warning("pyarrow module not available - parquet export disabled")
+    return PYARROW_AVAILABLE
+
+
+logger = logging.getLogger("export")
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+EXPORT_FIELDS = ("tank_id", "timestamp", "temp", "humidity", "light")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def readings_query(tank_ids: Iterable[int], since: Optional[datetime] = None,
+                   until: Optional[datetime] = None) -> dict:
+    """Build the Mongo filter for a set of tanks and an optional time range."""
+    tank_ids = list(tank_ids)
+    query: dict = {"tank_id": tank_ids[0] if len(tank_ids) == 1 else {"$in": tank_ids}}
+    if since or until:
+        ts = {}
+        if since:
+            ts["$gte"] = since
+        if until:
+            ts["$lt"] = until
+        query["timestamp"] = ts
+    return query
+
+
+async def iter_batches(collection, query: dict,
+                       batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    """Yield lists of at most `batch_size` reading documents in timestamp order."""
+    projection = {"_id": 0, **{f: 1 for f in EXPORT_FIELDS}}
+    cursor = collection.find(query, projection).sort("timestamp", 1).batch_size(batch_size)
+    batch: List[dict] = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _project(batches: AsyncIterator[List[dict]]) -> AsyncIterator[List[dict]]:
+    async for batch in batches:
+        yield [{f: doc[f] for f in EXPORT_FIELDS if f in doc} for doc in batch]
+
+
+async def _docs(batches: AsyncIterator[List[dict]]) -> AsyncIterator[dict]:
+    async for batch in batches:
+        for doc in batch:
+            yield doc
+
+
+async def merge_batches(streams: List[AsyncIterator[List[dict]]],
+                        batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    """Merge timestamp-ordered batch streams into one, re-batched to `batch_size`."""
+    docs = [_docs(s) for s in streams]
+    heap = []
+    for i, it in enumerate(docs):
+        doc = await anext(it, None)
+        if doc is not None:
+            heap.append((doc["timestamp"], i, doc))
+    heapq.heapify(heap)
+    batch: List[dict] = []
+    while heap:
+        _, i, doc = heapq.heappop(heap)
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+        nxt = await anext(docs[i], None)
+        if nxt is not None:
+            heapq.heappush(heap, (nxt["timestamp"], i, nxt))
+    if batch:
+        yield batch
+
+
+# fields a history query may select; tank_id and timestamp are always returned
+HISTORY_FIELDS = EXPORT_FIELDS + ("reading_id",)
+HISTORY_GROUPINGS = ("tank", "time")
+
+
+def history_projection(fields: Optional[str]) -> dict:
+    """Projection for a comma-separated `fields` list (all history fields when empty)."""
+    selected = [f.strip() for f in (fields or "").split(",") if f.strip()] or list(HISTORY_FIELDS)
+    unknown = [f for f in selected if f not in HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s) {', '.join(unknown)}; choose from {', '.join(HISTORY_FIELDS)}")
+    return {"_id": 0, "tank_id": 1, "timestamp": 1, **{f: 1 for f in selected}}
+
+
+async def query_history(collection, tank_ids: List[int], since: Optional[datetime] = None,
+                        until: Optional[datetime] = None, fields: Optional[str] = None,
+                        group: str = "tank", archived: Optional[dict] = None) -> dict:
+    """History of several tanks from one query.
+
+    The $in + time range filter is answered from the (tank_id, timestamp)
+    index: grouped results read it in index order, time-merged results let
+    the server merge the per-tank index ranges by timestamp. `archived`
+    (tank_id -> readings already expired to the archive) is merged in front.
+    """
+    if group not in HISTORY_GROUPINGS:
+        raise ValueError(f"group must be one of {', '.join(HISTORY_GROUPINGS)}")
+    projection = history_projection(fields)
+    sort = [("timestamp", 1)] if group == "time" else [("tank_id", 1), ("timestamp", 1)]
+    docs = await collection.find(readings_query(tank_ids, since, until), projection).sort(sort).to_list(length=None)
+    archived = {
+        tank_id: [{k: d[k] for k in projection if k in d} for d in rows]
+        for tank_id, rows in (archived or {}).items() if rows
+    }
+
+    if group == "time":
+        if archived:
+            docs = list(heapq.merge(*archived.values(), docs, key=lambda d: d["timestamp"]))
+        return {"tank_ids": tank_ids, "readings": docs, "count": len(docs)}
+
+    per_tank = {tank_id: list(archived.get(tank_id, [])) for tank_id in tank_ids}
+    for doc in docs:
+        per_tank[doc["tank_id"]].append(doc)
+    return {
+        "tank_ids": tank_ids,
+        "tanks": [{"tank_id": t, "readings": rows, "count": len(rows)} for t, rows in per_tank.items()],
+        "count": len(docs) + sum(len(rows) for rows in archived.values()),
+    }
+
+
+def shape_history(tank_ids: List[int], per_tank: dict, fields: Optional[str] = None,
+                  group: str = "tank") -> dict:
+    """The query_history response built from readings already fetched per tank, oldest first."""
+    if group not in HISTORY_GROUPINGS:
+        raise ValueError(f"group must be one of {', '.join(HISTORY_GROUPINGS)}")
+    keys = [k for k in history_projection(fields) if k != "_id"]
+    per_tank = {t: [{k: d[k] for k in keys if k in d} for d in per_tank.get(t, [])] for t in tank_ids}
+    if group == "time":
+        docs = list(heapq.merge(*per_tank.values(), key=lambda d: d["timestamp"]))
+        return {"tank_ids": tank_ids, "readings": docs, "count": len(docs)}
+    return {
+        "tank_ids": tank_ids,
+        "tanks": [{"tank_id": t, "readings": rows, "count": len(rows)} for t, rows in per_tank.items()],
+        "count": sum(len(rows) for rows in per_tank.values()),
+    }
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def encode_ndjson(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield "".join(json.dumps(doc, default=_json_default) + "\n" for doc in batch).encode()
+
+
+async def encode_csv(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    async for batch in batches:
+        for doc in batch:
+            ts = doc.get("timestamp")
+            if isinstance(ts, datetime):
+                doc["timestamp"] = ts.isoformat()
+            writer.writerow(doc)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose contents are drained after each row group."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = b"".join(self._chunks)
+        self._chunks.clear()
+        return out
+
+
+def _parquet_schema():
+    return pa.schema([
+        ("tank_id", pa.int64()),
+        ("timestamp", pa.timestamp("ms")),
+        ("temp", pa.float64()),
+        ("humidity", pa.float64()),
+        ("light", pa.bool_()),
+    ])
+
+
+async def encode_parquet(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    """Write each batch as its own row group and flush the bytes downstream."""
+    if not _load_pyarrow():
+        raise RuntimeError("pyarrow module not available")
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        async for batch in batches:
+            columns = {f: [doc.get(f) for doc in batch] for f in EXPORT_FIELDS}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    tail = sink.drain()
+    if tail:
+        yield tail
+
+
+ENCODERS = {
+    "ndjson": encode_ndjson,
+    "csv": encode_csv,
+    "parquet": encode_parquet,
+}
+
+
+def stream_export(collection, tank_ids: Iterable[int], fmt: str,
+                  since: Optional[datetime] = None,
+                  until: Optional[datetime] = None) -> AsyncIterator[bytes]:
+    """Return an async byte iterator for the requested export.
+
+    Raises ValueError for an unknown format and RuntimeError when the
+    encoder's optional dependency is missing.
+    """
+    if fmt not in ENCODERS:
+        raise ValueError(f"format must be one of {', '.join(ENCODERS)}")
+    if fmt == "parquet" and not _load_pyarrow():
+        raise RuntimeError("pyarrow module not available")
+    tank_ids = list(tank_ids)
+    batches = iter_batches(collection, readings_query(tank_ids, since, until))
+    if retention.RETENTION_ARCHIVE_DIR:
+        # expired days are only in the archive
+        batches = merge_batches([_project(retention.iter_archive(tank_ids, since, until)), batches])
+    return ENCODERS[fmt](batches)
@@ -0,0 +1,241 @@
+# In-memory cache for reading history and rollup queries.
+#
+# A requested range is split into fixed, epoch-aligned buckets per tank.
+# Buckets that ended more than HISTORY_CACHE_SETTLE_SECONDS ago are closed:
+# they are fetched once (contiguous misses in one query), kept until evicted
+# by the LRU byte budget, and sliced to the requested range on the way out.
+# Only the part after the last closed bucket is read live; for several
+# tanks, both are read for all of them with one $in query. Rollup buckets
+# additionally count as closed only once the retention job has rolled up
+# all their days.
+#
+# Past data can still change: spooled readings replayed after an outage,
+# the backfill tool, or expiry without an archive. Those bump the
+# "history_cache" invalidation counter and every worker drops its cache;
+# a fetch that straddles a drop isn't stored.
+import asyncio
+import logging
+import os
+import sys
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from server import export
+from server import invalidation
+from server import retention
+from server import tank_stats
+
+logger = logging.getLogger("history-cache")
+
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+HISTORY_CACHE_BUCKET_HOURS = int(os.getenv("HISTORY_CACHE_BUCKET_HOURS", "24"))
+HISTORY_CACHE_SETTLE_SECONDS = int(os.getenv("HISTORY_CACHE_SETTLE_SECONDS", "300"))
+
+# kind -> (bucket size, timestamp field of its documents)
+BUCKETS = {
+    "readings": (timedelta(hours=HISTORY_CACHE_BUCKET_HOURS), "timestamp"),
+    "hourly": (timedelta(days=1), "bucket"),
+    "daily": (timedelta(days=30), "bucket"),
+}
+
+_EPOCH = datetime(1970, 1, 1)
+
+Fetch = Callable[[datetime, Optional[datetime]], Awaitable[List[dict]]]
+FetchMany = Callable[[List[int], datetime, Optional[datetime]], Awaitable[List[dict]]]
+
+# (kind, tank_id, bucket start) -> (docs, estimated bytes), least recently used first
+_entries: "OrderedDict[Tuple[str, int, datetime], Tuple[List[dict], int]]" = OrderedDict()
+_bytes = 0
+_generation = 0
+counters = {"hits": 0, "misses": 0, "live": 0, "evictions": 0, "invalidations": 0}
+
+
+def clear():
+    global _bytes, _generation
+    _entries.clear()
+    _bytes = 0
+    _generation += 1
+    counters["invalidations"] += 1
+
+
+def initialize():
+    invalidation.register("history_cache", clear)
+
+
+def cleanup():
+    invalidation.unregister("history_cache", clear)
+    clear()
+
+
+def _floor(ts: datetime, size: timedelta) -> datetime:
+    return _EPOCH + ((ts - _EPOCH) // size) * size
+
+
+def _doc_bytes(doc: dict) -> int:
+    return sys.getsizeof(doc) + sum(sys.getsizeof(v) for v in doc.values())
+
+
+def _store(key, docs: List[dict]):
+    global _bytes
+    size = sum(_doc_bytes(d) for d in docs) + 200
+    if size > HISTORY_CACHE_MAX_BYTES:
+        return
+    # concurrent misses for the same bucket both store it; replace, don't add
+    old = _entries.pop(key, None)
+    if old is not None:
+        _bytes -= old[1]
+    _entries[key] = (docs, size)
+    _bytes += size
+    while _bytes > HISTORY_CACHE_MAX_BYTES and _entries:
+        _, (_, evicted) = _entries.popitem(last=False)
+        _bytes -= evicted
+        counters["evictions"] += 1
+
+
+def _closed_horizon(kind: str, rolled_through: Optional[datetime]) -> Optional[datetime]:
+    horizon = datetime.utcnow() - timedelta(seconds=HISTORY_CACHE_SETTLE_SECONDS)
+    if kind != "readings":
+        if rolled_through is None:
+            return None
+        horizon = min(horizon, rolled_through + timedelta(days=1))
+    return horizon
+
+
+async def cached_ranges(kind: str, tank_ids: List[int], since: datetime, until: Optional[datetime],
+                        fetch: FetchMany, rolled_through: Optional[datetime] = None) -> Dict[int, List[dict]]:
+    """Documents of several tanks in [since, until), closed buckets from memory.
+
+    `fetch(tank_ids, start, end)` reads [start, end) of those tanks from the
+    store in one query (end None: up to now), oldest first. Each contiguous
+    run of buckets missing for any tank and the live tail are fetched once
+    for all the tanks that need them.
+    """
+    size, field = BUCKETS[kind]
+    since = tank_stats._naive_utc(since)
+    until = tank_stats._naive_utc(until) if until else None
+    horizon = _closed_horizon(kind, rolled_through)
+    buckets = []
+    if horizon is not None:
+        b = _floor(since, size)
+        while b + size <= horizon and (until is None or b < until):
+            buckets.append(b)
+            b += size
+
+    generation = _generation
+    found: Dict[int, Dict[datetime, List[dict]]] = {t: {} for t in tank_ids}
+    # bucket start -> tanks that don't have it cached
+    missing: Dict[datetime, List[int]] = {}
+    for t in tank_ids:
+        for b in buckets:
+            entry = _entries.get((kind, t, b))
+            if entry is None:
+                missing.setdefault(b, []).append(t)
+            else:
+                _entries.move_to_end((kind, t, b))
+                found[t][b] = entry[0]
+    counters["hits"] += sum(len(f) for f in found.values())
+    counters["misses"] += sum(len(ts) for ts in missing.values())
+
+    # fetch each contiguous run of missing buckets with one query
+    runs = []
+    for b in sorted(missing):
+        if runs and runs[-1][1] == b:
+            runs[-1][1] = b + size
+            runs[-1][2].update(missing[b])
+        else:
+            runs.append([b, b + size, set(missing[b])])
+    for start, end, run_tanks in runs:
+        docs = await fetch(sorted(run_tanks), start, end)
+        per_bucket: Dict[Tuple[int, datetime], List[dict]] = {
+            (t, b): [] for b in missing if start <= b < end for t in missing[b]
+        }
+        for doc in docs:
+            bucket_docs = per_bucket.get((doc["tank_id"], _floor(doc[field], size)))
+            if bucket_docs is not None:  # else already cached for that tank
+                bucket_docs.append(doc)
+        for (t, b), bucket_docs in per_bucket.items():
+            found[t][b] = bucket_docs
+            if generation == _generation:
+                _store((kind, t, b), bucket_docs)
+
+    out: Dict[int, List[dict]] = {t: [] for t in tank_ids}
+    for t in tank_ids:
+        for b in buckets:
+            docs = found[t][b]
+            if b < since or (until is not None and until < b + size):
+                docs = [d for d in docs if since <= d[field] and (until is None or d[field] < until)]
+            out[t].extend(docs)
+    live_start = buckets[-1] + size if buckets else since
+    if tank_ids and (until is None or live_start < until):
+        counters["live"] += 1
+        for doc in await fetch(list(tank_ids), max(since, live_start), until):
+            out[doc["tank_id"]].append(doc)
+    return out
+
+
+async def cached_range(kind: str, tank_id: int, since: datetime, until: Optional[datetime], fetch: Fetch,
+                       rolled_through: Optional[datetime] = None) -> List[dict]:
+    """Documents of one tank in [since, until), closed buckets from memory.
+
+    `fetch(start, end)` reads [start, end) from the store (end None: up to
+    now), oldest first.
+    """
+    async def fetch_tank(tank_ids, start, end):
+        return await fetch(start, end)
+
+    return (await cached_ranges(kind, [tank_id], since, until, fetch_tank, rolled_through))[tank_id]
+
+
+def is_late(doc: dict) -> bool:
+    """Whether a reading lands in a bucket that may already be cached as closed."""
+    size = BUCKETS["readings"][0]
+    ts = tank_stats._naive_utc(doc["timestamp"])
+    return _floor(ts, size) + size <= datetime.utcnow() - timedelta(seconds=HISTORY_CACHE_SETTLE_SECONDS)
+
+
+async def observe(docs: List[dict]):
+    """Drop cached history everywhere if newly stored readings belong to closed buckets."""
+    if any(is_late(d) for d in docs):
+        await invalidation.bump("history_cache")
+
+
+# ---- query helpers --------------------------------------------------------------
+
+async def tanks_readings(collection, tank_ids: List[int], since: datetime,
+                         until: Optional[datetime]) -> Dict[int, List[dict]]:
+    """Raw readings of several tanks (archived ones included), one $in query per fetched range."""
+    async def fetch(ids, start, end):
+        query = export.readings_query(ids, start, end)
+        docs = await collection.find(query).sort("timestamp", 1).to_list(length=None)
+        for doc in docs:
+            doc["_id"] = str(doc["_id"])
+        archived = await asyncio.gather(*(retention.read_archive_async(t, start, end) for t in ids))
+        return [doc for tank_docs in archived for doc in tank_docs] + docs
+
+    return await cached_ranges("readings", tank_ids, since, until, fetch)
+
+
+async def tank_readings(collection, tank_id: int, since: datetime, until: Optional[datetime]) -> List[dict]:
+    """Raw readings of a tank (archived ones included), as GET /api/readings/{tank_id} returns them."""
+    return (await tanks_readings(collection, [tank_id], since, until))[tank_id]
+
+
+async def tank_rollups(tank_id: int, resolution: str, since: datetime, until: Optional[datetime]) -> List[dict]:
+    if resolution not in retention.ROLLUP_RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {', '.join(retention.ROLLUP_RESOLUTIONS)}")
+
+    async def fetch(start, end):
+        return await retention.get_rollups(tank_id, resolution, start, end)
+
+    return await cached_range(resolution, tank_id, since, until, fetch, await retention.rolled_through())
+
+
+def stats() -> dict:
+    return {
+        "entries": len(_entries),
+        "bytes": _bytes,
+        "max_bytes": HISTORY_CACHE_MAX_BYTES,
+        "bucket_hours": HISTORY_CACHE_BUCKET_HOURS,
+        **counters,
+    }
@@ -0,0 +1,110 @@
+# Idempotent persistence of sensor readings.
+#
+# Every reading document carries a `dedup_key`, derived from the client's
+# reading_id when one is sent and from (tank_id, timestamp) otherwise. A
+# unique index on that key lets retried POSTs be dropped at write time:
+# readings are written as unordered bulk upserts with $setOnInsert, so an
+# existing key matches instead of inserting a second copy.
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel, Field, TypeAdapter
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger("ingest")
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class Reading(BaseModel):
+    id: int = Field(..., description="Tank identifier")
+    temp: float
+    humidity: float
+    light: bool
+    timestamp: Optional[datetime] = Field(default_factory=datetime.utcnow)
+    reading_id: Optional[str] = Field(default=None, description="Client-assigned id used to drop retried duplicates")
+
+
+_reading_list = TypeAdapter(List[Reading])
+
+
+def validate_readings(items: List[dict]) -> List[Reading]:
+    """Validate a list of reading dicts in one pass rather than one model call per row."""
+    return _reading_list.validate_python(items)
+
+
+async def ensure_indexes(collection):
+    # partial so documents written before dedup keys existed don't collide on null
+    await collection.create_index(
+        "dedup_key",
+        unique=True,
+        partialFilterExpression={"dedup_key": {"$exists": True}},
+    )
+
+
+def dedup_key(doc: dict) -> str:
+    reading_id = doc.get("reading_id")
+    if reading_id:
+        return f"{doc['tank_id']}:id:{reading_id}"
+    ts = doc["timestamp"]
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    # Mongo stores datetimes with millisecond precision
+    return f"{doc['tank_id']}:{ts.isoformat(timespec='milliseconds')}"
+
+
+def with_dedup_key(doc: dict) -> dict:
+    if doc.get("reading_id") is None:
+        doc.pop("reading_id", None)
+    doc["dedup_key"] = dedup_key(doc)
+    return doc
+
+
+def reading_to_doc(reading: Reading) -> dict:
+    doc = reading.dict()
+    # Optionally rename `id` key to `tank_id` in DB:
+    doc["tank_id"] = doc.pop("id")
+    return with_dedup_key(doc)
+
+
+async def persist_readings(collection, docs: List[dict]) -> Tuple[dict, List[dict]]:
+    """Upsert reading documents, skipping any whose dedup_key already exists.
+
+    Returns ({"accepted": n, "deduplicated": m}, accepted_docs).
+    """
+    if not docs:
+        return {"accepted": 0, "deduplicated": 0}, []
+    ops = [
+        UpdateOne({"dedup_key": doc["dedup_key"]}, {"$setOnInsert": doc}, upsert=True)
+        for doc in docs
+    ]
+    try:
+        res = await collection.bulk_write(ops, ordered=False)
+        upserted = res.upserted_ids.keys()
+    except BulkWriteError as e:
+        # concurrent upserts of the same key can race into E11000; those are
+        # duplicates too. Anything else is a real failure.
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+            raise
+        upserted = [u["index"] for u in e.details.get("upserted", [])]
+    accepted_docs = [docs[i] for i in sorted(upserted)]
+    result = {"accepted": len(accepted_docs), "deduplicated": len(docs) - len(accepted_docs)}
+    return result, accepted_docs
+
+
+async def insert_new(collection, docs: List[dict]) -> Tuple[int, int]:
+    """Insert documents unordered, skipping ones whose dedup_key (or _id) exists.
+
+    Returns (inserted, duplicates).
+    """
+    try:
+        res = await collection.insert_many(docs, ordered=False)
+        return len(res.inserted_ids), 0
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != DUPLICATE_KEY_ERROR for err in errors):
+            raise
+        return e.details.get("nInserted", 0), len(errors)
@@ -0,0 +1,100 @@
+# Cross-worker cache invalidation.
+#
+# With several API workers, a write handled by one worker must invalidate
+# in-memory caches held by the others. Each cache name has a version
+# counter in the `cache_versions` collection: writers call bump(name), and
+# every worker polls the counters every INVALIDATION_POLL_SECONDS and runs
+# the callbacks registered for any name whose version moved. The bumping
+# worker runs its own callbacks immediately.
+#
+# Polling is used rather than change streams because those need a replica
+# set and the default deployment runs a standalone mongod.
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger("invalidation")
+
+VERSIONS_COLLECTION = "cache_versions"
+INVALIDATION_POLL_SECONDS = float(os.getenv("INVALIDATION_POLL_SECONDS", "2"))
+
+_versions_coll = None
+_seen: Dict[str, int] = {}
+_callbacks: Dict[str, List[Callable[[], None]]] = defaultdict(list)
+_task: Optional[asyncio.Task] = None
+
+
+def register(name: str, callback: Callable[[], None]):
+    """Run `callback` whenever cache `name` is invalidated by any worker."""
+    if callback not in _callbacks[name]:
+        _callbacks[name].append(callback)
+
+
+def unregister(name: str, callback: Callable[[], None]):
+    if callback in _callbacks.get(name, ()):
+        _callbacks[name].remove(callback)
+
+
+def version(name: str) -> int:
+    """Last seen version of cache `name`; the same in every worker once polled."""
+    return _seen.get(name, 0)
+
+
+def _fire(name: str):
+    for cb in _callbacks.get(name, ()):
+        try:
+            cb()
+        except Exception:
+            logger.exception("Invalidation callback for %s failed", name)
+
+
+async def initialize(db):
+    global _versions_coll, _task
+    _versions_coll = db[VERSIONS_COLLECTION]
+    async for doc in _versions_coll.find({}):
+        _seen[doc["_id"]] = doc.get("version", 0)
+    if _task is None:
+        _task = asyncio.create_task(_poll_loop())
+
+
+async def bump(name: str):
+    """Invalidate cache `name` in this worker now and in all others on their next poll."""
+    _fire(name)
+    if _versions_coll is None:
+        return
+    try:
+        doc = await _versions_coll.find_one_and_update(
+            {"_id": name}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        if doc:
+            _seen[name] = doc["version"]
+    except Exception as e:
+        logger.warning("Failed to publish invalidation for %s: %s", name, str(e))
+
+
+async def _poll_loop():
+    while True:
+        await asyncio.sleep(INVALIDATION_POLL_SECONDS)
+        try:
+            async for doc in _versions_coll.find({}):
+                name, version = doc["_id"], doc.get("version", 0)
+                if _seen.get(name) != version:
+                    _seen[name] = version
+                    _fire(name)
+        except Exception as e:
+            logger.warning("Invalidation poll failed: %s", str(e))
+
+
+async def cleanup():
+    global _task
+    if _task:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
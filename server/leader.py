@@ -0,0 +1,110 @@
+# Single-leader election over a Mongo lease document.
+#
+# Every API worker (and the standalone poller, server/poller.py) runs the
+# same election loop. The lease is a document in the `leases` collection:
+#
+#   {"_id": <name>, "owner": <worker id>, "expires_at": <datetime>}
+#
+# A worker takes the lease when it is free or expired and renews it every
+# LEASE_TTL_SECONDS / 3. Only the holder runs the background services, so
+# `uvicorn --workers N` polls sensors once rather than N times. Expiry
+# compares host clocks, so workers on different hosts need NTP-synced time.
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger("leader")
+
+LEASE_COLLECTION = "leases"
+LEASE_NAME = os.getenv("LEASE_NAME", "background-services")
+LEASE_TTL_SECONDS = float(os.getenv("LEASE_TTL_SECONDS", "15"))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_task: Optional[asyncio.Task] = None
+_is_leader = False
+
+
+def is_leader() -> bool:
+    return _is_leader
+
+
+async def try_acquire(leases, name: str = LEASE_NAME, owner: str = WORKER_ID) -> bool:
+    """Take or renew the lease. Returns True when `owner` holds it afterwards."""
+    now = datetime.utcnow()
+    try:
+        doc = await leases.find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=LEASE_TTL_SECONDS)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # the filter didn't match because someone else holds an unexpired lease
+        return False
+    return doc is not None and doc.get("owner") == owner
+
+
+async def release(leases, name: str = LEASE_NAME, owner: str = WORKER_ID):
+    await leases.delete_one({"_id": name, "owner": owner})
+
+
+async def start(db, on_elected: Callable[[], Awaitable[None]],
+                on_demoted: Callable[[], Awaitable[None]], name: str = LEASE_NAME):
+    """Run the election loop, calling on_elected/on_demoted on leadership changes."""
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_election_loop(db[LEASE_COLLECTION], name, on_elected, on_demoted))
+
+
+async def _election_loop(leases, name, on_elected, on_demoted):
+    global _is_leader
+    last_renewed = None
+    try:
+        while True:
+            try:
+                held = await try_acquire(leases, name)
+                if held:
+                    last_renewed = datetime.utcnow()
+            except Exception as e:
+                logger.warning("Lease renewal failed: %s", str(e))
+                # keep leading only while the last successful renewal is still valid
+                held = _is_leader and last_renewed is not None and \
+                    datetime.utcnow() - last_renewed < timedelta(seconds=LEASE_TTL_SECONDS * 2 / 3)
+
+            if held and not _is_leader:
+                _is_leader = True
+                logger.info("Worker %s elected for %s", WORKER_ID, name)
+                await on_elected()
+            elif not held and _is_leader:
+                _is_leader = False
+                logger.warning("Worker %s lost lease %s", WORKER_ID, name)
+                await on_demoted()
+            await asyncio.sleep(LEASE_TTL_SECONDS / 3)
+    except asyncio.CancelledError:
+        if _is_leader:
+            _is_leader = False
+            await on_demoted()
+            try:
+                await release(leases, name)
+            except Exception:
+                logger.debug("Lease release failed", exc_info=True)
+        raise
+
+
+async def cleanup():
+    global _task
+    if _task:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
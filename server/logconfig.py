@@ -0,0 +1,200 @@
+# Logging setup for the API and the poller: queued, sampled, JSON.
+#
+# configure() installs a single root handler that only enqueues records; a
+# background thread formats and writes them, so a slow stderr (a container
+# log driver under pressure, a full pipe) never blocks the event loop. The
+# queue is bounded and records are dropped, and counted, when it is full.
+# Messages keep their %-style arguments until the writer formats them.
+#
+# Hot paths ask sample() first, which costs a counter increment when the
+# record is skipped:
+#
+#   extra = logconfig.sample("ingest", tank_id)
+#   if extra:
+#       logger.info("Inserted reading for tank %s", tank_id, extra=extra)
+#
+# Each category either keeps 1 in N records ("1/100") or the first N per
+# window ("10/min"), per key when one is given (usually the tank id).
+# Emitted records carry the category, the sampling rate and how many were
+# suppressed since the last one. Rules come from LOG_SAMPLING, e.g.
+#
+#   LOG_SAMPLING=ingest=1/100,poll=1/12,ingest_error=10/min
+#
+# and "all" / "none" keep or drop a category entirely.
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+DEFAULT_SAMPLING = {
+    "ingest": "1/100",        # per accepted single reading
+    "dedup": "1/100",         # per dropped duplicate
+    "poll": "1/12",           # per tank per poll tick (once a minute at 5 s polls)
+    "ingest_error": "10/min",  # failed inserts, per tank
+    "post_error": "10/min",   # failed posts from the poller, per tank
+}
+
+_WINDOWS = {"s": 1.0, "sec": 1.0, "min": 60.0, "h": 3600.0}
+
+# attributes every LogRecord has; anything else was passed via extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional["_QueueHandler"] = None
+dropped = 0
+
+
+def parse_rule(spec: str) -> Tuple[str, float, float]:
+    """("sample", n, 0) / ("rate", n, window seconds) / ("all"|"none", 0, 0). Raises ValueError."""
+    spec = spec.strip().lower()
+    if spec in ("all", "none"):
+        return spec, 0, 0
+    count, _, per = spec.partition("/")
+    if per in _WINDOWS:
+        return "rate", int(count), _WINDOWS[per]
+    if count == "1" and per.isdigit() and int(per) > 0:
+        return "sample", int(per), 0
+    raise ValueError(f"invalid sampling rule {spec!r}, expected 1/N, N/min, all or none")
+
+
+def parse_rules(spec: str) -> Dict[str, Tuple[str, float, float]]:
+    rules = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        category, sep, rule = item.partition("=")
+        if not sep:
+            raise ValueError(f"invalid sampling rule {item!r}, expected category=rule")
+        rules[category.strip()] = parse_rule(rule)
+    return rules
+
+
+_rules = {c: parse_rule(r) for c, r in DEFAULT_SAMPLING.items()}
+_rules.update(parse_rules(os.getenv("LOG_SAMPLING", "")))
+_counters: Dict[tuple, "itertools.count"] = {}
+# (category, key) -> [window start, emitted in window, suppressed since last emit]
+_windows: Dict[tuple, list] = {}
+_lock = threading.Lock()
+
+
+def set_rules(spec: str):
+    """Override sampling rules at runtime ("category=rule,...")."""
+    _rules.update(parse_rules(spec))
+
+
+def sample(category: str, key=None) -> Optional[dict]:
+    """Extra fields for a record to emit, or None to skip it."""
+    kind, n, window = _rules.get(category, ("all", 0, 0))
+    if kind == "none":
+        return None
+    extra = {"category": category} if key is None else {"category": category, "key": key}
+    if kind == "all":
+        return extra
+    slot = (category, key)
+    if kind == "sample":
+        counter = _counters.get(slot)
+        if counter is None:
+            counter = _counters.setdefault(slot, itertools.count())
+        if next(counter) % n:
+            return None
+        extra["sample_rate"] = f"1/{int(n)}"
+        return extra
+    now = time.monotonic()
+    with _lock:
+        state = _windows.get(slot)
+        if state is None or now - state[0] >= window:
+            state = _windows[slot] = [now, 0, state[2] if state else 0]
+        if state[1] >= n:
+            state[2] += 1
+            return None
+        state[1] += 1
+        suppressed, state[2] = state[2], 0
+    if suppressed:
+        extra["suppressed"] = suppressed
+    return extra
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any extra= fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for attr, value in vars(record).items():
+            if attr not in _RECORD_ATTRS and not attr.startswith("_"):
+                entry[attr] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # the writer thread is in this process: pass the record through and
+        # leave message formatting to it
+        return record
+
+    def enqueue(self, record):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+
+def _formatter() -> logging.Formatter:
+    if LOG_FORMAT == "text":
+        return logging.Formatter("%(levelname)s:%(name)s:%(message)s")
+    return JsonFormatter()
+
+
+def configure(level: Optional[str] = None, fmt: Optional[str] = None, stream=None):
+    """Route all logging through the queue and background writer. Idempotent."""
+    global _listener, _handler, LOG_FORMAT
+    if fmt:
+        LOG_FORMAT = fmt
+    stop()
+    sink = logging.StreamHandler(stream or sys.stderr)
+    sink.setFormatter(_formatter())
+    _handler = _QueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _listener = logging.handlers.QueueListener(_handler.queue, sink, respect_handler_level=False)
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(_handler)
+    root.setLevel(level or LOG_LEVEL)
+    _listener.start()
+
+
+def stop():
+    """Flush queued records and stop the writer thread."""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        logging.getLogger().removeHandler(_handler)
+    _listener = _handler = None
+
+
+def stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": dropped,
+        "rules": dict(_rules),
+    }
+
+
+atexit.register(stop)
@@ -1,18 +1,10 @@
 import asyncio
 import os
 import logging
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 
-try:
-    from kasa import Discover
-    from kasa.exceptions import TimeoutError as KasaTimeoutError
-    KASA_AVAILABLE = True
-except ImportError:
-    KASA_AVAILABLE = False
-    logging.warning("kasa module not available - powerstrip functionality disabled")
-
 load_dotenv()
 
 logger = logging.getLogger("powerstrip")
@@ -26,6 +18,44 @@ class PowerstripUnavailableError(Exception):
     """Raised when the kasa powerstrip cannot be contacted or discovered."""
 
 
+# kasa is slow to import, so it's loaded on the first powerstrip call
+Discover = None
+KasaTimeoutError = None
+KASA_AVAILABLE = None  # unknown until _load_kasa() has run
+
+
+def _load_kasa() -> bool:
+    global Discover, KasaTimeoutError, KASA_AVAILABLE
+    if KASA_AVAILABLE is None:
+        try:
+            from kasa import Discover as _Discover
+            from kasa.exceptions import TimeoutError as _KasaTimeoutError
+            Discover, KasaTimeoutError = _Discover, _KasaTimeoutError
+            KASA_AVAILABLE = True
+        except ImportError:
+            KASA_AVAILABLE = False
+            logging.warning("kasa module not available - powerstrip functionality disabled")
+    return KASA_AVAILABLE
+
+
+# Last state seen for each outlet, keyed by (device_id, 1-based index); device
+# None is the KASA_DEVICE_IP strip. Listeners (the dashboard) are called with
+# (device_id, index, state) whenever a remembered state changes.
+known_states: Dict[Tuple[Optional[str], int], Optional[bool]] = {}
+state_listeners: List[Callable[[Optional[str], int, Optional[bool]], None]] = []
+
+
+def remember_state(device_id: Optional[str], index: int, state: Optional[bool]):
+    key = (device_id, index)
+    if key not in known_states or known_states[key] != state:
+        known_states[key] = state
+        for listener in state_listeners:
+            try:
+                listener(device_id, index, state)
+            except Exception:
+                logger.debug("Outlet state listener failed", exc_info=True)
+
+
 async def _call_and_await(fn, *args, **kwargs):
     """Call a function which may return a coroutine; await if needed."""
     res = fn(*args, **kwargs)
@@ -65,7 +95,7 @@ async def _get_device() -> object:
     Raises PowerstripUnavailableError when discovery times out or no devices are found.
     Other unexpected exceptions are allowed to bubble up.
     """
-    if not KASA_AVAILABLE:
+    if not _load_kasa():
         raise PowerstripUnavailableError("kasa module not available")
 
     try:
@@ -90,25 +120,105 @@ async def get_outlet_state(index: int) -> Optional[bool]:
     try:
         dev = await _get_device()
         await _safe_update(dev)
-        zero_idx = index - 1
-        # prefer children/relays
-        relays = getattr(dev, "relays", None) or getattr(dev, "children", None)
-        if relays and 0 <= zero_idx < len(relays):
-            item = relays[zero_idx]
-            await _safe_update(item)
-            return getattr(item, "is_on", None)
-        # modules mapping
-        modules = getattr(dev, "modules", None)
-        if modules:
-            items = list(modules.items())
-            if 0 <= zero_idx < len(items):
-                _, module = items[zero_idx]
+        state = await _read_outlet_state(dev, index)
+        remember_state(None, index, state)
+        return state
+    finally:
+        await _safe_close(dev)
+
+
+async def _read_outlet_state(dev, index: int) -> Optional[bool]:
+    """Read outlet `index` (1-based) of an updated device."""
+    zero_idx = index - 1
+    # prefer children/relays
+    relays = getattr(dev, "relays", None) or getattr(dev, "children", None)
+    if relays and 0 <= zero_idx < len(relays):
+        item = relays[zero_idx]
+        await _safe_update(item)
+        return getattr(item, "is_on", None)
+    # modules mapping
+    modules = getattr(dev, "modules", None)
+    if modules:
+        items = list(modules.items())
+        if 0 <= zero_idx < len(items):
+            _, module = items[zero_idx]
+            await _safe_update(module)
+            return getattr(module, "is_on", None)
+    # fallback to device-level is_on
+    return getattr(dev, "is_on", None)
+
+
+def _check_action(action: str) -> str:
+    action = action.lower()
+    if action not in ("on", "off", "toggle"):
+        raise ValueError("action must be 'on', 'off' or 'toggle'")
+    return action
+
+
+async def _apply_outlet_action(dev, index: int, action: str) -> Optional[bool]:
+    """Apply an already validated action to outlet `index` (1-based) of an updated device."""
+    zero_idx = index - 1
+
+    relays = getattr(dev, "relays", None) or getattr(dev, "children", None)
+    if relays and 0 <= zero_idx < len(relays):
+        item = relays[zero_idx]
+        await _safe_update(item)
+        # determine desired action
+        if action == "toggle":
+            current = getattr(item, "is_on", False)
+            action = "off" if current else "on"
+        fn = getattr(item, "turn_on" if action == "on" else "turn_off", None) or getattr(item, f"async_turn_{'on' if action=='on' else 'off'}", None)
+        if fn is None:
+            # try device-level API
+            dev_fn = getattr(dev, "turn_on" if action == "on" else "turn_off", None)
+            if dev_fn:
+                try:
+                    await _call_and_await(dev_fn, zero_idx)
+                except TypeError:
+                    await _call_and_await(dev_fn)
+            else:
+                raise RuntimeError("No method to control outlet")
+        else:
+            await _call_and_await(fn)
+        await _safe_update(item)
+        return getattr(item, "is_on", None)
+
+    # modules mapping
+    modules = getattr(dev, "modules", None)
+    if modules:
+        items = list(modules.items())
+        if 0 <= zero_idx < len(items):
+            _, module = items[zero_idx]
+            await _safe_update(module)
+            if action == "toggle":
+                current = getattr(module, "is_on", False)
+                action = "off" if current else "on"
+            fn = getattr(module, "turn_on" if action == "on" else "turn_off", None) or getattr(module, f"async_turn_{'on' if action=='on' else 'off'}", None)
+            if fn:
+                await _call_and_await(fn)
                 await _safe_update(module)
                 return getattr(module, "is_on", None)
-        # fallback to device-level is_on
+
+    # device-level fallback
+    if action == "toggle":
+        # best-effort: toggle based on device state
+        current = getattr(dev, "is_on", None)
+        if current is None:
+            raise RuntimeError("Cannot determine device state to toggle")
+        action = "off" if current else "on"
+    dev_fn = getattr(dev, "turn_on" if action == "on" else "turn_off", None) or getattr(dev, f"async_turn_{'on' if action=='on' else 'off'}", None)
+    if dev_fn:
+        try:
+            await _call_and_await(dev_fn, zero_idx)
+        except TypeError:
+            await _call_and_await(dev_fn)
+        await _safe_update(dev)
+        relays = getattr(dev, "relays", None) or getattr(dev, "children", None)
+        if relays and 0 <= zero_idx < len(relays):
+            return getattr(relays[zero_idx], "is_on", None)
         return getattr(dev, "is_on", None)
-    finally:
-        await _safe_close(dev)
+
+    raise RuntimeError("No suitable method to control outlet on this device")
 
 
 async def set_outlet_state(index: int, action: str) -> Optional[bool]:
@@ -116,76 +226,32 @@ async def set_outlet_state(index: int, action: str) -> Optional[bool]:
 
     Index is 1-based.
     """
-    action = action.lower()
-    if action not in ("on", "off", "toggle"):
-        raise ValueError("action must be 'on', 'off' or 'toggle'")
-
+    action = _check_action(action)
     dev = None
     try:
         dev = await _get_device()
         await _safe_update(dev)
-        zero_idx = index - 1
+        state = await _apply_outlet_action(dev, index, action)
+        remember_state(None, index, state)
+        return state
+    finally:
+        await _safe_close(dev)
 
-        relays = getattr(dev, "relays", None) or getattr(dev, "children", None)
-        if relays and 0 <= zero_idx < len(relays):
-            item = relays[zero_idx]
-            await _safe_update(item)
-            # determine desired action
-            if action == "toggle":
-                current = getattr(item, "is_on", False)
-                action = "off" if current else "on"
-            fn = getattr(item, "turn_on" if action == "on" else "turn_off", None) or getattr(item, f"async_turn_{'on' if action=='on' else 'off'}", None)
-            if fn is None:
-                # try device-level API
-                dev_fn = getattr(dev, "turn_on" if action == "on" else "turn_off", None)
-                if dev_fn:
-                    try:
-                        await _call_and_await(dev_fn, zero_idx)
-                    except TypeError:
-                        await _call_and_await(dev_fn)
-                else:
-                    raise RuntimeError("No method to control outlet")
-            else:
-                await _call_and_await(fn)
-            await _safe_update(item)
-            return getattr(item, "is_on", None)
-
-        # modules mapping
-        modules = getattr(dev, "modules", None)
-        if modules:
-            items = list(modules.items())
-            if 0 <= zero_idx < len(items):
-                _, module = items[zero_idx]
-                await _safe_update(module)
-                if action == "toggle":
-                    current = getattr(module, "is_on", False)
-                    action = "off" if current else "on"
-                fn = getattr(module, "turn_on" if action == "on" else "turn_off", None) or getattr(module, f"async_turn_{'on' if action=='on' else 'off'}", None)
-                if fn:
-                    await _call_and_await(fn)
-                    await _safe_update(module)
-                    return getattr(module, "is_on", None)
-
-        # device-level fallback
-        if action == "toggle":
-            # best-effort: toggle based on device state
-            current = getattr(dev, "is_on", None)
-            if current is None:
-                raise RuntimeError("Cannot determine device state to toggle")
-            action = "off" if current else "on"
-        dev_fn = getattr(dev, "turn_on" if action == "on" else "turn_off", None) or getattr(dev, f"async_turn_{'on' if action=='on' else 'off'}", None)
-        if dev_fn:
-            try:
-                await _call_and_await(dev_fn, zero_idx)
-            except TypeError:
-                await _call_and_await(dev_fn)
-            await _safe_update(dev)
-            relays = getattr(dev, "relays", None) or getattr(dev, "children", None)
-            if relays and 0 <= zero_idx < len(relays):
-                return getattr(relays[zero_idx], "is_on", None)
-            return getattr(dev, "is_on", None)
-
-        raise RuntimeError("No suitable method to control outlet on this device")
+
+async def set_outlet_states(changes: Dict[int, str]) -> Dict[int, Optional[bool]]:
+    """Apply several outlet actions with one device session. Returns index -> resulting state.
+
+    Indexes are 1-based.
+    """
+    changes = {index: _check_action(action) for index, action in changes.items()}
+    dev = None
+    try:
+        dev = await _get_device()
+        await _safe_update(dev)
+        states = {index: await _apply_outlet_action(dev, index, action) for index, action in changes.items()}
+        for index, state in states.items():
+            remember_state(None, index, state)
+        return states
     finally:
         await _safe_close(dev)
 
@@ -0,0 +1,335 @@
+# Registry of Kasa powerstrips and the tank outlets wired to them.
+#
+# Persisted in Mongo:
+#   powerstrips   {"_id": device_id, "host", "alias", "model", "relay_count", "last_seen"}
+#   tank_outlets  {"tank_id", "role", "device_id", "outlet"}   unique (tank_id, role)
+#
+# Each process keeps one open session per device, reused across requests
+# instead of rediscovering the strip on every call. Requests touching many
+# devices fan out with asyncio.gather; a per-device semaphore keeps each
+# strip to PER_DEVICE_CONCURRENCY in-flight commands (Kasa strips handle one
+# request at a time best) and FANOUT_CONCURRENCY caps devices contacted at
+# once. Discovery either broadcasts or probes every host of a subnet, with
+# DISCOVERY_CONCURRENCY probes in flight; subnets larger than
+# DISCOVERY_MAX_HOSTS addresses (a /22) are refused.
+import asyncio
+import ipaddress
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from server import invalidation
+from server import powerstrip_interface as ps
+from server.powerstrip_interface import PowerstripUnavailableError
+
+logger = logging.getLogger("powerstrip-registry")
+
+PER_DEVICE_CONCURRENCY = int(os.getenv("POWERSTRIP_PER_DEVICE_CONCURRENCY", "1"))
+FANOUT_CONCURRENCY = int(os.getenv("POWERSTRIP_FANOUT_CONCURRENCY", "32"))
+DISCOVERY_TIMEOUT = float(os.getenv("POWERSTRIP_DISCOVERY_TIMEOUT", "3"))
+DISCOVERY_CONCURRENCY = int(os.getenv("POWERSTRIP_DISCOVERY_CONCURRENCY", "128"))
+DISCOVERY_MAX_HOSTS = int(os.getenv("POWERSTRIP_DISCOVERY_MAX_HOSTS", "1024"))
+COMMAND_TIMEOUT = float(os.getenv("POWERSTRIP_COMMAND_TIMEOUT", "5"))
+
+DEVICES_COLLECTION = "powerstrips"
+OUTLETS_COLLECTION = "tank_outlets"
+
+
+async def _kasa_connect(host: str, timeout: float = DISCOVERY_TIMEOUT):
+    if not ps._load_kasa():
+        raise PowerstripUnavailableError("kasa module not available")
+    return await ps.Discover.discover_single(
+        host, discovery_timeout=timeout, username=ps.USERNAME, password=ps.PASSWORD
+    )
+
+
+async def _kasa_broadcast(timeout: float = DISCOVERY_TIMEOUT) -> Dict[str, object]:
+    if not ps._load_kasa():
+        raise PowerstripUnavailableError("kasa module not available")
+    return await ps.Discover.discover(
+        discovery_timeout=timeout, username=ps.USERNAME, password=ps.PASSWORD
+    )
+
+
+# swapped out by the emulator harness to run without hardware
+connect_device = _kasa_connect
+broadcast_discover = _kasa_broadcast
+
+
+class DeviceSession:
+    """A long-lived connection to one strip, serialized by a semaphore."""
+
+    def __init__(self, device_id: str, host: str, dev=None):
+        self.device_id = device_id
+        self.host = host
+        self.dev = dev
+        self.semaphore = asyncio.Semaphore(PER_DEVICE_CONCURRENCY)
+
+    async def _device(self):
+        if self.dev is None:
+            self.dev = await connect_device(self.host)
+        return self.dev
+
+    async def reset(self):
+        dev, self.dev = self.dev, None
+        await ps._safe_close(dev)
+
+    async def _run(self, fn):
+        dev = await self._device()
+        update = getattr(dev, "update", None)
+        if callable(update):
+            # not _safe_update: a failure here means the connection went stale
+            await ps._call_and_await(update)
+        return await fn(dev)
+
+    async def run(self, fn):
+        """Run `fn(dev)` against a freshly updated device; drop the session on failure."""
+        async with self.semaphore:
+            try:
+                return await asyncio.wait_for(self._run(fn), timeout=COMMAND_TIMEOUT)
+            except Exception:
+                await self.reset()
+                raise
+
+
+_db = None
+_sessions: Dict[str, DeviceSession] = {}
+_devices: Dict[str, dict] = {}
+# tank_id -> role -> (device_id, outlet)
+_mappings: Dict[int, Dict[str, Tuple[str, int]]] = {}
+_fanout: Optional[asyncio.Semaphore] = None
+
+
+def _fanout_semaphore() -> asyncio.Semaphore:
+    global _fanout
+    if _fanout is None:
+        _fanout = asyncio.Semaphore(FANOUT_CONCURRENCY)
+    return _fanout
+
+
+async def initialize(db):
+    global _db
+    _db = db
+    await _db[OUTLETS_COLLECTION].create_index([("tank_id", 1), ("role", 1)], unique=True)
+    await _db[OUTLETS_COLLECTION].create_index([("device_id", 1)])
+    await reload()
+    invalidation.register("powerstrip_registry", _schedule_reload)
+
+
+def _schedule_reload():
+    asyncio.get_running_loop().create_task(reload())
+
+
+async def reload():
+    """Refresh the in-memory device and mapping caches from Mongo."""
+    if _db is None:
+        return
+    devices = await _db[DEVICES_COLLECTION].find({}).to_list(length=None)
+    mappings: Dict[int, Dict[str, Tuple[str, int]]] = defaultdict(dict)
+    async for doc in _db[OUTLETS_COLLECTION].find({}):
+        mappings[doc["tank_id"]][doc["role"]] = (doc["device_id"], doc["outlet"])
+    _devices.clear()
+    _devices.update({d["_id"]: d for d in devices})
+    _mappings.clear()
+    _mappings.update(mappings)
+    for device_id in list(_sessions):
+        if device_id not in _devices:
+            await _sessions.pop(device_id).reset()
+
+
+async def cleanup():
+    invalidation.unregister("powerstrip_registry", _schedule_reload)
+    for session in list(_sessions.values()):
+        await session.reset()
+    _sessions.clear()
+
+
+def _session(device_id: str) -> DeviceSession:
+    session = _sessions.get(device_id)
+    if session is None:
+        device = _devices.get(device_id)
+        if device is None:
+            raise KeyError(f"Unknown powerstrip '{device_id}'")
+        session = _sessions[device_id] = DeviceSession(device_id, device["host"])
+    return session
+
+
+# ---- discovery ---------------------------------------------------------------
+
+def _device_id(dev, host: str) -> str:
+    return getattr(dev, "mac", None) or getattr(dev, "device_id", None) or host
+
+
+async def _probe_hosts(hosts: Iterable[str]) -> Dict[str, object]:
+    """Probe `hosts` with at most DISCOVERY_CONCURRENCY connections at a time."""
+    found = {}
+    pending = iter(hosts)
+
+    async def worker():
+        # workers share one iterator, so only the probes in flight exist
+        for host in pending:
+            try:
+                dev = await connect_device(host, DISCOVERY_TIMEOUT)
+            except Exception:
+                continue
+            if dev is not None:
+                found[host] = dev
+
+    await asyncio.gather(*(worker() for _ in range(max(1, DISCOVERY_CONCURRENCY))))
+    return found
+
+
+async def discover(subnet: Optional[str] = None) -> List[dict]:
+    """Find strips by broadcast, or by probing every host in `subnet`.
+
+    Found devices are upserted into the registry and their connections kept
+    as sessions. Raises ValueError for a malformed or oversized subnet.
+    """
+    if subnet:
+        network = ipaddress.ip_network(subnet, strict=False)
+        if network.num_addresses > DISCOVERY_MAX_HOSTS:
+            raise ValueError(
+                f"Subnet {network} has {network.num_addresses} addresses; "
+                f"at most {DISCOVERY_MAX_HOSTS} can be probed"
+            )
+        found = await _probe_hosts(str(h) for h in network.hosts())
+    else:
+        found = await broadcast_discover(DISCOVERY_TIMEOUT)
+
+    async def register(host, dev):
+        try:
+            await ps._safe_update(dev)
+        except Exception:
+            logger.debug("Update after discovery failed for %s", host, exc_info=True)
+        relays = getattr(dev, "children", None) or getattr(dev, "relays", None) or []
+        doc = {
+            "_id": _device_id(dev, host),
+            "host": host,
+            "alias": getattr(dev, "alias", None),
+            "model": getattr(dev, "model", None),
+            "relay_count": len(relays),
+            "last_seen": datetime.utcnow(),
+        }
+        await _db[DEVICES_COLLECTION].replace_one({"_id": doc["_id"]}, doc, upsert=True)
+        _devices[doc["_id"]] = doc
+        old = _sessions.get(doc["_id"])
+        if old is not None and old.dev is not dev:
+            await old.reset()
+        _sessions[doc["_id"]] = DeviceSession(doc["_id"], host, dev)
+        return doc
+
+    docs = await asyncio.gather(*(register(host, dev) for host, dev in found.items()))
+    logger.info("Discovered %d powerstrip(s)", len(docs))
+    await invalidation.bump("powerstrip_registry")
+    return list(docs)
+
+
+def list_devices() -> List[dict]:
+    return list(_devices.values())
+
+
+# ---- tank outlet mapping -------------------------------------------------------
+
+def outlets_for_tank(tank_id: int) -> Dict[str, Tuple[str, int]]:
+    """role -> (device_id, 1-based outlet) for a tank, from the in-memory cache."""
+    return dict(_mappings.get(tank_id, {}))
+
+
+def mapped_tanks() -> Iterable[int]:
+    return list(_mappings)
+
+
+async def assign_outlet(tank_id: int, role: str, device_id: str, outlet: int):
+    device = _devices.get(device_id)
+    if device is None:
+        raise KeyError(f"Unknown powerstrip '{device_id}'")
+    if device.get("relay_count") and not 1 <= outlet <= device["relay_count"]:
+        raise ValueError(f"Outlet must be between 1 and {device['relay_count']}")
+    await _db[OUTLETS_COLLECTION].update_one(
+        {"tank_id": tank_id, "role": role},
+        {"$set": {"device_id": device_id, "outlet": outlet}},
+        upsert=True,
+    )
+    _mappings.setdefault(tank_id, {})[role] = (device_id, outlet)
+    await invalidation.bump("powerstrip_registry")
+
+
+async def unassign_outlet(tank_id: int, role: str) -> bool:
+    res = await _db[OUTLETS_COLLECTION].delete_one({"tank_id": tank_id, "role": role})
+    _mappings.get(tank_id, {}).pop(role, None)
+    await invalidation.bump("powerstrip_registry")
+    return res.deleted_count > 0
+
+
+# ---- fan-out reads/writes --------------------------------------------------------
+
+async def _per_device(device_id: str, fn):
+    async with _fanout_semaphore():
+        return await _session(device_id).run(fn)
+
+
+async def read_outlets(targets: Dict[str, List[int]]) -> Dict[str, Dict[int, Optional[bool]]]:
+    """Read outlet states for {device_id: [outlet, ...]}, one session call per device, all devices at once.
+
+    A device that can't be reached maps to an {"error": ...} entry.
+    """
+    async def read(device_id, outlets):
+        async def fn(dev):
+            states = {o: await ps._read_outlet_state(dev, o) for o in outlets}
+            for o, state in states.items():
+                ps.remember_state(device_id, o, state)
+            return states
+        try:
+            return device_id, await _per_device(device_id, fn)
+        except Exception as e:
+            logger.warning("Failed to read powerstrip %s: %s", device_id, str(e) or type(e).__name__)
+            return device_id, {"error": str(e) or type(e).__name__}
+
+    results = await asyncio.gather(*(read(d, o) for d, o in targets.items()))
+    return dict(results)
+
+
+async def set_outlet_states(device_id: str, changes: Dict[int, str]) -> Dict[int, Optional[bool]]:
+    """Apply {outlet: action} to one device in a single session call."""
+    changes = {o: ps._check_action(a) for o, a in changes.items()}
+
+    async def fn(dev):
+        states = {o: await ps._apply_outlet_action(dev, o, a) for o, a in changes.items()}
+        for o, state in states.items():
+            ps.remember_state(device_id, o, state)
+        return states
+    return await _per_device(device_id, fn)
+
+
+async def set_outlets(changes: Dict[str, Dict[int, str]]) -> Dict[str, object]:
+    """Apply {device_id: {outlet: action}} across devices concurrently."""
+    async def apply(device_id, batch):
+        try:
+            return device_id, await set_outlet_states(device_id, batch)
+        except Exception as e:
+            logger.warning("Failed to control powerstrip %s: %s", device_id, str(e) or type(e).__name__)
+            return device_id, {"error": str(e) or type(e).__name__}
+
+    results = await asyncio.gather(*(apply(d, b) for d, b in changes.items()))
+    return dict(results)
+
+
+async def tank_outlet_states(tank_id: int) -> List[dict]:
+    mapping = outlets_for_tank(tank_id)
+    targets: Dict[str, List[int]] = defaultdict(list)
+    for device_id, outlet in mapping.values():
+        targets[device_id].append(outlet)
+    states = await read_outlets(targets)
+    out = []
+    for role, (device_id, outlet) in sorted(mapping.items()):
+        device_states = states.get(device_id, {})
+        entry = {"role": role, "device_id": device_id, "outlet": outlet}
+        if "error" in device_states:
+            entry["state"] = None
+            entry["error"] = device_states["error"]
+        else:
+            entry["state"] = device_states.get(outlet)
+        out.append(entry)
+    return out
@@ -0,0 +1,207 @@
+# Reptile inventory.
+#
+# Animals live in the `reptiles` collection keyed by `reptile_id` (the id
+# of models.reptile.Reptile). An animal only references its species; the
+# habitat targets come from the species profile and are resolved with a
+# $lookup when a tank's animals are listed, instead of every animal
+# carrying its own copy of the optimal temperatures. Both sides store the
+# same `species_key` (species_key(): whitespace collapsed, lower case), so
+# the join is an indexed equality match.
+#
+# Imports take CSV or NDJSON and upsert in unordered bulk_write batches, so
+# re-importing a facility's inventory updates animals in place.
+import csv
+import io
+import json
+import logging
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, ReplaceOne
+
+logger = logging.getLogger("reptiles")
+
+REPTILES_COLLECTION = "reptiles"
+IMPORT_BATCH_SIZE = int(os.getenv("REPTILE_IMPORT_BATCH_SIZE", "1000"))
+
+# field -> type; everything an inventory row may carry
+_FIELDS = {
+    "reptile_id": int,
+    "name": str,
+    "species": str,
+    "tank_id": int,
+    "age_years": int,
+    "age_months": int,
+    "weight": float,
+    "feed_interval_days": int,
+}
+_REQUIRED = ("reptile_id", "name", "species")
+# per-animal habitat copies written by DB_generator.py; the species profile is authoritative
+_LEGACY_FIELDS = (
+    "optimal_cool_temp", "optimal_hot_temp", "requires_basking", "basking_temp",
+    "daylight_hours", "basking_duration_minutes", "optimum_humidity",
+)
+# profile fields exposed on the resolved view
+_PROFILE_FIELDS = (
+    "cool_temp", "hot_temp", "basking_temp", "humidity", "daylight_hours",
+    "basking_duration_minutes", "requires_basking", "feed_interval_days",
+)
+
+
+async def ensure_indexes(collection, profiles_collection=None):
+    await collection.create_index([("reptile_id", ASCENDING)], unique=True)
+    await collection.create_index([("tank_id", ASCENDING)])
+    await collection.create_index([("species_key", ASCENDING)])
+    if profiles_collection is not None:
+        await profiles_collection.create_index([("species_key", ASCENDING)])
+        await key_profiles(profiles_collection)
+
+
+def species_key(species: str) -> str:
+    """Join key between an animal's species and a profile's species_name."""
+    return " ".join(species.split()).lower()
+
+
+async def key_profiles(profiles_collection) -> int:
+    """Give species profiles stored without a species_key (or a stale one) theirs."""
+    updated = 0
+    async for profile in profiles_collection.find({}, {"species_name": 1, "species_key": 1}):
+        key = species_key(profile.get("species_name") or "")
+        if profile.get("species_key") != key:
+            await profiles_collection.update_one({"_id": profile["_id"]}, {"$set": {"species_key": key}})
+            updated += 1
+    if updated:
+        logger.info("Keyed %d species profile(s) for the reptile join", updated)
+    return updated
+
+
+def _number(value, kind):
+    """A finite, non-negative int or float from a CSV cell or JSON value. Raises ValueError."""
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if kind is int and isinstance(value, int):
+        number = value
+    elif kind is int and isinstance(value, str) and value.strip().lstrip("+-").isdigit():
+        number = int(value)
+    else:
+        number = float(value)
+        if not math.isfinite(number):
+            raise ValueError(value)
+        if kind is int:
+            if not number.is_integer():
+                raise ValueError(value)  # "3.7" is not a tank or an age in years
+            number = int(number)
+    if number < 0:
+        raise ValueError(value)
+    return number
+
+
+def normalize(record: dict) -> dict:
+    """Validate and coerce one inventory record. Raises ValueError."""
+    record = dict(record)
+    if "reptile_id" not in record and "id" in record:
+        record["reptile_id"] = record.pop("id")
+    doc = {}
+    for field, kind in _FIELDS.items():
+        value = record.get(field)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            if field in _REQUIRED:
+                raise ValueError(f"missing required field '{field}'")
+            continue
+        try:
+            doc[field] = str(value) if kind is str else _number(value, kind)
+        except (TypeError, ValueError):
+            raise ValueError(f"invalid {field} {value!r}")
+    if not doc["species"].strip():
+        raise ValueError("missing required field 'species'")
+    doc["species_key"] = species_key(doc["species"])
+    return doc
+
+
+def parse_records(body: bytes, content_type: str) -> List[dict]:
+    """Decode a CSV (text/csv) or NDJSON body into normalized records."""
+    text = body.decode("utf-8-sig")
+    if "csv" in content_type:
+        rows = enumerate(csv.DictReader(io.StringIO(text)), start=2)  # line 1 is the header
+    elif "ndjson" in content_type or "json" in content_type:
+        rows = []
+        for lineno, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append((lineno, json.loads(line)))
+            except ValueError:
+                raise ValueError(f"line {lineno}: invalid JSON")
+    else:
+        raise ValueError("Content-Type must be text/csv or application/x-ndjson")
+    docs = []
+    seen = set()
+    for lineno, row in rows:
+        if not isinstance(row, dict):
+            raise ValueError(f"line {lineno}: expected an object")
+        try:
+            doc = normalize(row)
+        except ValueError as e:
+            raise ValueError(f"line {lineno}: {e}")
+        if doc["reptile_id"] in seen:
+            raise ValueError(f"line {lineno}: duplicate reptile_id {doc['reptile_id']}")
+        seen.add(doc["reptile_id"])
+        docs.append(doc)
+    return docs
+
+
+async def bulk_upsert(collection, docs: List[dict]) -> Dict[str, int]:
+    """Insert or replace animals by reptile_id in unordered batches."""
+    result = {"received": len(docs), "inserted": 0, "updated": 0, "unchanged": 0}
+    for start in range(0, len(docs), IMPORT_BATCH_SIZE):
+        batch = docs[start:start + IMPORT_BATCH_SIZE]
+        res = await collection.bulk_write(
+            [ReplaceOne({"reptile_id": d["reptile_id"]}, d, upsert=True) for d in batch],
+            ordered=False,
+        )
+        result["inserted"] += res.upserted_count
+        result["updated"] += res.modified_count
+        result["unchanged"] += res.matched_count - res.modified_count
+    logger.info("Reptile import: %(received)d received, %(inserted)d inserted, %(updated)d updated", result)
+    return result
+
+
+def list_query(tank_id: Optional[int] = None, species: Optional[str] = None) -> dict:
+    query = {}
+    if tank_id is not None:
+        query["tank_id"] = tank_id
+    if species:
+        query["species_key"] = species_key(species)
+    return query
+
+
+def resolved_pipeline(tank_id: int, profiles_collection: str = "species_profiles") -> List[dict]:
+    """A tank's animals with habitat targets joined from their species profile."""
+    return [
+        {"$match": {"tank_id": tank_id}},
+        {"$lookup": {
+            "from": profiles_collection,
+            "localField": "species_key",
+            "foreignField": "species_key",
+            "pipeline": [
+                {"$project": {"_id": 0, "species_name": 1, **{f: 1 for f in _PROFILE_FIELDS}}},
+                {"$limit": 1},
+            ],
+            "as": "profile",
+        }},
+        {"$unwind": {"path": "$profile", "preserveNullAndEmptyArrays": True}},
+        {"$addFields": {
+            # an animal-level feeding interval overrides the species default
+            "feed_interval_days": {"$ifNull": ["$feed_interval_days", "$profile.feed_interval_days"]},
+        }},
+        {"$project": {"_id": 0, "species_key": 0, **{f: 0 for f in _LEGACY_FIELDS}}},
+        {"$sort": {"reptile_id": 1}},
+    ]
+
+
+async def tank_inventory(collection, tank_id: int) -> Tuple[List[dict], List[str]]:
+    """(animals, species without a profile) for a tank, in one aggregation."""
+    animals = await collection.aggregate(resolved_pipeline(tank_id)).to_list(length=None)
+    missing = sorted({a["species"] for a in animals if not a.get("profile")})
+    return animals, missing
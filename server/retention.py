@@ -0,0 +1,446 @@
+# Retention policy for sensor_readings.
+#
+# A background job walks closed UTC days in order. Every closed day gets
+# hourly and daily rollups (upserted into readings_hourly / readings_daily).
+# Days older than RETENTION_RAW_DAYS are then expired:
+#
+#   1. the day's rollups must already exist (rolled_through in retention_state)
+#   2. raw readings are optionally archived to compressed NDJSON files
+#      (<archive dir>/<tank_id>/<YYYY-MM-DD>.ndjson.zst, gzip when zstandard
+#      isn't installed) and the day is recorded as archived_through
+#   3. raw readings are deleted in bounded batches, then the day is
+#      recorded as expired_through
+#
+# Readings can arrive for a day after it was first rolled up, so its
+# rollups are recomputed from the complete raw day once more right before
+# it is archived and deleted (recorded as final_rolled_through when there
+# is no archive to recover from).
+#
+# Scheduled deletes are used instead of a TTL index because a TTL monitor
+# can remove documents before their rollups exist. Progress markers are
+# written before deleting, so a crash mid-expiry only ever resumes deletes.
+#
+# Readings can still arrive for a day that was already expired (spool
+# replay, the backfill tool). With an archive, the day's archived readings
+# are restored next to them (the dedup index drops copies), so rollups and
+# the archive files are rewritten from the complete day before deleting
+# again. Without one, the late readings are folded into the stored rollups.
+import asyncio
+import gzip
+import heapq
+import io
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+from server import ingest
+from server import invalidation
+from server import tank_stats
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+    logging.warning("zstandard module not available - readings will be archived with gzip")
+
+logger = logging.getLogger("retention")
+
+RETENTION_RAW_DAYS = int(os.getenv("RETENTION_RAW_DAYS", "0"))  # 0 disables expiry
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+RETENTION_DELETE_BATCH = int(os.getenv("RETENTION_DELETE_BATCH", "5000"))
+RETENTION_MAX_DAYS_PER_RUN = int(os.getenv("RETENTION_MAX_DAYS_PER_RUN", "7"))
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "")
+
+HOURLY_COLLECTION = "readings_hourly"
+DAILY_COLLECTION = "readings_daily"
+STATE_COLLECTION = "retention_state"
+
+ROLLUP_RESOLUTIONS = {"hourly": ("hour", HOURLY_COLLECTION), "daily": ("day", DAILY_COLLECTION)}
+
+_readings = None
+_db = None
+_retention_task = None
+
+
+async def initialize(db, readings_collection):
+    """Create the indexes the retention job and rollup queries rely on."""
+    global _db, _readings
+    _db = db
+    _readings = readings_collection
+    await _readings.create_index([("tank_id", 1), ("timestamp", 1)])
+    await _readings.create_index([("timestamp", 1)])
+    for _, coll in ROLLUP_RESOLUTIONS.values():
+        await _db[coll].create_index([("tank_id", 1), ("bucket", 1)], unique=True)
+
+
+def start():
+    """Start the rollup/expiry job. Must only run in one process (see server/leader.py)."""
+    global _retention_task
+    if _retention_task is None:
+        _retention_task = asyncio.create_task(_retention_loop())
+        if RETENTION_RAW_DAYS > 0:
+            logger.info("Retention enabled: raw readings kept for %d days", RETENTION_RAW_DAYS)
+
+
+async def cleanup():
+    global _retention_task
+    if _retention_task:
+        _retention_task.cancel()
+        try:
+            await _retention_task
+        except asyncio.CancelledError:
+            pass
+        _retention_task = None
+
+
+async def _retention_loop():
+    while True:
+        try:
+            await run_once()
+        except Exception as e:
+            logger.error("Retention run failed: %s", str(e))
+        await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+
+
+def _day_start(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def expiry_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Readings strictly before this (UTC midnight) are eligible for expiry."""
+    now = now or datetime.utcnow()
+    return _day_start(now - timedelta(days=RETENTION_RAW_DAYS))
+
+
+async def _get_state() -> dict:
+    return await _db[STATE_COLLECTION].find_one({"_id": "raw_readings"}) or {}
+
+
+async def rolled_through() -> Optional[datetime]:
+    """Last day whose rollups have been written, or None."""
+    return (await _get_state()).get("rolled_through")
+
+
+async def expired_through() -> Optional[datetime]:
+    """Last day whose raw readings have been expired, or None."""
+    return (await _get_state()).get("expired_through")
+
+
+async def _set_state(**fields):
+    await _db[STATE_COLLECTION].update_one({"_id": "raw_readings"}, {"$set": fields}, upsert=True)
+
+
+async def roll_up_closed_days(now: Optional[datetime] = None) -> int:
+    """Write rollups for up to RETENTION_MAX_DAYS_PER_RUN closed days. Returns days rolled."""
+    today = _day_start(now or datetime.utcnow())
+    rolled_through = (await _get_state()).get("rolled_through")
+    if rolled_through is None:
+        oldest = await _readings.find_one({}, {"timestamp": 1}, sort=[("timestamp", 1)])
+        if not oldest:
+            return 0
+        day = _day_start(oldest["timestamp"])
+    else:
+        day = rolled_through + timedelta(days=1)
+    rolled = 0
+    while day < today and rolled < RETENTION_MAX_DAYS_PER_RUN:
+        await write_rollups(day, day + timedelta(days=1))
+        await _set_state(rolled_through=day)
+        day += timedelta(days=1)
+        rolled += 1
+    return rolled
+
+
+async def run_once(now: Optional[datetime] = None) -> int:
+    """Roll up closed days, then expire raw readings past retention. Returns docs deleted."""
+    await roll_up_closed_days(now)
+    if RETENTION_RAW_DAYS <= 0:
+        return 0
+    cutoff = expiry_cutoff(now)
+    deleted = 0
+    for _ in range(RETENTION_MAX_DAYS_PER_RUN):
+        oldest = await _readings.find_one(
+            {"timestamp": {"$lt": cutoff}}, {"timestamp": 1}, sort=[("timestamp", 1)]
+        )
+        if not oldest:
+            break
+        day = _day_start(oldest["timestamp"])
+        rolled_through = (await _get_state()).get("rolled_through")
+        if rolled_through is None or rolled_through < day:
+            # rollups are behind; never expire data that hasn't been rolled up
+            logger.warning("Skipping expiry of %s: rollups not written yet", f"{day:%Y-%m-%d}")
+            break
+        deleted += await expire_day(day)
+    if deleted and not RETENTION_ARCHIVE_DIR:
+        # expired readings are gone rather than archived; cached history still has them
+        await invalidation.bump("history_cache")
+    return deleted
+
+
+# bucket start of a reading's timestamp, per rollup unit
+_BUCKET_PARTS = {
+    "hour": ("year", "month", "day", "hour"),
+    "day": ("year", "month", "day"),
+}
+_PART_OPERATORS = {"year": "$year", "month": "$month", "day": "$dayOfMonth", "hour": "$hour"}
+ROLLUP_METRICS = ("temp", "humidity")
+
+
+def _rollup_pipeline(match: dict, unit: str) -> List[dict]:
+    bucket = {"$dateFromParts": {part: {_PART_OPERATORS[part]: "$timestamp"} for part in _BUCKET_PARTS[unit]}}
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"tank_id": "$tank_id", "bucket": bucket},
+            "count": {"$sum": 1},
+            "temp_avg": {"$avg": "$temp"},
+            "temp_min": {"$min": "$temp"},
+            "temp_max": {"$max": "$temp"},
+            "humidity_avg": {"$avg": "$humidity"},
+            "humidity_min": {"$min": "$humidity"},
+            "humidity_max": {"$max": "$humidity"},
+            "light_on_count": {"$sum": {"$cond": ["$light", 1, 0]}},
+        }},
+    ]
+
+
+def _combine_rollups(old: dict, new: dict) -> dict:
+    """One rollup covering the readings of both."""
+    out = dict(new, count=old["count"] + new["count"],
+               light_on_count=old.get("light_on_count", 0) + new["light_on_count"])
+    for metric in ROLLUP_METRICS:
+        avgs = [(r[f"{metric}_avg"], r["count"]) for r in (old, new) if r.get(f"{metric}_avg") is not None]
+        out[f"{metric}_avg"] = sum(a * n for a, n in avgs) / sum(n for _, n in avgs) if avgs else None
+        lows = [r[f"{metric}_min"] for r in (old, new) if r.get(f"{metric}_min") is not None]
+        highs = [r[f"{metric}_max"] for r in (old, new) if r.get(f"{metric}_max") is not None]
+        out[f"{metric}_min"] = min(lows) if lows else None
+        out[f"{metric}_max"] = max(highs) if highs else None
+    return out
+
+
+async def write_rollups(start: datetime, end: datetime, merge: bool = False):
+    """Write hourly and daily rollups for [start, end) into their collections.
+
+    Rollups are replaced by ones computed from the raw readings in range;
+    with `merge` those readings are added to the rollups already stored
+    instead, for days whose other raw readings are gone.
+    """
+    match = {"timestamp": {"$gte": start, "$lt": end}}
+    for unit, coll in ROLLUP_RESOLUTIONS.values():
+        groups = await _readings.aggregate(_rollup_pipeline(match, unit)).to_list(length=None)
+        ops = []
+        for group in groups:
+            key = {"tank_id": group["_id"]["tank_id"], "bucket": group["_id"]["bucket"]}
+            rollup = {**key, **{k: v for k, v in group.items() if k != "_id"}}
+            if merge:
+                stored = await _db[coll].find_one(key, {"_id": 0})
+                if stored:
+                    rollup = _combine_rollups(stored, rollup)
+            ops.append(ReplaceOne(key, rollup, upsert=True))
+        if ops:
+            await _db[coll].bulk_write(ops, ordered=False)
+
+
+def _archive_path(tank_id, day: datetime, ext: str) -> str:
+    return os.path.join(RETENTION_ARCHIVE_DIR, str(tank_id), f"{day:%Y-%m-%d}.ndjson.{ext}")
+
+
+def _open_archive_writer(path: str):
+    raw = open(path, "wb")
+    if ZSTD_AVAILABLE:
+        return raw, zstandard.ZstdCompressor(level=10).stream_writer(raw)
+    return raw, gzip.GzipFile(fileobj=raw, mode="wb")
+
+
+async def archive_day(start: datetime, end: datetime):
+    """Write each tank's raw readings for the day to its own compressed file."""
+    ext = "zst" if ZSTD_AVAILABLE else "gz"
+    tank_ids = await _readings.distinct("tank_id", {"timestamp": {"$gte": start, "$lt": end}})
+    for tank_id in tank_ids:
+        path = _archive_path(tank_id, start, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        raw, writer = _open_archive_writer(tmp)
+        try:
+            cursor = _readings.find(
+                {"tank_id": tank_id, "timestamp": {"$gte": start, "$lt": end}}
+            ).sort("timestamp", 1)
+            async for doc in cursor:
+                doc["_id"] = str(doc["_id"])
+                doc["timestamp"] = doc["timestamp"].isoformat()
+                writer.write((json.dumps(doc) + "\n").encode())
+        finally:
+            writer.close()
+            raw.close()
+        # rename last so a partially written archive is never read back
+        os.replace(tmp, path)
+
+
+async def restore_day(start: datetime, end: datetime, tank_ids: Optional[Iterable[int]] = None) -> int:
+    """Put archived readings of [start, end) back into the raw collection.
+
+    Only tanks with raw readings in range are restored unless `tank_ids` is
+    given. Readings already present are skipped. Returns the number restored.
+    """
+    if not RETENTION_ARCHIVE_DIR:
+        return 0
+    if tank_ids is None:
+        tank_ids = await _readings.distinct("tank_id", {"timestamp": {"$gte": start, "$lt": end}})
+    restored = 0
+    for tank_id in tank_ids:
+        docs = await read_archive_async(tank_id, start, end)
+        for doc in docs:
+            # keep the original ids so a second restore matches them
+            if ObjectId.is_valid(doc.get("_id")):
+                doc["_id"] = ObjectId(doc["_id"])
+            else:
+                doc.pop("_id", None)
+        if docs:
+            inserted, _ = await ingest.insert_new(_readings, docs)
+            restored += inserted
+    return restored
+
+
+async def expire_day(day: datetime) -> int:
+    """Archive (if configured) and delete a rolled-up day of raw readings."""
+    start, end = day, day + timedelta(days=1)
+    state = await _get_state()
+    archived_through = state.get("archived_through")
+    expired_through = state.get("expired_through")
+    final_rolled_through = state.get("final_rolled_through")
+    if RETENTION_ARCHIVE_DIR:
+        if archived_through is not None and archived_through >= start:
+            # readings arrived after the day was archived: complete the day
+            # from its archive, then roll it up and archive it again
+            restored = await restore_day(start, end)
+            logger.info("Re-archiving %s with %d archived readings restored", f"{day:%Y-%m-%d}", restored)
+        # late readings may have arrived since the day was first rolled up
+        await write_rollups(start, end)
+        await archive_day(start, end)
+        if archived_through is None or archived_through < start:
+            await _set_state(archived_through=start)
+    elif expired_through is not None and expired_through >= start:
+        # the day's earlier raw readings are gone; add these to its rollups
+        await write_rollups(start, end, merge=True)
+        logger.info("Folded late readings for %s into its rollups", f"{day:%Y-%m-%d}")
+    elif final_rolled_through is None or final_rolled_through < start:
+        # the raw day is still complete: roll it up once more so readings
+        # that arrived since it was first rolled up are counted
+        await write_rollups(start, end)
+        await _set_state(final_rolled_through=start)
+    # else a previous expiry of the day was interrupted mid-delete; its
+    # rollups were recomputed before deleting began
+
+    deleted = 0
+    query = {"timestamp": {"$gte": start, "$lt": end}}
+    while True:
+        ids = [d["_id"] async for d in _readings.find(query, {"_id": 1}).limit(RETENTION_DELETE_BATCH)]
+        if not ids:
+            break
+        res = await _readings.delete_many({"_id": {"$in": ids}})
+        deleted += res.deleted_count
+        # yield between batches so ingest isn't starved by a large expiry
+        await asyncio.sleep(0)
+    if expired_through is None or expired_through < start:
+        await _set_state(expired_through=start)
+    logger.info("Expired %d raw readings for %s", deleted, f"{day:%Y-%m-%d}")
+    return deleted
+
+
+def _read_archive_file(path: str) -> List[dict]:
+    with open(path, "rb") as raw:
+        if path.endswith(".zst"):
+            if not ZSTD_AVAILABLE:
+                logger.warning("Skipping %s: zstandard module not available", path)
+                return []
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        else:
+            stream = gzip.GzipFile(fileobj=raw, mode="rb")
+        docs = []
+        for line in io.TextIOWrapper(stream, encoding="utf-8"):
+            if line.strip():
+                doc = json.loads(line)
+                doc["timestamp"] = datetime.fromisoformat(doc["timestamp"])
+                docs.append(doc)
+        return docs
+
+
+def _archive_files(tank_id: int, since: Optional[datetime], until: Optional[datetime]) -> List[tuple]:
+    """(day, path) of a tank's archive files overlapping [since, until), oldest first."""
+    tank_dir = os.path.join(RETENTION_ARCHIVE_DIR, str(tank_id))
+    if not os.path.isdir(tank_dir):
+        return []
+    files = []
+    for name in sorted(os.listdir(tank_dir)):
+        if not (name.endswith(".ndjson.zst") or name.endswith(".ndjson.gz")):
+            continue
+        day = datetime.strptime(name.split(".", 1)[0], "%Y-%m-%d")
+        if since and day + timedelta(days=1) <= since:
+            continue
+        if until and day >= until:
+            continue
+        files.append((day, os.path.join(tank_dir, name)))
+    return files
+
+
+def read_archive(tank_id: int, since: Optional[datetime] = None,
+                 until: Optional[datetime] = None) -> List[dict]:
+    """Return archived raw readings for a tank within [since, until), oldest first."""
+    if not RETENTION_ARCHIVE_DIR:
+        return []
+    # archived timestamps are naive UTC; query params may carry an offset
+    since = tank_stats._naive_utc(since) if since else None
+    until = tank_stats._naive_utc(until) if until else None
+    docs: List[dict] = []
+    for _, path in _archive_files(tank_id, since, until):
+        for doc in _read_archive_file(path):
+            ts = doc["timestamp"]
+            if (since is None or ts >= since) and (until is None or ts < until):
+                docs.append(doc)
+    return docs
+
+
+async def iter_archive(tank_ids: Iterable[int], since: Optional[datetime] = None,
+                       until: Optional[datetime] = None) -> AsyncIterator[List[dict]]:
+    """Archived readings of several tanks in timestamp order, one day in memory at a time."""
+    if not RETENTION_ARCHIVE_DIR:
+        return
+    tank_ids = list(tank_ids)
+    since = tank_stats._naive_utc(since) if since else None
+    until = tank_stats._naive_utc(until) if until else None
+    days = set()
+    for tank_id in tank_ids:
+        days.update(day for day, _ in await asyncio.to_thread(_archive_files, tank_id, since, until))
+    for day in sorted(days):
+        lo = max(since, day) if since else day
+        hi = min(until, day + timedelta(days=1)) if until else day + timedelta(days=1)
+        per_tank = await asyncio.gather(*(read_archive_async(t, lo, hi) for t in tank_ids))
+        docs = list(heapq.merge(*per_tank, key=lambda d: d["timestamp"]))
+        if docs:
+            yield docs
+
+
+async def read_archive_async(tank_id: int, since: Optional[datetime] = None,
+                             until: Optional[datetime] = None) -> List[dict]:
+    # decompression is CPU and disk bound; keep it off the event loop
+    return await asyncio.to_thread(read_archive, tank_id, since, until)
+
+
+async def get_rollups(tank_id: int, resolution: str, since: Optional[datetime] = None,
+                      until: Optional[datetime] = None) -> List[dict]:
+    if resolution not in ROLLUP_RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {', '.join(ROLLUP_RESOLUTIONS)}")
+    query: dict = {"tank_id": tank_id}
+    if since or until:
+        query["bucket"] = {}
+        if since:
+            query["bucket"]["$gte"] = since
+        if until:
+            query["bucket"]["$lt"] = until
+    coll = _db[ROLLUP_RESOLUTIONS[resolution][1]]
+    return await coll.find(query, {"_id": 0}).sort("bucket", 1).to_list(length=None)
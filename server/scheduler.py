@@ -0,0 +1,306 @@
+# Photoperiod and basking scheduler.
+#
+# Each tank's light and basking outlets follow its species profile: lights
+# come on at PHOTOPERIOD_START (server local time) for `daylight_hours`, and
+# when `requires_basking` is set the basking lamp runs for
+# `basking_duration_minutes` centred in the daylight period. A role whose
+# window covers the whole day (24 daylight hours) is simply kept on.
+#
+# Nothing is switched unless a tank's outlets are assigned explicitly, via
+# the powerstrip registry or an `outlets` entry in sensor_interface.TANKS.
+#
+# The scheduler keeps a heap with exactly one pending transition per
+# (tank, role). Transitions due within SCHEDULE_COALESCE_SECONDS of the
+# earliest one form a group: it sleeps until the last of the group is due
+# (or until woken by a reschedule), so nothing is switched early, pops
+# everything due, groups the changes per device and sends one batched
+# command to each device concurrently (see powerstrip_registry for
+# multi-strip setups).
+# When species profiles change, only tanks whose schedule-relevant fields
+# changed are recomputed; their old heap entries are skipped lazily via a
+# per-tank generation counter.
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, time as dtime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from server import invalidation
+from server import powerstrip_registry
+from server import sensor_interface
+from server import tank_stats
+from server import tracing
+
+logger = logging.getLogger("scheduler")
+
+PHOTOPERIOD_START = os.getenv("PHOTOPERIOD_START", "07:00")
+# transitions due within this many seconds of the first are sent together,
+# when the last of them is due
+SCHEDULE_COALESCE_SECONDS = float(os.getenv("SCHEDULE_COALESCE_SECONDS", "60"))
+# a failed outlet command is retried after this long
+SCHEDULE_RETRY_SECONDS = float(os.getenv("SCHEDULE_RETRY_SECONDS", "60"))
+
+ROLES = ("lights", "basking_lamp")
+
+
+def _start_time() -> dtime:
+    hours, minutes = PHOTOPERIOD_START.split(":")
+    return dtime(int(hours), int(minutes))
+
+
+def schedule_signature(profile: dict) -> Tuple:
+    """The profile fields that affect outlet timing."""
+    return (
+        profile.get("daylight_hours", 12),
+        profile.get("requires_basking", True),
+        profile.get("basking_duration_minutes", 60),
+    )
+
+
+def _windows_for_day(profile: dict, day, role: str) -> Optional[Tuple[datetime, datetime]]:
+    daylight_hours, requires_basking, basking_minutes = schedule_signature(profile)
+    lights_on = datetime.combine(day, _start_time())
+    lights_off = lights_on + timedelta(hours=max(0, min(24, daylight_hours)))
+    if role == "lights":
+        return lights_on, lights_off
+    if not requires_basking or basking_minutes <= 0:
+        return None
+    mid = lights_on + (lights_off - lights_on) / 2
+    half = timedelta(minutes=basking_minutes) / 2
+    return max(lights_on, mid - half), min(lights_off, mid + half)
+
+
+def _always_on(profile: dict, role: str, day) -> bool:
+    # back-to-back daily windows would put one day's "off" at the same
+    # instant as the next day's "on"; there is nothing to switch
+    window = _windows_for_day(profile, day, role)
+    return window is not None and window[1] - window[0] >= timedelta(days=1)
+
+
+def transitions(profile: dict, role: str, around: datetime) -> List[Tuple[datetime, str]]:
+    """On/off transitions for `role` on the days around `around`, in time order."""
+    if _always_on(profile, role, around.date()):
+        return []
+    out = []
+    for offset in (-1, 0, 1):
+        window = _windows_for_day(profile, (around + timedelta(days=offset)).date(), role)
+        if window and window[0] < window[1]:
+            out.append((window[0], "on"))
+            out.append((window[1], "off"))
+    return sorted(out)
+
+
+def next_transition(profile: dict, role: str, after: datetime) -> Optional[Tuple[datetime, str]]:
+    for when, action in transitions(profile, role, after):
+        if when > after:
+            return when, action
+    return None
+
+
+def desired_state(profile: dict, role: str, now: datetime) -> str:
+    if _always_on(profile, role, now.date()):
+        return "on"
+    state = "off"
+    for when, action in transitions(profile, role, now):
+        if when <= now:
+            state = action
+    return state
+
+
+def outlets_for_tank(tank_id: int) -> Dict[str, Tuple[Optional[str], int]]:
+    """role -> (device_id, 1-based outlet index).
+
+    Registry assignments win; roles only listed in the TANKS config map to
+    the default powerstrip (device_id None).
+    """
+    config = sensor_interface.TANKS.get(tank_id) or {}
+    outlets = {role: (None, index) for role, index in config.get("outlets", {}).items()}
+    outlets.update(powerstrip_registry.outlets_for_tank(tank_id))
+    return outlets
+
+
+def scheduled_tanks() -> List[int]:
+    return sorted(set(sensor_interface.TANKS) | set(powerstrip_registry.mapped_tanks()))
+
+
+class PhotoperiodScheduler:
+    def __init__(self, powerstrip):
+        self.powerstrip = powerstrip
+        # (when, seq, tank_id, generation, role, action, is_retry)
+        self._heap: List[Tuple[datetime, int, int, int, str, str, bool]] = []
+        self._seq = itertools.count()
+        self._generation: Dict[int, int] = defaultdict(int)
+        self._signatures: Dict[int, Tuple] = {}
+        self._profiles: Dict[int, dict] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _push(self, tank_id: int, role: str, after: datetime):
+        nxt = next_transition(self._profiles[tank_id], role, after)
+        if nxt:
+            when, action = nxt
+            heapq.heappush(self._heap, (when, next(self._seq), tank_id, self._generation[tank_id], role, action, False))
+
+    def schedule_tank(self, tank_id: int, profile: dict, now: datetime) -> Dict[str, str]:
+        """(Re)compute a tank's pending transitions. Returns the state each role should be in now."""
+        self._generation[tank_id] += 1
+        self._profiles[tank_id] = profile
+        self._signatures[tank_id] = schedule_signature(profile)
+        roles = [r for r in ROLES if r in outlets_for_tank(tank_id)]
+        for role in roles:
+            self._push(tank_id, role, now)
+        self._wake.set()
+        return {role: desired_state(profile, role, now) for role in roles}
+
+    def unschedule_tank(self, tank_id: int):
+        self._generation[tank_id] += 1
+        self._profiles.pop(tank_id, None)
+        self._signatures.pop(tank_id, None)
+
+    async def sync_all(self, now: Optional[datetime] = None):
+        """Schedule every configured tank whose profile changed and apply its current state."""
+        now = now or datetime.now()
+        changes = []
+        for tank_id in scheduled_tanks():
+            if not outlets_for_tank(tank_id):
+                continue
+            profile = await tank_stats.profile_for_tank(tank_id)
+            if profile is None:
+                if tank_id in self._profiles:
+                    self.unschedule_tank(tank_id)
+                continue
+            if self._signatures.get(tank_id) == schedule_signature(profile):
+                continue
+            for role, action in self.schedule_tank(tank_id, profile, now).items():
+                changes.append((tank_id, role, action))
+        if changes:
+            logger.info("Scheduled %d tank(s)", len({c[0] for c in changes}))
+            await self._apply(changes)
+
+    async def _apply(self, changes: List[Tuple[int, str, str]]):
+        # one batched command per device, all devices at once
+        per_device: Dict[Optional[str], Dict[int, str]] = defaultdict(dict)
+        sources: Dict[Optional[str], List[Tuple[int, str, str]]] = defaultdict(list)
+        for tank_id, role, action in changes:
+            target = outlets_for_tank(tank_id).get(role)
+            if target is not None:
+                device_id, index = target
+                per_device[device_id][index] = action
+                sources[device_id].append((tank_id, role, action))
+
+        async def send(device_id, batch):
+            name = device_id or "default"
+            try:
+                if device_id is None:
+                    await self.powerstrip.set_outlet_states(batch)
+                else:
+                    await powerstrip_registry.set_outlet_states(device_id, batch)
+                await tracing.actuated(tank_id for tank_id, _, _ in sources[device_id])
+                logger.info("Applied %d outlet change(s) on %s", len(batch), name)
+            except Exception as e:
+                logger.warning("Failed to apply scheduled outlet changes on %s: %s", name, str(e))
+                retry_at = datetime.now() + timedelta(seconds=SCHEDULE_RETRY_SECONDS)
+                for tank_id, role, action in sources[device_id]:
+                    heapq.heappush(self._heap, (retry_at, next(self._seq), tank_id,
+                                                self._generation[tank_id], role, action, True))
+
+        await asyncio.gather(*(send(d, b) for d, b in per_device.items()))
+
+    def _drop_superseded(self):
+        while self._heap and self._heap[0][3] != self._generation[self._heap[0][2]]:
+            heapq.heappop(self._heap)
+
+    def _group_due_at(self) -> Optional[datetime]:
+        """When the last live transition within SCHEDULE_COALESCE_SECONDS of the earliest one is due.
+
+        Waiting for it, rather than firing the group when the first is due,
+        coalesces the group without switching anything before its time.
+        """
+        self._drop_superseded()
+        if not self._heap:
+            return None
+        horizon = self._heap[0][0] + timedelta(seconds=SCHEDULE_COALESCE_SECONDS)
+        return max(e[0] for e in self._heap if e[0] <= horizon and e[3] == self._generation[e[2]])
+
+    def _pop_due(self, now: datetime) -> List[Tuple[int, str, str]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, _, tank_id, generation, role, action, is_retry = heapq.heappop(self._heap)
+            if generation != self._generation[tank_id]:
+                continue  # superseded by a reschedule
+            due.append((tank_id, role, action))
+            if not is_retry:
+                self._push(tank_id, role, when)
+        return due
+
+    async def run(self):
+        while True:
+            self._wake.clear()
+            due_at = self._group_due_at()
+            delay = max(0.0, (due_at - datetime.now()).total_seconds()) if due_at else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                continue  # rescheduled; recompute the sleep
+            except asyncio.TimeoutError:
+                pass
+            due = self._pop_due(datetime.now())
+            if due:
+                await self._apply(due)
+
+    def status(self) -> List[dict]:
+        live = [e for e in self._heap if e[3] == self._generation[e[2]]]
+        return [
+            {"tank_id": tank_id, "role": role, "action": action, "at": when, "retry": is_retry}
+            for when, _, tank_id, _, role, action, is_retry in sorted(live)
+        ]
+
+
+_scheduler: Optional[PhotoperiodScheduler] = None
+
+
+def _on_profiles_changed():
+    if _scheduler is not None:
+        asyncio.get_running_loop().create_task(_scheduler.sync_all())
+
+
+def _on_outlets_changed():
+    # a reassigned outlet changes where transitions go, not when; force a
+    # reschedule so the new outlet is brought to the current state
+    if _scheduler is not None:
+        asyncio.get_running_loop().create_task(_resync_outlets(_scheduler))
+
+
+async def _resync_outlets(sched: "PhotoperiodScheduler"):
+    await powerstrip_registry.reload()  # don't race the registry's own reload
+    sched._signatures.clear()
+    await sched.sync_all()
+
+
+async def start(powerstrip):
+    """Start scheduling; runs with the other single-instance background services."""
+    global _scheduler
+    if _scheduler is not None:
+        return
+    _scheduler = PhotoperiodScheduler(powerstrip)
+    invalidation.register("species_profiles", _on_profiles_changed)
+    invalidation.register("powerstrip_registry", _on_outlets_changed)
+    await _scheduler.sync_all()
+    _scheduler._task = asyncio.create_task(_scheduler.run())
+
+
+async def cleanup():
+    global _scheduler
+    if _scheduler is None:
+        return
+    invalidation.unregister("species_profiles", _on_profiles_changed)
+    invalidation.unregister("powerstrip_registry", _on_outlets_changed)
+    if _scheduler._task:
+        _scheduler._task.cancel()
+        try:
+            await _scheduler._task
+        except asyncio.CancelledError:
+            pass
+    _scheduler = None
@@ -1,9 +1,14 @@
 # this file orchestrates the data coming from the sensors and sends it to the server
 import time
 import os
+import uuid
+from datetime import datetime
 import requests
-from requests.exceptions import RequestException
+from requests.exceptions import HTTPError, RequestException
 from models.tank import Tank
+from server.spool import Spool
+from server import logconfig
+from server import tracing
 import asyncio
 import logging
 
@@ -11,9 +16,17 @@ logger = logging.getLogger(__name__)
 
 # configure the REST endpoint (override via environment)
 SERVER_API_URL = os.getenv("SERVER_API_URL", "http://localhost:8000/api/readings")
+SERVER_BULK_API_URL = os.getenv("SERVER_BULK_API_URL", SERVER_API_URL.rstrip("/") + "/bulk")
+
+# spool replay: batch size, pause between batches (rate limit) and idle re-check
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", "500"))
+SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", "0.5"))
+SPOOL_REPLAY_IDLE_SECONDS = float(os.getenv("SPOOL_REPLAY_IDLE_SECONDS", "5"))
 
 # Store the polling task so we can cancel it on shutdown
 _polling_task = None
+_replay_task = None
+_spool = None
 
 # Sample tank configuration - can be expanded to read from database
 TANKS = {
@@ -22,6 +35,8 @@ TANKS = {
         "target_temp": 29.0,
         "target_humidity": 40.0,
         "reptile_species": "Leopard Gecko"
+        # add e.g. "outlets": {"lights": 2, "basking_lamp": 4} (1-based outlets
+        # on the KASA_DEVICE_IP strip) to have the photoperiod scheduler drive them
     },
     2: {
         "name": "Tank 2 (Bearded Dragon)",
@@ -39,7 +54,13 @@ TANKS = {
 
 async def initialize():
     """Start the sensor polling loop in the background."""
-    global _polling_task
+    global _polling_task, _replay_task, _spool
+    try:
+        _spool = Spool()
+        _replay_task = asyncio.create_task(replay_spool_async())
+    except OSError as e:
+        # keep polling even if the spool directory isn't writable
+        logger.warning("Spool unavailable, failed posts will be dropped: %s", str(e))
     try:
         # Start polling sensors asynchronously
         _polling_task = asyncio.create_task(poll_sensors_async())
@@ -62,40 +83,142 @@ async def poll_sensors_async():
                     light=True
                 )
                 data = tank.get_habitat_readings()
+                # stamp at sample time so a retried POST is recognised as the same reading
+                data["timestamp"] = datetime.utcnow().isoformat()
+                data["reading_id"] = uuid.uuid4().hex
                 update_server(data)
-                logger.info(
-                    f"Tank {tank_id} ({tank_config['name']}): "
-                    f"temp={data['temp']}°C, humidity={data['humidity']}%, light={data['light']}"
-                )
+                extra = logconfig.sample("poll", tank_id)
+                if extra:
+                    logger.info("Tank %s (%s): temp=%s°C, humidity=%s%%, light=%s", tank_id, tank_config["name"],
+                                data["temp"], data["humidity"], data["light"], extra=extra)
         except Exception as e:
             logger.error("Error polling sensors: %s", str(e))
 
         await asyncio.sleep(5)  # Poll every 5 seconds
 
 
+async def replay_spool_async():
+    """Drain spooled readings through the bulk ingest endpoint at a bounded rate."""
+    while True:
+        try:
+            if await replay_once():
+                await asyncio.sleep(SPOOL_REPLAY_INTERVAL)
+                continue
+        except Exception as e:
+            logger.error("Error replaying spool: %s", str(e))
+        await asyncio.sleep(SPOOL_REPLAY_IDLE_SECONDS)
+
+
+async def replay_once() -> bool:
+    """Send the next spooled batch. Returns True when the spool advanced."""
+    if _spool is None or not _spool.pending():
+        return False
+    batch, offset = _spool.read_batch(SPOOL_REPLAY_BATCH)
+    if batch and not await asyncio.to_thread(_deliver, batch):
+        return False
+    _spool.commit(*offset)
+    if batch:
+        logger.info("Replayed %d spooled readings", len(batch))
+    return True
+
+
+def _deliver(batch) -> bool:
+    """Post a batch, setting aside readings the server rejects. False means retry later.
+
+    A rejected batch is split in halves until the offending readings are
+    isolated; re-sending the halves that were already accepted is harmless.
+    """
+    try:
+        return post_batch(batch)
+    except BatchRejected as e:
+        if len(batch) > 1:
+            mid = len(batch) // 2
+            return _deliver(batch[:mid]) and _deliver(batch[mid:])
+        path = _spool.dead_letter(batch, str(e))
+        logger.error("Server rejected spooled reading %s (%s); moved to %s",
+                     batch[0].get("reading_id"), e, path)
+        return True
+
+
 async def cleanup():
     """Cleanup sensor interface on shutdown."""
-    global _polling_task
-    if _polling_task:
-        _polling_task.cancel()
-        try:
-            await _polling_task
-        except asyncio.CancelledError:
-            pass
+    global _polling_task, _replay_task
+    for task in (_polling_task, _replay_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    _polling_task = _replay_task = None
+    if _spool is not None:
+        _spool.close()
     logger.info("Sensor interface cleanup complete")
 
 
+class BatchRejected(Exception):
+    """The server refused the readings themselves; re-sending them can't succeed."""
+
+
+def _retryable(status: int) -> bool:
+    return status >= 500 or status in (408, 429)
+
+
+def _rejected(e: RequestException) -> bool:
+    return isinstance(e, HTTPError) and e.response is not None and not _retryable(e.response.status_code)
+
+
+def post_batch(batch):
+    """POST a batch of readings to the bulk endpoint.
+
+    Returns True on success and False when the server is unavailable or
+    busy; raises BatchRejected when it refuses the batch (4xx).
+    """
+    try:
+        resp = requests.post(SERVER_BULK_API_URL, json=batch, timeout=30)
+        resp.raise_for_status()
+        return True
+    except RequestException as e:
+        if _rejected(e):
+            raise BatchRejected(f"{e.response.status_code} {e.response.text[:200]}")
+        logger.debug("Spool replay deferred, server unavailable: %s", e)
+        return False
+
+
+def _trace_headers(data) -> dict:
+    if not data.get("reading_id"):
+        return {}
+    return {
+        tracing.TRACEPARENT_HEADER: tracing.traceparent(data["reading_id"]),
+        tracing.SENT_AT_HEADER: f"{time.time():.6f}",
+    }
+
+
 def update_server(data):
     """Send sensor data to the REST API instead of writing directly to the DB."""
     try:
-        resp = requests.post(SERVER_API_URL, json=data, timeout=5)
+        resp = requests.post(SERVER_API_URL, json=data, headers=_trace_headers(data), timeout=5)
         resp.raise_for_status()
-        logger.debug(f"Successfully posted sensor data to server: {resp.status_code}")
+        logger.debug("Successfully posted sensor data to server: %s", resp.status_code)
     except RequestException as e:
+        if _rejected(e):
+            # invalid, not undelivered: spooling it would only block the replay
+            logger.error("Server rejected sensor data for tank %s: %s", data.get("id"), e)
+            return
         # simple single retry
         try:
-            resp = requests.post(SERVER_API_URL, json=data, timeout=5)
+            resp = requests.post(SERVER_API_URL, json=data, headers=_trace_headers(data), timeout=5)
             resp.raise_for_status()
-            logger.debug(f"Posted sensor data to server on retry: {resp.status_code}")
+            logger.debug("Posted sensor data to server on retry: %s", resp.status_code)
         except RequestException as e2:
-            logger.error(f"Failed to post sensor data to server: {e2}")
+            if _rejected(e2):
+                logger.error("Server rejected sensor data for tank %s: %s", data.get("id"), e2)
+                return
+            if _spool is not None:
+                _spool.append(data)
+            extra = logconfig.sample("post_error", data.get("id"))
+            if extra:
+                if _spool is not None:
+                    logger.warning("Failed to post sensor data to server, spooled for replay: %s", e2, extra=extra)
+                else:
+                    logger.error("Failed to post sensor data to server: %s", e2, extra=extra)
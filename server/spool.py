@@ -0,0 +1,199 @@
+# Disk-backed store-and-forward spool for the sensor poller.
+#
+# Readings that can't be posted are appended to a write-ahead log made of
+# fixed-size, memory-mapped segment files (segment-<seq>.log). Each record
+# is a 4 byte length, a 4 byte crc32 and a JSON payload; a zero length marks
+# the end of the written part of a segment. The replayer drains the spool in
+# batches and only then advances the read offset, which is persisted with an
+# atomic rename, so a crash at any point re-sends rather than loses readings
+# (ingest dedup keys make the re-send harmless). Readings the server refuses
+# as invalid are moved to rejected.ndjson so they can't block the spool.
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("spool")
+
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(os.getcwd(), "spool"))
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(256 * 1024 * 1024)))
+
+RECORD_HEADER = struct.Struct("<II")
+OFFSET_FILE = "offset.json"
+DEAD_LETTER_FILE = "rejected.ndjson"
+
+
+def _segment_name(seq: int) -> str:
+    return f"segment-{seq:010d}.log"
+
+
+class Spool:
+    """Append-only segment log with a crash-safe committed read offset."""
+
+    def __init__(self, directory: str = SPOOL_DIR, segment_bytes: int = SPOOL_SEGMENT_BYTES,
+                 max_bytes: int = SPOOL_MAX_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._write_seq: Optional[int] = None
+        self._write_pos = 0
+        self._mm: Optional[mmap.mmap] = None
+        self._fd: Optional[int] = None
+        self.read_seq, self.read_pos = self._load_offset()
+        segments = self.segments()
+        if segments:
+            self._open_for_append(segments[-1])
+        if self.read_seq < (segments[0] if segments else 0):
+            self.read_seq, self.read_pos = (segments[0] if segments else 0), 0
+
+    # ---- segment bookkeeping -------------------------------------------
+
+    def segments(self) -> List[int]:
+        seqs = []
+        for name in os.listdir(self.directory):
+            if name.startswith("segment-") and name.endswith(".log"):
+                seqs.append(int(name[len("segment-"):-len(".log")]))
+        return sorted(seqs)
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, _segment_name(seq))
+
+    def _scan_end(self, buf) -> int:
+        """Return the end of the last intact record; a torn write ends the segment."""
+        pos = 0
+        limit = len(buf)
+        while pos + RECORD_HEADER.size <= limit:
+            length, crc = RECORD_HEADER.unpack_from(buf, pos)
+            end = pos + RECORD_HEADER.size + length
+            if length == 0 or end > limit:
+                break
+            if zlib.crc32(buf[pos + RECORD_HEADER.size:end]) != crc:
+                logger.warning("Spool segment has a torn record at byte %d; truncating", pos)
+                break
+            pos = end
+        return pos
+
+    def _open_for_append(self, seq: int):
+        self._close_writer()
+        path = self._path(seq)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(fd).st_size < self.segment_bytes:
+            os.ftruncate(fd, self.segment_bytes)
+        mm = mmap.mmap(fd, self.segment_bytes)
+        self._fd, self._mm, self._write_seq = fd, mm, seq
+        self._write_pos = self._scan_end(mm)
+        # zero anything past a torn record so it can't be mistaken for data later
+        if self._write_pos + RECORD_HEADER.size <= self.segment_bytes:
+            mm[self._write_pos:self._write_pos + RECORD_HEADER.size] = b"\0" * RECORD_HEADER.size
+
+    def _close_writer(self):
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm.close()
+            self._mm = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def close(self):
+        self._close_writer()
+
+    def size_bytes(self) -> int:
+        return len(self.segments()) * self.segment_bytes
+
+    # ---- offsets -------------------------------------------------------
+
+    def _load_offset(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, OFFSET_FILE)) as f:
+                data = json.load(f)
+            return int(data["segment"]), int(data["position"])
+        except (OSError, ValueError, KeyError):
+            return 0, 0
+
+    def commit(self, seq: int, pos: int):
+        """Persist the read offset atomically and delete fully consumed segments."""
+        path = os.path.join(self.directory, OFFSET_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": seq, "position": pos}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self.read_seq, self.read_pos = seq, pos
+        for old in self.segments():
+            if old < seq:
+                os.remove(self._path(old))
+
+    # ---- append / read -------------------------------------------------
+
+    def append(self, reading: dict):
+        payload = json.dumps(reading, default=str).encode()
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        if len(record) + RECORD_HEADER.size > self.segment_bytes:
+            raise ValueError("Reading is larger than a spool segment")
+        if self._mm is None or self._write_pos + len(record) + RECORD_HEADER.size > self.segment_bytes:
+            self._rotate()
+        self._mm[self._write_pos:self._write_pos + len(record)] = record
+        self._write_pos += len(record)
+
+    def _rotate(self):
+        seq = 0 if self._write_seq is None else self._write_seq + 1
+        self._open_for_append(seq)
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        segments = self.segments()
+        dropped = 0
+        while len(segments) > 1 and len(segments) * self.segment_bytes > self.max_bytes:
+            os.remove(self._path(segments.pop(0)))
+            dropped += 1
+        if dropped:
+            logger.warning("Spool over %d bytes; dropped %d oldest segment(s)", self.max_bytes, dropped)
+            if self.read_seq < segments[0]:
+                self.commit(segments[0], 0)
+
+    def read_batch(self, max_records: int) -> Tuple[List[dict], Tuple[int, int]]:
+        """Return up to max_records unacknowledged readings and the offset after them.
+
+        Call commit() with the returned offset once the batch is acknowledged.
+        """
+        out: List[dict] = []
+        seq, pos = self.read_seq, self.read_pos
+        for s in self.segments():
+            if s < seq:
+                continue
+            if s > seq:
+                seq, pos = s, 0
+            with open(self._path(s), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    end = self._write_pos if s == self._write_seq else self._scan_end(buf)
+                    while pos < end and len(out) < max_records:
+                        length, _ = RECORD_HEADER.unpack_from(buf, pos)
+                        start = pos + RECORD_HEADER.size
+                        out.append(json.loads(buf[start:start + length]))
+                        pos = start + length
+            if len(out) >= max_records:
+                break
+        return out, (seq, pos)
+
+    def dead_letter(self, records: List[dict], reason: str) -> str:
+        """Set aside records that can never be delivered. Returns the file they went to."""
+        path = os.path.join(self.directory, DEAD_LETTER_FILE)
+        with open(path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps({"reason": reason, "reading": record}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return path
+
+    def pending(self) -> bool:
+        segments = self.segments()
+        if not segments:
+            return False
+        return self.read_seq < segments[-1] or self.read_pos < self._write_pos
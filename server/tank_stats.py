@@ -0,0 +1,381 @@
+# Streaming per-tank statistics and drift detection.
+#
+# Every accepted reading is folded into a small fixed-size state per tank in
+# O(1): an EWMA, a ring of per-minute buckets holding count, Welford mean/M2,
+# min and max (sliding-window mean/stddev/min/max without keeping raw
+# samples; buckets are merged with Chan's parallel formula on read) and
+# time-in-range against the tank's species profile. Readings older than the
+# newest one seen (replays, out-of-order delivery) still land in their
+# minute's bucket but don't move `last` or the EWMA. /api/tanks/{id}/stats
+# reads this state and never queries raw history.
+#
+# The state of each tank is shared by every API worker as one document in
+# the `tank_stats` collection. Readings are queued in memory and every
+# STATS_FLUSH_SECONDS each worker folds its queue, in timestamp order, into
+# the stored state and writes it back only if the document's version is
+# unchanged, re-reading and folding again otherwise. Without start() (the
+# backfill and poller processes) state is kept in memory.
+import asyncio
+import logging
+import math
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from server import invalidation
+from server import sensor_interface
+
+logger = logging.getLogger("tank-stats")
+
+EWMA_ALPHA = float(os.getenv("STATS_EWMA_ALPHA", "0.1"))
+WINDOW_MINUTES = int(os.getenv("STATS_WINDOW_MINUTES", "60"))
+# gaps longer than this (sensor offline) don't count towards time-in-range
+MAX_GAP_SECONDS = float(os.getenv("STATS_MAX_GAP_SECONDS", "300"))
+# species profiles carry a single humidity target; in range is target +/- this
+HUMIDITY_TOLERANCE = float(os.getenv("HUMIDITY_TOLERANCE", "10"))
+# EWMA within this fraction of the range width from a bound counts as drifting
+DRIFT_MARGIN = float(os.getenv("STATS_DRIFT_MARGIN", "0.1"))
+STATS_FLUSH_SECONDS = float(os.getenv("STATS_FLUSH_SECONDS", "1"))
+# attempts at storing a tank's state before a flush gives its readings up
+STATS_STATE_RETRIES = 5
+
+STATE_COLLECTION = "tank_stats"
+
+# species_name (lower case) -> profile document, refreshed on invalidation
+_profiles: Dict[str, dict] = {}
+_profiles_loaded = False
+_species_collection = None
+
+_tanks: Dict[int, "TankStats"] = {}
+_state_collection = None
+# tank_id -> (reading, target ranges) queued since the last flush
+_pending: Dict[int, List[tuple]] = {}
+_flush_task: Optional[asyncio.Task] = None
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _naive_utc(ts: datetime) -> datetime:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _minute(ts: datetime) -> int:
+    return int((ts - _EPOCH).total_seconds() // 60)
+
+
+def target_ranges(profile: dict) -> Dict[str, Tuple[float, float]]:
+    """Acceptable temp/humidity ranges for a species profile."""
+    return {
+        "temp": (profile["cool_temp"], profile["hot_temp"]),
+        "humidity": (profile["humidity"] - HUMIDITY_TOLERANCE, profile["humidity"] + HUMIDITY_TOLERANCE),
+    }
+
+
+class MetricStats:
+    """Running statistics for one metric of one tank."""
+
+    __slots__ = ("count", "ewma", "last", "bucket_minute", "bucket_count", "bucket_mean", "bucket_m2",
+                 "bucket_min", "bucket_max")
+
+    def __init__(self):
+        self.count = 0
+        self.ewma: Optional[float] = None
+        self.last: Optional[float] = None
+        # ring of per-minute buckets covering the sliding window
+        self.bucket_minute = [-1] * WINDOW_MINUTES
+        self.bucket_count = [0] * WINDOW_MINUTES
+        self.bucket_mean = [0.0] * WINDOW_MINUTES
+        self.bucket_m2 = [0.0] * WINDOW_MINUTES
+        self.bucket_min = [0.0] * WINDOW_MINUTES
+        self.bucket_max = [0.0] * WINDOW_MINUTES
+
+    def add(self, value: float, minute: int, newest: bool = True):
+        """Fold in a value; `newest` is False for readings older than the latest one seen."""
+        self.count += 1
+        if newest:
+            self.ewma = value if self.ewma is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * self.ewma
+            self.last = value
+        slot = minute % WINDOW_MINUTES
+        if self.bucket_minute[slot] != minute:
+            if self.bucket_minute[slot] > minute:
+                return  # older than the window, already overwritten
+            self.bucket_minute[slot] = minute
+            self.bucket_count[slot] = 1
+            self.bucket_mean[slot] = self.bucket_min[slot] = self.bucket_max[slot] = value
+            self.bucket_m2[slot] = 0.0
+            return
+        n = self.bucket_count[slot] = self.bucket_count[slot] + 1
+        delta = value - self.bucket_mean[slot]
+        self.bucket_mean[slot] += delta / n
+        self.bucket_m2[slot] += delta * (value - self.bucket_mean[slot])
+        self.bucket_min[slot] = min(self.bucket_min[slot], value)
+        self.bucket_max[slot] = max(self.bucket_max[slot], value)
+
+    def to_doc(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "MetricStats":
+        m = cls()
+        m.count, m.ewma, m.last = doc["count"], doc["ewma"], doc["last"]
+        if len(doc["bucket_minute"]) == WINDOW_MINUTES:  # else STATS_WINDOW_MINUTES changed; start over
+            for name in cls.__slots__[3:]:
+                setattr(m, name, list(doc[name]))
+        return m
+
+    def window(self, now_minute: int) -> dict:
+        """count/mean/variance/min/max over the buckets of the last WINDOW_MINUTES."""
+        n, mean, m2 = 0, 0.0, 0.0
+        lo = hi = None
+        for slot in range(WINDOW_MINUTES):
+            if now_minute - WINDOW_MINUTES < self.bucket_minute[slot] <= now_minute:
+                nb, mb = self.bucket_count[slot], self.bucket_mean[slot]
+                total = n + nb
+                delta = mb - mean
+                mean += delta * nb / total
+                m2 += self.bucket_m2[slot] + delta * delta * n * nb / total
+                n = total
+                lo = self.bucket_min[slot] if lo is None else min(lo, self.bucket_min[slot])
+                hi = self.bucket_max[slot] if hi is None else max(hi, self.bucket_max[slot])
+        return {
+            "count": n,
+            "mean": mean if n else None,
+            "variance": m2 / (n - 1) if n > 1 else None,
+            "min": lo,
+            "max": hi,
+        }
+
+
+class TankStats:
+    __slots__ = ("tank_id", "metrics", "last_ts", "last_in_range", "seconds_in_range", "seconds_observed")
+
+    def __init__(self, tank_id: int):
+        self.tank_id = tank_id
+        self.metrics = {"temp": MetricStats(), "humidity": MetricStats()}
+        self.last_ts: Optional[datetime] = None
+        self.last_in_range: Dict[str, bool] = {}
+        self.seconds_in_range = {"temp": 0.0, "humidity": 0.0}
+        self.seconds_observed = 0.0
+
+    def add(self, doc: dict, ranges: Optional[Dict[str, Tuple[float, float]]]):
+        ts = _naive_utc(doc["timestamp"])
+        minute = _minute(ts)
+        newest = self.last_ts is None or ts >= self.last_ts
+        for name, metric in self.metrics.items():
+            metric.add(float(doc[name]), minute, newest)
+
+        if self.last_ts is not None and ts > self.last_ts:
+            # attribute the interval since the previous sample to that sample's state
+            dt = (ts - self.last_ts).total_seconds()
+            if dt <= MAX_GAP_SECONDS and self.last_in_range:
+                self.seconds_observed += dt
+                for name, ok in self.last_in_range.items():
+                    if ok:
+                        self.seconds_in_range[name] += dt
+        if newest:
+            self.last_ts = ts
+            self.last_in_range = (
+                {name: lo <= doc[name] <= hi for name, (lo, hi) in ranges.items()} if ranges else {}
+            )
+
+    def to_doc(self) -> dict:
+        return {
+            "metrics": {name: m.to_doc() for name, m in self.metrics.items()},
+            "last_ts": self.last_ts,
+            "last_in_range": self.last_in_range,
+            "seconds_in_range": self.seconds_in_range,
+            "seconds_observed": self.seconds_observed,
+        }
+
+    @classmethod
+    def from_doc(cls, tank_id: int, doc: dict) -> "TankStats":
+        stats = cls(tank_id)
+        stats.metrics = {name: MetricStats.from_doc(m) for name, m in doc["metrics"].items()}
+        stats.last_ts = doc["last_ts"]
+        stats.last_in_range = doc["last_in_range"]
+        stats.seconds_in_range = doc["seconds_in_range"]
+        stats.seconds_observed = doc["seconds_observed"]
+        return stats
+
+    def snapshot(self, ranges: Optional[Dict[str, Tuple[float, float]]]) -> dict:
+        now_minute = _minute(self.last_ts) if self.last_ts else 0
+        metrics = {}
+        for name, m in self.metrics.items():
+            window = m.window(now_minute)
+            var = window["variance"]
+            entry = {
+                "count": m.count,
+                "last": m.last,
+                "mean": window["mean"],
+                "stddev": math.sqrt(var) if var is not None else None,
+                "ewma": m.ewma,
+                "window_minutes": WINDOW_MINUTES,
+                "window_count": window["count"],
+                "window_min": window["min"],
+                "window_max": window["max"],
+            }
+            if ranges:
+                r_lo, r_hi = ranges[name]
+                entry["target_range"] = [r_lo, r_hi]
+                entry["in_range"] = self.last_in_range.get(name)
+                entry["time_in_range_pct"] = (
+                    100.0 * self.seconds_in_range[name] / self.seconds_observed
+                    if self.seconds_observed else None
+                )
+                entry["drift"] = _drift(m.ewma, r_lo, r_hi)
+            metrics[name] = entry
+        return {
+            "tank_id": self.tank_id,
+            "last_reading_at": self.last_ts,
+            "observed_seconds": self.seconds_observed,
+            **metrics,
+        }
+
+
+def _drift(ewma: Optional[float], lo: float, hi: float) -> Optional[str]:
+    """Classify the smoothed value: out_low/out_high, drifting_low/high, or None."""
+    if ewma is None:
+        return None
+    if ewma < lo:
+        return "out_low"
+    if ewma > hi:
+        return "out_high"
+    margin = (hi - lo) * DRIFT_MARGIN
+    if ewma < lo + margin:
+        return "drifting_low"
+    if ewma > hi - margin:
+        return "drifting_high"
+    return None
+
+
+# ---- species profiles ------------------------------------------------------
+
+def _invalidate_profiles():
+    global _profiles_loaded
+    _profiles_loaded = False
+
+
+async def initialize(species_collection):
+    global _species_collection
+    _species_collection = species_collection
+    invalidation.register("species_profiles", _invalidate_profiles)
+
+
+async def _load_profiles():
+    global _profiles, _profiles_loaded
+    if _profiles_loaded or _species_collection is None:
+        return
+    profiles = await _species_collection.find({}, {"_id": 0}).to_list(length=None)
+    _profiles = {p["species_name"].lower(): p for p in profiles}
+    _profiles_loaded = True
+
+
+def species_for_tank(tank_id: int) -> Optional[str]:
+    config = sensor_interface.TANKS.get(tank_id)
+    return config.get("reptile_species") if config else None
+
+
+async def profile_for_tank(tank_id: int) -> Optional[dict]:
+    try:
+        await _load_profiles()
+    except Exception as e:
+        logger.warning("Failed to load species profiles: %s", str(e))
+    species = species_for_tank(tank_id)
+    return _profiles.get(species.lower()) if species else None
+
+
+# ---- ingest hook / queries ------------------------------------------------
+
+async def start(db):
+    """Share per-tank state through `db` and fold queued readings in the background."""
+    global _state_collection, _flush_task
+    _state_collection = db[STATE_COLLECTION]
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def cleanup():
+    global _state_collection, _flush_task
+    if _flush_task:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    if _state_collection is not None:
+        await flush()
+    _state_collection = None
+
+
+async def observe(doc: dict):
+    """Fold one persisted reading document into its tank's statistics."""
+    profile = await profile_for_tank(doc["tank_id"])
+    ranges = target_ranges(profile) if profile else None
+    if _state_collection is not None:
+        _pending.setdefault(doc["tank_id"], []).append((doc, ranges))
+        return
+    stats = _tanks.get(doc["tank_id"])
+    if stats is None:
+        stats = _tanks[doc["tank_id"]] = TankStats(doc["tank_id"])
+    stats.add(doc, ranges)
+
+
+async def _store(tank_id: int, version: int, stats: TankStats) -> bool:
+    """Write a tank's state if nobody else did since `version` was read."""
+    state = {"version": version + 1, **stats.to_doc()}
+    if version == 0:
+        try:
+            await _state_collection.insert_one({"_id": tank_id, **state})
+            return True
+        except DuplicateKeyError:
+            return False
+    res = await _state_collection.replace_one({"_id": tank_id, "version": version}, state)
+    return res.matched_count == 1
+
+
+async def _apply(tank_id: int, readings: List[tuple]):
+    for _ in range(STATS_STATE_RETRIES):
+        doc = await _state_collection.find_one({"_id": tank_id})
+        stats = TankStats.from_doc(tank_id, doc) if doc else TankStats(tank_id)
+        for reading, ranges in readings:
+            stats.add(reading, ranges)
+        if await _store(tank_id, doc["version"] if doc else 0, stats):
+            return
+    raise RuntimeError("stats kept changing concurrently")
+
+
+async def flush():
+    """Fold the readings queued since the last flush into the shared state."""
+    global _pending
+    pending, _pending = _pending, {}
+    for tank_id, readings in pending.items():
+        readings.sort(key=lambda r: _naive_utc(r[0]["timestamp"]))
+        try:
+            await _apply(tank_id, readings)
+        except Exception as e:
+            logger.warning("Failed to update stats for tank %s: %s", tank_id, str(e) or type(e).__name__)
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(STATS_FLUSH_SECONDS)
+        await flush()
+
+
+async def get_stats(tank_id: int) -> Optional[dict]:
+    if _state_collection is not None:
+        doc = await _state_collection.find_one({"_id": tank_id})
+        stats = TankStats.from_doc(tank_id, doc) if doc else None
+    else:
+        stats = _tanks.get(tank_id)
+    if stats is None:
+        return None
+    profile = await profile_for_tank(tank_id)
+    snap = stats.snapshot(target_ranges(profile) if profile else None)
+    snap["species"] = profile["species_name"] if profile else species_for_tank(tank_id)
+    return snap
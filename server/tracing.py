@@ -0,0 +1,270 @@
+# End-to-end latency tracing, from sensor sample to relay actuation.
+#
+# The poller sends each reading with a W3C `traceparent` header (the trace
+# id is the reading's reading_id) and an `x-sent-at` send time; the reading's
+# own timestamp is its sample time. The API marks the trace as it moves on:
+#
+#   client     sampled -> request sent (poller side, includes the retry)
+#   transport  sent -> request received by the API
+#   admission  received -> admitted by the ingest gate
+#   persist    admitted -> stored in MongoDB
+#   evaluate   stored -> stats, alert/control evaluation and summaries done
+#   actuate    evaluated -> the next relay command for that tank completed
+#
+# Relays are switched by the photoperiod scheduler or the API rather than
+# by each reading, so a command is attributed to the newest evaluated
+# reading of its tank that no earlier command claimed: sample -> actuation
+# is how old the data was when the relay actually flipped.
+#
+# The scheduler usually runs in another process (the standalone poller, or
+# whichever worker holds the lease), so evaluated traces waiting for a
+# command are shared through the `trace_actuations` collection: a command
+# claims its tank's newest unclaimed trace there, and the worker that
+# evaluated the reading picks the actuation time up when it next reports.
+# Ingest never waits on that collection; each tank's newest evaluated
+# trace is kept in memory and written by a background flush every
+# TRACE_FLUSH_SECONDS, in one bulk write for all tanks.
+#
+# Finished traces go into a per-worker ring buffer of TRACE_BUFFER_SIZE
+# entries that /api/traces/latency summarizes. Clocks of the poller and API
+# hosts are assumed to be in sync (NTP); skew shows up in `client`,
+# `transport` and `actuate`.
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterable, List, Optional, Set
+
+from pymongo import DESCENDING, DeleteMany, InsertOne
+
+logger = logging.getLogger("tracing")
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "4096"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS", "1"))
+# unclaimed or unreported traces are dropped from Mongo after this long
+TRACE_ACTUATION_TTL_SECONDS = int(os.getenv("TRACE_ACTUATION_TTL_SECONDS", "86400"))
+
+ACTUATIONS_COLLECTION = "trace_actuations"
+
+TRACEPARENT_HEADER = "traceparent"
+SENT_AT_HEADER = "x-sent-at"
+STAGES = ("client", "transport", "admission", "persist", "evaluate", "actuate")
+
+_buffer: Deque[dict] = deque(maxlen=TRACE_BUFFER_SIZE)
+# tank_id -> newest evaluated trace not yet claimed by a relay command nor
+# shared through the database (all of them when there is no database)
+_awaiting_actuation: Dict[int, dict] = {}
+# tanks whose shared trace was superseded by a command in this process
+_withdrawn: Set[int] = set()
+_collection = None
+_flush_task: Optional[asyncio.Task] = None
+
+
+async def initialize(db):
+    """Share traces awaiting actuation through `db`; needed wherever relays are switched."""
+    global _collection, _flush_task
+    coll = db[ACTUATIONS_COLLECTION]
+    await coll.create_index([("tank_id", 1), ("evaluated_at", DESCENDING)])
+    await coll.create_index([("created", 1)], expireAfterSeconds=TRACE_ACTUATION_TTL_SECONDS)
+    _collection = coll
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def cleanup():
+    global _collection, _flush_task
+    if _flush_task:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    if _collection is not None:
+        await flush()
+    _collection = None
+
+
+async def flush():
+    """Share the traces evaluated since the last flush, one bulk write for all tanks."""
+    if _collection is None or not (_awaiting_actuation or _withdrawn):
+        return
+    records = dict(_awaiting_actuation)
+    withdrawn = _withdrawn - set(records)
+    _awaiting_actuation.clear()
+    _withdrawn.clear()
+    now = datetime.utcnow()
+    ops = []
+    for tank_id in withdrawn:
+        ops.append(DeleteMany({"tank_id": tank_id, "actuated_at": None}))
+    for tank_id, record in records.items():
+        # only the newest evaluated reading of a tank can be claimed
+        ops.append(DeleteMany({"tank_id": tank_id, "actuated_at": None}))
+        ops.append(InsertOne({
+            "_id": record["trace_id"],
+            "tank_id": tank_id,
+            "evaluated_at": record["evaluated_at"],
+            "actuated_at": None,
+            "created": now,
+        }))
+    try:
+        await _collection.bulk_write(ops, ordered=True)
+    except Exception as e:
+        logger.warning("Failed to share %d trace(s) awaiting actuation: %s", len(records), str(e))
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(TRACE_FLUSH_SECONDS)
+        await flush()
+
+
+def traceparent(trace_id: str) -> str:
+    """Header value for a new span of `trace_id` (32 hex digits)."""
+    return f"00-{trace_id}-{random.getrandbits(64):016x}-01"
+
+
+def _epoch(ts: datetime) -> float:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+class Trace:
+    __slots__ = ("trace_id", "tank_id", "marks")
+
+    def __init__(self, trace_id: str, tank_id: int, sampled_at: float):
+        self.trace_id = trace_id
+        self.tank_id = tank_id
+        # (stage, time the stage ended), in order
+        self.marks = [("sampled", sampled_at)]
+
+    def mark(self, stage: str, at: Optional[float] = None):
+        self.marks.append((stage, time.time() if at is None else at))
+
+
+def begin(headers, state, doc: dict) -> Optional[Trace]:
+    """A trace for an incoming reading, or None if it isn't traced."""
+    header = headers.get(TRACEPARENT_HEADER)
+    if not header or (TRACE_SAMPLE_RATE < 1.0 and random.random() >= TRACE_SAMPLE_RATE):
+        return None
+    parts = header.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32:
+        return None
+    trace = Trace(parts[1], doc["tank_id"], _epoch(doc["timestamp"]))
+    sent_at = headers.get(SENT_AT_HEADER)
+    if sent_at:
+        try:
+            sent = float(sent_at)
+        except ValueError:
+            sent = None
+        if sent is not None and math.isfinite(sent):
+            trace.mark("client", sent)
+    received_at = getattr(state, "received_at", None)
+    if received_at is not None:
+        trace.mark("transport", received_at)
+        trace.mark("admission", getattr(state, "admitted_at", received_at))
+    return trace
+
+
+def finish(trace: Optional[Trace]):
+    """Record an evaluated reading and make it the tank's candidate for the next actuation."""
+    if trace is None:
+        return
+    trace.mark("evaluate")
+    stages = {}
+    for (_, start), (stage, end) in zip(trace.marks, trace.marks[1:]):
+        stages[stage] = round((end - start) * 1000, 3)
+    sampled_at, evaluated_at = trace.marks[0][1], trace.marks[-1][1]
+    record = {
+        "trace_id": trace.trace_id,
+        "tank_id": trace.tank_id,
+        "sampled_at": sampled_at,
+        "evaluated_at": evaluated_at,
+        "stages": stages,
+        "sample_to_evaluated_ms": round((evaluated_at - sampled_at) * 1000, 3),
+        "sample_to_actuation_ms": None,
+    }
+    _buffer.append(record)
+    _awaiting_actuation[trace.tank_id] = record
+
+
+def _close(record: dict, at: float):
+    record["stages"]["actuate"] = round((at - record["evaluated_at"]) * 1000, 3)
+    record["sample_to_actuation_ms"] = round((at - record["sampled_at"]) * 1000, 3)
+
+
+async def actuated(tank_ids: Iterable[int], at: Optional[float] = None):
+    """A relay command for these tanks has completed."""
+    at = time.time() if at is None else at
+    for tank_id in set(tank_ids):
+        record = _awaiting_actuation.pop(tank_id, None)
+        if record is not None:
+            # the newest candidate hasn't been shared yet; any shared one is older
+            _close(record, at)
+            if _collection is not None:
+                _withdrawn.add(tank_id)
+            continue
+        if _collection is None:
+            continue
+        try:
+            await _collection.find_one_and_update(
+                {"tank_id": tank_id, "actuated_at": None},
+                {"$set": {"actuated_at": at}},
+                sort=[("evaluated_at", DESCENDING)],
+            )
+        except Exception as e:
+            logger.warning("Failed to record actuation for tank %s: %s", tank_id, str(e))
+
+
+async def _collect_actuations():
+    """Close buffered traces whose actuation was recorded, possibly by another process."""
+    pending = {r["trace_id"]: r for r in _buffer if r["sample_to_actuation_ms"] is None}
+    if _collection is None or not pending:
+        return
+    query = {"_id": {"$in": list(pending)}, "actuated_at": {"$ne": None}}
+    closed = []
+    async for doc in _collection.find(query, {"actuated_at": 1}):
+        _close(pending[doc["_id"]], doc["actuated_at"])
+        closed.append(doc["_id"])
+    if closed:
+        await _collection.delete_many({"_id": {"$in": closed}})
+
+
+def _percentiles(values: List[float]) -> Optional[dict]:
+    if not values:
+        return None
+    values = sorted(values)
+
+    def rank(p):
+        # nearest-rank percentile
+        return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+    return {"count": len(values), "p50": rank(50), "p95": rank(95), "p99": rank(99), "max": values[-1]}
+
+
+async def report(recent: int = 0) -> dict:
+    try:
+        await _collect_actuations()
+    except Exception as e:
+        logger.warning("Failed to read recorded actuations: %s", str(e))
+    records = list(_buffer)
+    out = {
+        "traces": len(records),
+        "buffer_size": TRACE_BUFFER_SIZE,
+        "sample_to_evaluated_ms": _percentiles([r["sample_to_evaluated_ms"] for r in records]),
+        "sample_to_actuation_ms": _percentiles(
+            [r["sample_to_actuation_ms"] for r in records if r["sample_to_actuation_ms"] is not None]),
+        "stages_ms": {
+            stage: _percentiles([r["stages"][stage] for r in records if stage in r["stages"]])
+            for stage in STAGES
+        },
+    }
+    if recent:
+        out["recent"] = records[-recent:]
+    return out
@@ -0,0 +1,76 @@
+# Local stand-in for an alert webhook, for development and tests.
+#
+#   python -m server.webhook_receiver --port 9000
+#   ALERT_WEBHOOK_URL=http://localhost:9000/ uvicorn server.app:app
+#
+# Received batches are printed and kept in WebhookReceiver.batches. An
+# optional delay simulates a slow sink.
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+
+class WebhookReceiver:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0, status: int = 200):
+        self.batches: List[dict] = []
+        self.delay = delay
+        self.status = status
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", "0"))
+                body = self.rfile.read(length)
+                if receiver.delay:
+                    time.sleep(receiver.delay)
+                try:
+                    receiver.batches.append(json.loads(body or b"{}"))
+                except ValueError:
+                    receiver.batches.append({"raw": body.decode(errors="replace")})
+                self.send_response(receiver.status)
+                self.end_headers()
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> "WebhookReceiver":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local alert webhook receiver")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to stall each request")
+    args = parser.parse_args()
+    receiver = WebhookReceiver(args.host, args.port, args.delay).start()
+    print(f"Listening on {receiver.url}")
+    seen = 0
+    try:
+        while True:
+            time.sleep(0.5)
+            for batch in receiver.batches[seen:]:
+                print(json.dumps(batch))
+            seen = len(receiver.batches)
+    except KeyboardInterrupt:
+        receiver.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# Shared fixtures. MongoDB is replaced by mongomock-motor and the API is
+# driven in-process through httpx's ASGI transport, so the suite needs no
+# running services:
+#
+#   pip install -r requirements.txt -r requirements-dev.txt
+#   python -m pytest
+import os
+
+os.environ.setdefault("POLLER_MODE", "off")
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["tanks_test"]
+
+
+@pytest.fixture
+async def api(db):
+    """server.app wired to a fresh mock database, without running the lifespan."""
+    from server import app as api
+    from server import ingest
+
+    api.collection = db["sensor_readings"]
+    api.species_profiles_collection = db["species_profiles"]
+    api.reptiles_collection = db["reptiles"]
+    await ingest.ensure_indexes(api.collection)
+    yield api
+    api.collection = api.species_profiles_collection = api.reptiles_collection = None
+
+
+@pytest.fixture
+async def client(api):
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
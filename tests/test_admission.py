@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from server import admission
+
+pytestmark = pytest.mark.anyio
+
+
+async def hold(gate, release):
+    async with gate.admit():
+        await release.wait()
+
+
+async def test_full_queue_is_shed_immediately():
+    gate = admission.AdmissionGate("test", max_in_flight=1, max_queue=1, queue_timeout=5)
+    release = asyncio.Event()
+    holder = asyncio.create_task(hold(gate, release))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(hold(gate, release))
+    await asyncio.sleep(0)
+    assert (gate.in_flight, gate.queued) == (1, 1)
+
+    with pytest.raises(admission.Saturated) as exc:
+        async with gate.admit():
+            pass
+    assert exc.value.retry_after >= 1
+    assert gate.counters["shed_queue_full"] == 1
+
+    # the queued request gets the slot once it frees up
+    release.set()
+    await asyncio.gather(holder, waiter)
+    assert gate.counters["admitted"] == 2
+    assert gate.status()["shed"] == 1
+    assert (gate.in_flight, gate.queued) == (0, 0)
+
+
+async def test_queued_request_times_out():
+    gate = admission.AdmissionGate("test", max_in_flight=1, max_queue=4, queue_timeout=0.02)
+    release = asyncio.Event()
+    holder = asyncio.create_task(hold(gate, release))
+    await asyncio.sleep(0)
+    with pytest.raises(admission.Saturated):
+        async with gate.admit():
+            pass
+    assert gate.counters["shed_timeout"] == 1
+    assert gate.queued == 0
+    release.set()
+    await holder
+
+
+def test_retry_after_follows_backlog():
+    gate = admission.AdmissionGate("test", max_in_flight=2, max_queue=10, queue_timeout=1)
+    gate._service_time = 0.5
+    gate.in_flight, gate.queued = 2, 10
+    assert gate.retry_after() == 3
+    gate.in_flight, gate.queued = 0, 0
+    assert gate.retry_after() == 1
+
+
+def test_only_ingest_routes_are_gated():
+    assert admission.gate_for("POST", "/api/readings") is admission.ingest_gate
+    assert admission.gate_for("POST", "/api/readings/bulk/") is admission.ingest_gate
+    assert admission.gate_for("GET", "/api/readings") is None
+    assert admission.gate_for("POST", "/api/powerstrip/1/on") is None
+
+
+async def test_saturated_ingest_gets_429_while_control_passes(client, monkeypatch):
+    gate = admission.AdmissionGate("ingest", max_in_flight=1, max_queue=0, queue_timeout=1)
+    monkeypatch.setattr(admission, "ingest_gate", gate)
+    release = asyncio.Event()
+    holder = asyncio.create_task(hold(gate, release))
+    await asyncio.sleep(0)
+    try:
+        reading = {"id": 1, "temp": 25.0, "humidity": 40.0, "light": True}
+        resp = await client.post("/api/readings", json=reading)
+        assert resp.status_code == 429
+        assert int(resp.headers["retry-after"]) >= 1
+        assert resp.json()["retry_after"] == int(resp.headers["retry-after"])
+        # exempt routes don't queue behind ingest
+        resp = await client.get("/api/admission")
+        assert resp.status_code == 200
+        assert resp.json()["ingest"]["shed_queue_full"] == 1
+    finally:
+        release.set()
+        await holder
+    assert (await client.post("/api/readings", json=reading)).status_code != 429
+
+
+async def test_cancel_as_the_slot_frees_keeps_the_permit():
+    gate = admission.AdmissionGate("test", max_in_flight=1, max_queue=1, queue_timeout=5)
+    slot = gate.admit()
+    await slot.__aenter__()
+    waiter = asyncio.create_task(hold(gate, asyncio.Event()))
+    await asyncio.sleep(0)
+    assert gate.queued == 1
+    # the permit is handed to the waiter, which is cancelled before it resumes
+    await slot.__aexit__(None, None, None)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(waiter, 1)
+    await asyncio.sleep(0)
+    assert (gate.in_flight, gate.queued) == (0, 0)
+    assert not gate._sem().locked()
+    async with gate.admit():
+        assert gate.in_flight == 1
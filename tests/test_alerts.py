@@ -0,0 +1,150 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+
+from server import alerts
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingSink:
+    def __init__(self, name, delay=0.0, failures=0):
+        self.name = name
+        self.delay = delay
+        self.failures = failures
+        self.batches = []
+        self.attempts = 0
+
+    async def deliver(self, batch):
+        self.attempts += 1
+        await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("webhook down")
+        self.batches.append(batch)
+
+
+@pytest.fixture
+def fast(monkeypatch):
+    monkeypatch.setattr(alerts, "ALERT_BATCH_WINDOW_SECONDS", 0.01)
+    monkeypatch.setattr(alerts, "ALERT_SINK_RETRY_SECONDS", 0.01)
+    monkeypatch.setattr(alerts, "ALERT_SINK_TIMEOUT_SECONDS", 0.5)
+
+
+async def wait_for(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def test_hysteresis_and_cooldown(monkeypatch):
+    monkeypatch.setattr(alerts, "ALERT_COOLDOWN_SECONDS", 60)
+    service = alerts.AlertService([])
+    service._queue = asyncio.Queue()
+    service.observe(1, "temp", 40.0, 20.0, 35.0, now=0)
+    service.observe(1, "temp", 41.0, 20.0, 35.0, now=10)    # suppressed
+    service.observe(1, "temp", 34.8, 20.0, 35.0, now=20)    # inside, but within hysteresis
+    service.observe(1, "temp", 36.0, 20.0, 35.0, now=70)    # repeat after the cooldown
+    service.observe(1, "temp", 30.0, 20.0, 35.0, now=80)    # resolved
+    events = [service._queue.get_nowait() for _ in range(service._queue.qsize())]
+    assert [e["state"] for e in events] == ["firing", "repeat", "resolved"]
+    assert events[1]["suppressed"] == 1
+
+
+async def test_slow_sink_does_not_delay_others(fast):
+    slow = RecordingSink("webhook", delay=0.4)
+    quick = RecordingSink("log")
+    service = alerts.AlertService([slow, quick])
+    await service.start()
+    try:
+        service.send_alert(1, "heater_stuck", 45.0)
+        await wait_for(lambda: quick.batches)
+        assert not slow.batches
+        await wait_for(lambda: slow.batches)
+    finally:
+        await service.stop()
+
+
+async def test_failed_delivery_is_retried(fast):
+    flaky = RecordingSink("webhook", failures=2)
+    service = alerts.AlertService([flaky])
+    await service.start()
+    try:
+        service.send_alert(1, "heater_stuck", 45.0)
+        await wait_for(lambda: flaky.batches)
+        sink = service.status()["sinks"]["webhook"]
+        assert (flaky.attempts, sink["retries"], sink["delivered"], sink["failed"]) == (3, 2, 1, 0)
+    finally:
+        await service.stop()
+
+
+async def test_delivery_gives_up_after_retries(fast, monkeypatch):
+    monkeypatch.setattr(alerts, "ALERT_SINK_RETRIES", 1)
+    down = RecordingSink("webhook", failures=10)
+    service = alerts.AlertService([down])
+    await service.start()
+    try:
+        service.send_alert(1, "heater_stuck", 45.0)
+        await wait_for(lambda: service.status()["sinks"]["webhook"]["failed"] == 1)
+        assert down.attempts == 2
+    finally:
+        await service.stop()
+
+
+@pytest.fixture
+async def shared(db):
+    """Two workers' worth of alert state sharing one database."""
+    alerts._collection = db[alerts.ALERT_STATE_COLLECTION]
+    alerts._pending = {}
+    alerts.alert_service._queue = asyncio.Queue()
+    yield alerts.alert_service._queue
+    alerts._collection = None
+    alerts._pending = {}
+    alerts.alert_service._queue = None
+
+
+def reading(temp, minute=0):
+    return {"tank_id": 1, "temp": temp, "timestamp": datetime(2026, 1, 1, 12, minute)}
+
+
+async def test_shared_state_fires_once_across_workers(shared, monkeypatch):
+    monkeypatch.setattr(alerts, "ALERT_COOLDOWN_SECONDS", 60)
+    critical = {"temp": (20.0, 35.0)}
+    alerts.evaluate_reading(reading(40.0), critical)
+    await alerts.flush()
+    # another worker, with nothing in memory, sees the condition already firing
+    alerts.alert_service._tanks.clear()
+    alerts.evaluate_reading(reading(41.0, 1), critical)
+    await alerts.flush()
+    alerts.evaluate_reading(reading(30.0, 2), critical)
+    await alerts.flush()
+    events = [shared.get_nowait() for _ in range(shared.qsize())]
+    assert [e["state"] for e in events] == ["firing", "resolved"]
+    assert events[1]["suppressed"] == 1
+    assert (await alerts.status())["firing"] == []
+
+
+async def test_concurrent_update_is_reevaluated(shared, monkeypatch):
+    critical = {"temp": (20.0, 35.0)}
+    store = alerts._store
+    raced = []
+
+    async def racing_store(tank_id, version, conditions):
+        if not raced:
+            # another worker stores the firing transition first
+            raced.append(1)
+            other = alerts._TankConditions(tank_id)
+            other.observe("temp", 45.0, 20.0, 35.0, time.time())
+            await alerts._collection.insert_one({"_id": tank_id, "version": 1, "conditions": other.to_doc()})
+        return await store(tank_id, version, conditions)
+
+    monkeypatch.setattr(alerts, "_store", racing_store)
+    alerts.evaluate_reading(reading(40.0), critical)
+    await alerts.flush()
+    assert shared.empty()  # the other worker sent the alert
+    doc = await alerts._collection.find_one({"_id": 1})
+    assert doc["version"] == 2 and doc["conditions"]["critical_temp"]["suppressed"] == 1
+    assert (await alerts.status())["firing"] == [{"tank_id": 1, "condition": "critical_temp", "suppressed": 1}]
@@ -0,0 +1,107 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import backfill
+from server import compliance
+from server import ingest
+from server import retention
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 3, 10, 12)
+DAY = datetime(2026, 3, 1)
+HEADER = ["tank_id", "timestamp", "temp", "humidity", "light"]
+
+
+def reading(tank_id, ts, temp):
+    return ingest.with_dedup_key({"tank_id": tank_id, "timestamp": ts, "temp": temp, "humidity": 50.0, "light": True})
+
+
+def ndjson_file(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    return str(path)
+
+
+def row(tank_id, ts, temp):
+    return {"tank_id": tank_id, "timestamp": ts.isoformat(), "temp": temp, "humidity": 50.0, "light": True}
+
+
+def test_invalid_utf8_line_is_rejected():
+    lines = [b"1,2026-03-01T00:00:00,25.0,50,true\n", b"1,2026-03-01T00:01:00,25\xff,50,true\n",
+             b"1,2026-03-01T00:02:00,26.0,50,true\n"]
+    docs, rejects, days = backfill.parse_chunk("csv", HEADER, lines, 2)
+    assert [d["temp"] for d in docs] == [25.0, 26.0]
+    assert rejects == [(3, "invalid UTF-8")]
+    assert days == {(1, DAY)}
+
+
+def test_rows_before_cutoff_are_rejected():
+    lines = [json.dumps(row(1, DAY + timedelta(hours=h), 25.0)).encode() for h in (1, 30)]
+    docs, rejects, days = backfill.parse_chunk("ndjson", None, lines, 1, not_before=DAY + timedelta(days=1))
+    assert [d["timestamp"] for d in docs] == [DAY + timedelta(hours=30)]
+    assert [lineno for lineno, _ in rejects] == [1]
+    assert days == {(1, DAY + timedelta(days=1))}
+
+
+@pytest.fixture
+async def expired_day(db, tmp_path, monkeypatch):
+    """Readings of DAY, rolled up, archived (or not) and expired."""
+    monkeypatch.setattr(retention, "RETENTION_RAW_DAYS", 3)
+    monkeypatch.setattr(retention, "RETENTION_ARCHIVE_DIR", str(tmp_path / "archive"))
+    coll = db["sensor_readings"]
+    await ingest.ensure_indexes(coll)
+    await retention.initialize(db, coll)
+    await compliance.initialize(db)
+    await coll.insert_many([
+        reading(1, DAY + timedelta(hours=1), 20.0),
+        reading(1, DAY + timedelta(hours=1, minutes=1), 24.0),
+        reading(2, DAY + timedelta(hours=5), 30.0),
+    ])
+    return coll
+
+
+async def run_backfill(coll, tmp_path, rows, not_before=None):
+    path = ndjson_file(tmp_path / "sdcard.ndjson", rows)
+    checkpoint = backfill.Checkpoint(str(tmp_path / "checkpoint.json"))
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        job = backfill.Backfill(coll, checkpoint, pool, not_before=not_before)
+        await job.load_file(path)
+        await job.update_derived(coll)
+    return job
+
+
+async def test_backfill_into_archived_expired_day(expired_day, tmp_path):
+    assert await retention.run_once(NOW) == 3
+    job = await run_backfill(expired_day, tmp_path, [
+        row(1, DAY + timedelta(hours=1, minutes=2), 28.0),
+        row(1, DAY + timedelta(hours=1), 20.0),  # already archived
+    ])
+    assert (job.counts["inserted"], job.counts["duplicates"]) == (2, 0)
+
+    # the day is complete again: re-archived, rolled up and summarized from all three readings
+    assert await expired_day.count_documents({}) == 0
+    assert [d["temp"] for d in retention.read_archive(1)] == [20.0, 24.0, 28.0]
+    [hourly] = await retention.get_rollups(1, "hourly")
+    assert (hourly["count"], hourly["temp_avg"], hourly["temp_max"]) == (3, 24.0, 28.0)
+    [summary] = await compliance.get_compliance(1)
+    assert summary["readings"] == 3
+    # other tanks' data for the day is untouched
+    assert len(retention.read_archive(2)) == 1
+    assert (await retention.get_rollups(2, "hourly"))[0]["count"] == 1
+
+
+async def test_backfill_without_archive_refuses_expired_days(expired_day, tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, "RETENTION_ARCHIVE_DIR", "")
+    await retention.run_once(NOW)
+    not_before = await backfill.expired_cutoff()
+    assert not_before == DAY + timedelta(days=1)
+    job = await run_backfill(expired_day, tmp_path, [
+        row(1, DAY + timedelta(hours=1, minutes=2), 28.0),
+        row(1, NOW - timedelta(days=1), 25.0),
+    ], not_before=not_before)
+    assert (job.counts["inserted"], job.counts["rejected"]) == (1, 1)
+    [hourly] = await retention.get_rollups(1, "hourly", DAY, DAY + timedelta(days=1))
+    assert (hourly["count"], hourly["temp_avg"]) == (2, 22.0)
@@ -0,0 +1,100 @@
+from datetime import datetime
+
+import msgpack
+import pytest
+
+from server import binary_ingest
+
+pytestmark = pytest.mark.anyio
+
+
+def test_frames_round_trip():
+    readings = [
+        {"id": 1, "timestamp": datetime(2026, 1, 2, 3, 4, 5), "temp": 28.25, "humidity": 41.5, "light": True},
+        {"id": 2, "timestamp": datetime(2026, 1, 2, 3, 4, 6), "temp": -1.5, "humidity": 90.0, "light": False},
+    ]
+    body = binary_ingest.encode_frame(readings) * 2
+    assert binary_ingest.decode_body(body, "application/octet-stream") == readings * 2
+
+
+def test_gzip_body():
+    body = binary_ingest.gzip_body(binary_ingest.encode_frame([{"id": 1, "temp": 1, "humidity": 2, "light": True}]))
+    assert len(binary_ingest.decode_body(body, "application/octet-stream", "gzip")) == 1
+
+
+@pytest.mark.parametrize("body", [b"RB", b"XX\x01\x01\x00", b"RB\x01\x02\x00" + b"\x00" * 11])
+def test_malformed_frames(body):
+    with pytest.raises(ValueError):
+        binary_ingest.decode_frames(body)
+
+
+@pytest.mark.parametrize("item", [
+    [1, 1767225600, None, 4000, True],
+    [1, 1767225600, "hot", 4000, True],
+    [1, 2 ** 63 - 1, 2500, 4000, True],
+    [1, 2 ** 62, 2500, 4000, True],
+    {"id": 1, "temp": 25.0, "humidity": 40.0, "light": True, "timestamp": float("inf")},
+    [1, 2, 3],
+    "reading",
+])
+def test_bad_msgpack_items_are_value_errors(item):
+    with pytest.raises(ValueError, match="Reading 0"):
+        binary_ingest.decode_msgpack(msgpack.packb([item]))
+
+
+async def test_endpoint_status_codes(client, monkeypatch):
+    ok = msgpack.packb([[1, 1767225600, 2500, 4000, True], {"id": 2, "temp": 25.0, "humidity": 40.0, "light": False}])
+    resp = await client.post("/api/readings/binary", content=ok, headers={"content-type": "application/msgpack"})
+    assert resp.status_code == 201 and resp.json()["accepted"] == 2
+
+    bad = msgpack.packb([[1, 1767225600, None, 4000, True]])
+    resp = await client.post("/api/readings/binary", content=bad, headers={"content-type": "application/msgpack"})
+    assert resp.status_code == 400
+
+    huge = msgpack.packb([[1, 10 ** 15, 2500, 4000, True]])
+    resp = await client.post("/api/readings/binary", content=huge, headers={"content-type": "application/msgpack"})
+    assert resp.status_code == 400
+
+    resp = await client.post("/api/readings/binary", content=b"{}", headers={"content-type": "application/json"})
+    assert resp.status_code == 415
+    resp = await client.post("/api/readings/binary", content=ok,
+                             headers={"content-type": "application/msgpack", "content-encoding": "br"})
+    assert resp.status_code == 415
+
+    monkeypatch.setattr(binary_ingest, "MSGPACK_AVAILABLE", False)
+    resp = await client.post("/api/readings/binary", content=ok, headers={"content-type": "application/msgpack"})
+    assert resp.status_code == 501
+
+
+async def test_oversized_bodies_are_refused_while_reading(client, api, monkeypatch):
+    monkeypatch.setattr(binary_ingest, "MAX_BODY_BYTES", 64)
+    frame = binary_ingest.encode_frame([{"id": 1, "temp": 25.0, "humidity": 40.0, "light": True}] * 10)
+    sent = []
+
+    async def chunks():
+        for i in range(0, len(frame), 16):
+            sent.append(i)
+            yield frame[i:i + 16]
+
+    resp = await client.post("/api/readings/binary", content=frame,
+                             headers={"content-type": "application/octet-stream"})
+    assert resp.status_code == 413
+    # no Content-Length: the read stops at the first chunk past the cap
+    resp = await client.post("/api/readings/binary", content=chunks(),
+                             headers={"content-type": "application/octet-stream"})
+    assert resp.status_code == 413
+    assert len(sent) == 5  # of 8
+    gzipped = binary_ingest.gzip_body(b"\0" * 1000)
+    resp = await client.post("/api/readings/binary", content=gzipped,
+                             headers={"content-type": "application/octet-stream", "content-encoding": "gzip"})
+    assert resp.status_code == 413
+    assert await api.collection.count_documents({}) == 0
+
+
+async def test_rows_are_validated_together(client, api):
+    items = [{"id": 1, "temp": 25.0, "humidity": 40.0, "light": True, "timestamp": 1767225600},
+             {"id": "two", "temp": 25.0, "humidity": 40.0, "light": True}]
+    resp = await client.post("/api/readings/binary", content=msgpack.packb(items),
+                             headers={"content-type": "application/msgpack"})
+    assert resp.status_code == 400 and "1.id" in resp.json()["detail"]
+    assert await api.collection.count_documents({}) == 0
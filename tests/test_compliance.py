@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import compliance
+from server import tank_stats
+
+pytestmark = pytest.mark.anyio
+
+DAY = datetime(2026, 3, 1)
+PROFILE = {"species_name": "Leopard Gecko", "cool_temp": 24.0, "hot_temp": 32.0, "humidity": 40.0,
+           "daylight_hours": 12}
+
+
+@pytest.fixture
+async def summaries(db, monkeypatch):
+    monkeypatch.setattr(tank_stats, "_profiles", {"leopard gecko": PROFILE})
+    monkeypatch.setattr(tank_stats, "_profiles_loaded", True)
+    monkeypatch.setattr(compliance, "_pending", [])
+    await compliance.initialize(db)
+    yield db[compliance.COMPLIANCE_COLLECTION]
+    await compliance.cleanup()
+
+
+async def record(docs):
+    compliance.record(docs)
+    await compliance.flush()
+
+
+def readings(temps, start=DAY + timedelta(hours=8), step=60, light=True):
+    return [{"tank_id": 1, "timestamp": start + timedelta(seconds=i * step), "temp": t, "humidity": 40.0,
+             "light": light} for i, t in enumerate(temps)]
+
+
+async def test_batches_are_bridged(summaries):
+    docs = readings([25.0, 25.0, 40.0, 40.0, 25.0, 25.0])
+    await record(docs[:3])
+    await record(docs[3:])
+    [day] = await compliance.get_compliance(1)
+    assert day["readings"] == 6
+    assert day["observed_hours"] == round(300 / 3600, 3)
+    # two of the five minutes started from an out-of-range reading
+    assert day["temp_in_range_pct"] == 60.0
+    assert day["humidity_in_range_pct"] == 100.0
+    # the excursion spanning both batches is counted once
+    assert day["temp_excursions"] == 1
+    assert day["targets"] == {"temp": [24.0, 32.0], "humidity": [30.0, 50.0]}
+    assert day["light_hours_delta"] == round(300 / 3600 - 12, 3)
+
+
+async def test_incremental_matches_backfill(summaries, db):
+    docs = readings([25.0, 40.0, 25.0, 40.0, 40.0, 25.0], step=90)
+    for doc in docs:
+        await record([doc])
+    incremental = await compliance.get_compliance(1)
+    await db["sensor_readings"].insert_many([dict(d) for d in docs])
+    assert await compliance.backfill(db["sensor_readings"], tank_id=1) == 1
+    assert await compliance.get_compliance(1) == incremental
+    assert incremental[0]["temp_excursions"] == 2
+
+
+async def test_gaps_and_late_readings_add_no_time(summaries):
+    start = DAY + timedelta(hours=8)
+    await record(readings([25.0, 25.0], start=start))
+    # the sensor was offline for an hour
+    await record(readings([25.0, 25.0], start=start + timedelta(hours=1)))
+    [day] = await compliance.get_compliance(1)
+    assert day["observed_hours"] == round(120 / 3600, 3)
+    # a late reading from before the day's last one is only counted
+    await record(readings([40.0], start=start + timedelta(seconds=30)))
+    [day] = await compliance.get_compliance(1)
+    assert (day["readings"], day["observed_hours"], day["temp_excursions"]) == (5, round(120 / 3600, 3), 0)
+
+
+async def test_days_are_split_and_filtered(summaries, client):
+    await record(readings([25.0] * 3, start=DAY - timedelta(minutes=1)))
+    await record(readings([25.0] * 2, start=DAY + timedelta(days=2)))
+    resp = await client.get("/api/tanks/1/compliance")
+    assert [d["day"] for d in resp.json()["days"]] == ["2026-02-28", "2026-03-01", "2026-03-03"]
+    resp = await client.get("/api/tanks/1/compliance", params={"from": "2026-03-01", "to": "2026-03-02"})
+    assert [(d["day"], d["readings"]) for d in resp.json()["days"]] == [("2026-03-01", 2)]
+    resp = await client.get("/api/tanks/1/compliance", params={"from": "2026-03-02", "to": "2026-03-01"})
+    assert resp.status_code == 400
+
+
+async def test_tank_without_profile_has_no_percentages(summaries, monkeypatch):
+    monkeypatch.setattr(tank_stats, "_profiles", {})
+    await record(readings([25.0, 25.0]))
+    [day] = await compliance.get_compliance(1)
+    assert (day["targets"], day["temp_in_range_pct"], day["light_hours_delta"]) == (None, None, None)
+    assert day["light_hours"] == round(60 / 3600, 3)
+
+
+async def test_readings_are_applied_per_flush(summaries, monkeypatch):
+    docs = readings([25.0, 40.0, 25.0, 25.0])
+    for doc in docs:
+        compliance.record([doc])  # one call per ingest request
+    assert await summaries.count_documents({}) == 0
+    updates = []
+    update_one = compliance._collection.update_one
+
+    async def counting_update_one(*args, **kwargs):
+        updates.append(args[0])
+        return await update_one(*args, **kwargs)
+
+    monkeypatch.setattr(compliance._collection, "update_one", counting_update_one)
+    await compliance.flush()
+    assert len(updates) == 1
+    [day] = await compliance.get_compliance(1)
+    assert (day["readings"], day["temp_excursions"], day["temp_in_range_pct"]) == (4, 1, round(200 / 3, 2))
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import dashboard
+from server import invalidation
+from server import powerstrip_interface
+from server import sensor_interface
+
+pytestmark = pytest.mark.anyio
+
+TS = datetime(2026, 2, 1, 12)
+
+
+def body(tank_id=1, minutes=0, temp=26.0):
+    return {"id": tank_id, "temp": temp, "humidity": 40.0, "light": True,
+            "timestamp": (TS + timedelta(minutes=minutes)).isoformat()}
+
+
+def fresh_worker(monkeypatch):
+    """Forget this process's dashboard state, as another worker would see it."""
+    monkeypatch.setattr(dashboard, "_rendered", None)
+    monkeypatch.setattr(dashboard, "_latest", {})
+    monkeypatch.setattr(dashboard, "_outlets", {})
+    dashboard._invalidate()
+
+
+@pytest.fixture
+async def shared(api, db, monkeypatch):
+    monkeypatch.setattr(invalidation, "_versions_coll", db[invalidation.VERSIONS_COLLECTION])
+    monkeypatch.setattr(invalidation, "_seen", {})
+    monkeypatch.setattr(powerstrip_interface, "known_states", {})
+    fresh_worker(monkeypatch)
+    monkeypatch.setattr(dashboard, "_pending_latest", {})
+    monkeypatch.setattr(dashboard, "_pending_outlets", {})
+    dashboard.initialize(db)
+    yield
+    await dashboard.cleanup()
+
+
+async def ingest(client, **kwargs):
+    await client.post("/api/readings", json=body(**kwargs))
+    await dashboard.flush()  # the background flush, run now
+
+
+def tank(resp, tank_id):
+    return next(t for t in resp.json()["tanks"] if t["tank_id"] == tank_id)
+
+
+async def test_etag_is_shared_between_workers(client, shared, monkeypatch):
+    await ingest(client, temp=27.5)
+    first = await client.get("/api/dashboard")
+    assert first.status_code == 200
+    assert tank(first, 1)["latest"]["temp"] == 27.5
+    assert "last-modified" not in first.headers
+
+    fresh_worker(monkeypatch)
+    resp = await client.get("/api/dashboard", headers={"If-None-Match": first.headers["etag"]})
+    assert resp.status_code == 304
+    resp = await client.get("/api/dashboard")
+    assert resp.headers["etag"] == first.headers["etag"]
+    assert tank(resp, 1)["latest"]["temp"] == 27.5
+
+
+async def test_any_change_moves_the_etag(client, shared):
+    await ingest(client)
+    first = await client.get("/api/dashboard")
+    await ingest(client, minutes=1, temp=30.0)
+    resp = await client.get("/api/dashboard", headers={"If-None-Match": first.headers["etag"]})
+    assert resp.status_code == 200
+    assert tank(resp, 1)["latest"]["temp"] == 30.0
+
+
+async def test_older_reading_does_not_replace_newer(client, shared, monkeypatch):
+    await ingest(client, minutes=5, temp=28.0)
+    fresh_worker(monkeypatch)  # a worker that hasn't seen the newer reading yet
+    await ingest(client, minutes=1, temp=20.0)
+    resp = await client.get("/api/dashboard")
+    assert tank(resp, 1)["latest"]["temp"] == 28.0
+
+
+async def test_outlet_state_from_another_process(client, shared, monkeypatch):
+    monkeypatch.setitem(sensor_interface.TANKS[1], "outlets", {"lights": 2})
+    # e.g. the scheduler in the standalone poller switching the lights on
+    powerstrip_interface.remember_state(None, 2, True)
+    await dashboard.flush()
+    fresh_worker(monkeypatch)
+    resp = await client.get("/api/dashboard")
+    assert tank(resp, 1)["outlets"] == [{"role": "lights", "device_id": None, "outlet": 2, "state": True}]
+
+
+async def test_readings_are_published_once_per_flush(client, shared, db):
+    first = await client.get("/api/dashboard")
+    for minute in range(5):
+        await client.post("/api/readings", json=body(minutes=minute, temp=20.0 + minute))
+    # nothing is written or invalidated on the request path
+    assert await db[dashboard.STATE_COLLECTION].count_documents({}) == 0
+    assert dashboard.data_version() == int(first.headers["etag"].strip('"'))
+    await dashboard.flush()
+    assert dashboard.data_version() == int(first.headers["etag"].strip('"')) + 1
+    resp = await client.get("/api/dashboard")
+    assert tank(resp, 1)["latest"]["temp"] == 24.0
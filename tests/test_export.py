@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pyarrow.parquet as pq
+import pytest
+
+from server import export
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+async def readings(api):
+    docs = [
+        {"tank_id": tank, "timestamp": START + timedelta(minutes=i), "temp": 20.0 + i, "humidity": 40.0,
+         "light": i % 2 == 0}
+        for tank in (1, 2) for i in range(7)
+    ]
+    await api.collection.insert_many(docs)
+    return docs
+
+
+async def _collect(stream):
+    return b"".join([chunk async for chunk in stream])
+
+
+async def test_batches_are_bounded(api, readings):
+    sizes = [len(b) async for b in export.iter_batches(api.collection, export.readings_query([1]), batch_size=3)]
+    assert sizes == [3, 3, 1]
+
+
+async def test_ndjson_and_csv_match(api, readings, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 4)
+    query_range = (START + timedelta(minutes=2), START + timedelta(minutes=5))
+    ndjson = await _collect(export.stream_export(api.collection, [1], "ndjson", *query_range))
+    rows = [json.loads(line) for line in ndjson.decode().splitlines()]
+    assert [r["temp"] for r in rows] == [22.0, 23.0, 24.0]
+    text = await _collect(export.stream_export(api.collection, [1], "csv", *query_range))
+    assert [float(r["temp"]) for r in csv.DictReader(io.StringIO(text.decode()))] == [22.0, 23.0, 24.0]
+
+
+async def test_parquet_row_groups(api, readings):
+    async def batches():
+        async for batch in export.iter_batches(api.collection, export.readings_query([1, 2]), batch_size=5):
+            yield batch
+
+    body = await _collect(export.encode_parquet(batches()))
+    table = pq.read_table(io.BytesIO(body))
+    assert table.num_rows == 14
+    assert pq.ParquetFile(io.BytesIO(body)).num_row_groups == 3
+    assert table.column("timestamp").to_pylist() == sorted(d["timestamp"] for d in readings)
+
+
+async def test_export_endpoint(client, readings, monkeypatch):
+    resp = await client.get("/api/readings/export", params={"tank_ids": "1,2", "format": "parquet"})
+    assert resp.status_code == 200
+    assert pq.read_table(io.BytesIO(resp.content)).num_rows == 14
+    assert (await client.get("/api/readings/1/export", params={"format": "xml"})).status_code == 400
+    monkeypatch.setattr(export, "PYARROW_AVAILABLE", False)
+    assert (await client.get("/api/readings/1/export", params={"format": "parquet"})).status_code == 501
+
+
+async def test_history_is_one_query(api, readings):
+    finds = []
+    find = api.collection.find
+
+    class Counting:
+        def __getattr__(self, name):
+            return getattr(api.collection, name)
+
+        def find(self, *args, **kwargs):
+            finds.append(args[0])
+            return find(*args, **kwargs)
+
+    result = await export.query_history(Counting(), [1, 2], until=START + timedelta(minutes=2))
+    assert finds == [{"tank_id": {"$in": [1, 2]}, "timestamp": {"$lt": START + timedelta(minutes=2)}}]
+    assert [(t["tank_id"], t["count"]) for t in result["tanks"]] == [(1, 2), (2, 2)]
+    assert result["count"] == 4
+
+
+async def test_history_merges_archive_by_time(api, readings):
+    archived = {2: [{"tank_id": 2, "timestamp": START - timedelta(days=1), "temp": 10.0, "humidity": 1.0,
+                     "light": False, "_archive_only": True}]}
+    result = await export.query_history(api.collection, [1, 2], fields="temp", group="time", archived=archived)
+    assert result["count"] == 15
+    assert result["readings"][0] == {"tank_id": 2, "timestamp": START - timedelta(days=1), "temp": 10.0}
+    timestamps = [r["timestamp"] for r in result["readings"]]
+    assert timestamps == sorted(timestamps)
+    assert all(set(r) == {"tank_id", "timestamp", "temp"} for r in result["readings"])
+
+
+async def test_history_endpoint_without_since(client, readings):
+    resp = await client.get("/api/readings", params={"tank_ids": "2,1,2", "fields": "light", "group": "tank"})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["tank_ids"] == [2, 1]
+    assert [t["tank_id"] for t in body["tanks"]] == [2, 1]
+    assert set(body["tanks"][0]["readings"][0]) == {"tank_id", "timestamp", "light"}
+    until = (START + timedelta(minutes=3)).isoformat()
+    resp = await client.get("/api/readings", params={"tank_ids": "1", "until": until, "group": "time"})
+    assert [r["temp"] for r in resp.json()["readings"]] == [20.0, 21.0, 22.0]
+
+
+@pytest.mark.parametrize("params", [
+    {"tank_ids": "1", "fields": "temp,pressure"},
+    {"tank_ids": "1", "group": "species"},
+    {"tank_ids": "one"},
+    {"tank_ids": ","},
+])
+async def test_history_endpoint_rejects_bad_params(client, readings, params):
+    assert (await client.get("/api/readings", params=params)).status_code == 400
+
+
+async def test_export_includes_archived_days(client, api, readings, tmp_path, monkeypatch, db):
+    from server import retention
+
+    monkeypatch.setattr(retention, "RETENTION_RAW_DAYS", 3)
+    monkeypatch.setattr(retention, "RETENTION_ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 4)
+    await retention.initialize(db, api.collection)
+    # expire the first day, then add readings that are still live
+    assert await retention.run_once(START + timedelta(days=10)) == 14
+    await api.collection.insert_many([
+        {"tank_id": tank, "timestamp": START + timedelta(days=9, minutes=i), "temp": 30.0, "humidity": 40.0,
+         "light": True} for tank in (1, 2) for i in range(2)
+    ])
+    resp = await client.get("/api/readings/export", params={"tank_ids": "1,2"})
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert len(rows) == 18
+    assert [r["timestamp"] for r in rows] == sorted(r["timestamp"] for r in rows)
+    assert all(set(r) == set(export.EXPORT_FIELDS) for r in rows)
+    resp = await client.get("/api/readings/1/export", params={
+        "format": "csv", "since": (START + timedelta(minutes=5)).isoformat() + "Z"})
+    temps = [float(r["temp"]) for r in csv.DictReader(io.StringIO(resp.text))]
+    assert temps == [25.0, 26.0, 30.0, 30.0]
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import history_cache
+from server import ingest
+
+pytestmark = pytest.mark.anyio
+
+
+class CountingCollection:
+    """Records the filters passed to find()."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.queries = []
+
+    def find(self, query, *args, **kwargs):
+        self.queries.append(query)
+        return self.collection.find(query, *args, **kwargs)
+
+
+@pytest.fixture
+async def readings(db):
+    history_cache.clear()
+    coll = db["sensor_readings"]
+    await ingest.ensure_indexes(coll)
+    start = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(days=3)
+    await coll.insert_many([
+        ingest.with_dedup_key({"tank_id": tank_id, "timestamp": start + timedelta(hours=h),
+                               "temp": 20.0 + tank_id, "humidity": 50.0, "light": True})
+        for tank_id in (1, 2, 3) for h in range(0, 72, 6)
+    ])
+    yield CountingCollection(coll), start
+    history_cache.clear()
+
+
+async def test_several_tanks_share_one_query_per_range(readings):
+    coll, start = readings
+    per_tank = await history_cache.tanks_readings(coll, [1, 2, 3], start, None)
+    # one $in query for the closed buckets, one for the live tail
+    assert len(coll.queries) == 2
+    assert all(q["tank_id"] == {"$in": [1, 2, 3]} for q in coll.queries)
+    assert {t: len(docs) for t, docs in per_tank.items()} == {1: 12, 2: 12, 3: 12}
+    assert all(d["tank_id"] == t for t, docs in per_tank.items() for d in docs)
+    assert per_tank[2] == sorted(per_tank[2], key=lambda d: d["timestamp"])
+
+    coll.queries.clear()
+    again = await history_cache.tanks_readings(coll, [1, 2, 3], start, None)
+    assert len(coll.queries) == 1  # closed buckets now come from memory
+    assert again == per_tank
+
+
+async def test_only_tanks_missing_a_bucket_are_fetched(readings):
+    coll, start = readings
+    single = await history_cache.tank_readings(coll, 1, start, None)
+    coll.queries.clear()
+    per_tank = await history_cache.tanks_readings(coll, [1, 2], start, None)
+    assert [q["tank_id"] for q in coll.queries] == [2, {"$in": [1, 2]}]
+    assert per_tank[1] == single
+
+
+async def test_multi_tank_history_endpoint(client, api):
+    since = datetime.utcnow() - timedelta(days=2)
+    await api.collection.insert_many([
+        ingest.with_dedup_key({"tank_id": t, "timestamp": since + timedelta(hours=h), "temp": 25.0,
+                               "humidity": 50.0, "light": True})
+        for t in (1, 2) for h in (1, 30)
+    ])
+    history_cache.clear()
+    resp = await client.get("/api/readings", params={"tank_ids": "1,2", "since": since.isoformat()})
+    assert resp.status_code == 200
+    assert [t["count"] for t in resp.json()["tanks"]] == [2, 2]
+
+
+def test_storing_a_bucket_twice_is_counted_once(monkeypatch):
+    history_cache.clear()
+    docs = [{"tank_id": 1, "temp": 20.0}]
+    key = ("readings", 1, datetime(2026, 3, 1))
+    history_cache._store(key, docs)
+    size = history_cache._bytes
+    monkeypatch.setattr(history_cache, "HISTORY_CACHE_MAX_BYTES", size + 10)
+    # two concurrent misses for the same bucket
+    history_cache._store(key, docs)
+    assert history_cache._bytes == size
+    assert list(history_cache._entries) == [key]
+    history_cache.clear()
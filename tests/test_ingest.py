@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import history_cache
+from server import ingest
+from server import tank_stats
+
+pytestmark = pytest.mark.anyio
+
+TS = datetime(2026, 2, 1, 12)
+
+
+def body(tank_id=1, minutes=0, **extra):
+    return {"id": tank_id, "temp": 26.0, "humidity": 40.0, "light": True,
+            "timestamp": (TS + timedelta(minutes=minutes)).isoformat(), **extra}
+
+
+def test_dedup_key():
+    doc = {"tank_id": 3, "timestamp": datetime.fromisoformat("2026-02-01T13:00:00.1234+01:00")}
+    assert ingest.dedup_key(doc) == "3:2026-02-01T12:00:00.123"
+    assert ingest.dedup_key({**doc, "reading_id": "abc"}) == "3:id:abc"
+
+
+async def test_retried_post_is_deduplicated(client, api):
+    first = await client.post("/api/readings", json=body())
+    assert first.status_code == 201 and first.json()["accepted"] == 1
+    again = await client.post("/api/readings", json=body())
+    assert again.json() == {"inserted_id": None, "accepted": 0, "deduplicated": 1}
+    # a reading_id identifies the reading even if the timestamp differs
+    await client.post("/api/readings", json=body(minutes=1, reading_id="r-1"))
+    resp = await client.post("/api/readings", json=body(minutes=2, reading_id="r-1"))
+    assert resp.json()["deduplicated"] == 1
+    assert await api.collection.count_documents({}) == 2
+
+
+async def test_bulk_drops_stored_and_repeated_readings(client, api):
+    await client.post("/api/readings", json=body())
+    resp = await client.post("/api/readings/bulk", json=[body(), body(minutes=1), body(minutes=1), body(2)])
+    assert resp.json() == {"accepted": 2, "deduplicated": 2}
+    assert await api.collection.count_documents({}) == 3
+
+
+async def test_failing_post_processing_still_acknowledges(client, api, monkeypatch):
+    async def broken(docs):
+        raise RuntimeError("cache_versions unavailable")
+
+    monkeypatch.setattr(history_cache, "observe", broken)
+    resp = await client.post("/api/readings", json=body(7))
+    assert resp.status_code == 201 and resp.json()["accepted"] == 1
+    # the stored reading still reached the stats after the failed step
+    assert (await tank_stats.get_stats(7))["temp"]["count"] >= 1
+    resp = await client.post("/api/readings/bulk", json=[body(7, minutes=5)])
+    assert resp.status_code == 201 and resp.json()["accepted"] == 1
+
+
+async def test_persist_failure_is_502(client, api, monkeypatch):
+    async def down(*args, **kwargs):
+        raise ConnectionError("mongod unreachable")
+
+    monkeypatch.setattr(api.collection, "update_one", down)
+    assert (await client.post("/api/readings", json=body())).status_code == 502
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import socket
+import struct
+
+import pytest
+
+from server import powerstrip_interface
+from tools import kasa_emulator
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def strips(monkeypatch):
+    strips = kasa_emulator.make_strips(2, relays=4, latency=0)
+    monkeypatch.setattr(powerstrip_interface, "IP_ADDRESS", strips[0].host)
+    monkeypatch.setattr(powerstrip_interface, "known_states", {})
+    with kasa_emulator.installed(kasa_emulator.EmulatedDiscover(strips)):
+        yield strips
+
+
+def test_xor_round_trip():
+    payload = json.dumps({"system": {"get_sysinfo": {}}}).encode()
+    assert kasa_emulator.xor_encrypt(payload) != payload
+    assert kasa_emulator.xor_decrypt(kasa_emulator.xor_encrypt(payload)) == payload
+
+
+def test_handle_switches_addressed_children_only():
+    strip = kasa_emulator.EmulatedStrip("127.0.0.2", relays=3)
+    request = {"context": {"child_ids": [strip.child_id(1)]}, "system": {"set_relay_state": {"state": 1}}}
+    assert strip.handle(request) == {"system": {"set_relay_state": {"err_code": 0}}}
+    assert strip.relays == [False, True, False]
+    info = strip.handle({"system": {"get_sysinfo": {}}})["system"]["get_sysinfo"]
+    assert [c["state"] for c in info["children"]] == [0, 1, 0]
+    assert strip.handle({"emeter": {"get_realtime": {}}})["emeter"]["err_code"] == -1
+
+
+async def test_interface_drives_emulated_strip(strips):
+    assert await powerstrip_interface.set_outlet_state(2, "on") is True
+    assert strips[0].relays == [False, True, False, False]
+    assert strips[1].relays == [False] * 4
+    assert await powerstrip_interface.get_outlet_state(2) is True
+    assert powerstrip_interface.known_states[(None, 2)] is True
+
+
+async def test_offline_strip_is_unavailable(strips, monkeypatch):
+    strips[0].offline = True
+    sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, "sleep", lambda delay, *args: sleep(0, *args))
+    with pytest.raises(powerstrip_interface.PowerstripUnavailableError):
+        await powerstrip_interface.get_outlet_state(1)
+
+
+async def test_injected_failures_are_counted(strips):
+    strips[1].failure_rate = 1.0
+    with pytest.raises(kasa_emulator.EmulatedFailure):
+        await strips[1].round_trip()
+    assert strips[1].counters == {"requests": 1, "failures": 1}
+    found = await kasa_emulator.EmulatedDiscover(strips).discover(discovery_timeout=0.05)
+    assert list(found) == [strips[0].host]  # the failing strip's reply was lost
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def test_responder_speaks_legacy_tcp():
+    strip = kasa_emulator.EmulatedStrip("127.0.0.1", relays=2, latency=0)
+    port = free_port()
+    responder = await kasa_emulator.KasaResponder([strip], port=port, discovery_host=None).start()
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+        async def call(request):
+            payload = kasa_emulator.xor_encrypt(json.dumps(request).encode())
+            writer.write(struct.pack(">I", len(payload)) + payload)
+            (length,) = struct.unpack(">I", await reader.readexactly(4))
+            return json.loads(kasa_emulator.xor_decrypt(await reader.readexactly(length)))
+
+        await call({"system": {"set_relay_state": {"state": 1}}})
+        info = await call({"system": {"get_sysinfo": {}}})
+        assert [c["state"] for c in info["system"]["get_sysinfo"]["children"]] == [1, 1]
+        writer.close()
+    finally:
+        await responder.stop()
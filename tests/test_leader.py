@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import invalidation
+from server import leader
+from server import poller
+
+pytestmark = pytest.mark.anyio
+
+
+async def wait_until(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+
+async def test_only_one_worker_holds_the_lease(db):
+    leases = db[leader.LEASE_COLLECTION]
+    assert await leader.try_acquire(leases, owner="a")
+    assert not await leader.try_acquire(leases, owner="b")
+    # the holder renews
+    assert await leader.try_acquire(leases, owner="a")
+    await leader.release(leases, owner="b")  # not b's to release
+    assert not await leader.try_acquire(leases, owner="b")
+    await leader.release(leases, owner="a")
+    assert await leader.try_acquire(leases, owner="b")
+
+
+async def test_expired_lease_is_taken_over(db):
+    leases = db[leader.LEASE_COLLECTION]
+    assert await leader.try_acquire(leases, owner="a")
+    await leases.update_one({"_id": leader.LEASE_NAME},
+                            {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+    assert await leader.try_acquire(leases, owner="b")
+    assert not await leader.try_acquire(leases, owner="a")
+
+
+async def test_election_runs_services_until_shutdown(db, monkeypatch):
+    monkeypatch.setattr(leader, "LEASE_TTL_SECONDS", 0.03)
+    events = []
+
+    async def elected():
+        events.append("elected")
+
+    async def demoted():
+        events.append("demoted")
+
+    await leader.start(db, elected, demoted)
+    await wait_until(leader.is_leader)
+    await asyncio.sleep(0.05)  # a few renewals don't re-elect
+    assert events == ["elected"]
+    await leader.cleanup()
+    assert events == ["elected", "demoted"]
+    assert not leader.is_leader()
+    assert await db[leader.LEASE_COLLECTION].count_documents({}) == 0
+
+
+async def test_lost_lease_demotes(db, monkeypatch):
+    monkeypatch.setattr(leader, "LEASE_TTL_SECONDS", 0.03)
+    events = []
+
+    async def elected():
+        events.append("elected")
+
+    async def demoted():
+        events.append("demoted")
+
+    await leader.start(db, elected, demoted)
+    await wait_until(leader.is_leader)
+    # another worker took over (e.g. after this one stalled past the TTL)
+    await db[leader.LEASE_COLLECTION].update_one(
+        {"_id": leader.LEASE_NAME},
+        {"$set": {"owner": "other", "expires_at": datetime.utcnow() + timedelta(hours=1)}})
+    await wait_until(lambda: not leader.is_leader())
+    await leader.cleanup()
+    assert events == ["elected", "demoted"]
+    assert (await db[leader.LEASE_COLLECTION].find_one({}))["owner"] == "other"
+
+
+async def test_poller_mode_off_starts_nothing(db, monkeypatch):
+    started = []
+
+    async def start_services():
+        started.append(True)
+
+    monkeypatch.setattr(poller, "start_services", start_services)
+    await poller.start(db, mode="off")
+    await poller.stop(mode="off")
+    assert started == []
+    assert await db[leader.LEASE_COLLECTION].count_documents({}) == 0
+
+
+async def test_invalidation_reaches_other_workers(db, monkeypatch):
+    monkeypatch.setattr(invalidation, "INVALIDATION_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(invalidation, "_seen", {})
+    fired = []
+    callback = lambda: fired.append(True)  # noqa: E731
+    invalidation.register("test_cache", callback)
+    try:
+        await invalidation.initialize(db)
+        await invalidation.bump("test_cache")  # this worker: immediately
+        assert fired == [True]
+        assert invalidation.version("test_cache") == 1
+        # another worker's bump is picked up on the next poll
+        await db[invalidation.VERSIONS_COLLECTION].update_one({"_id": "test_cache"}, {"$inc": {"version": 1}})
+        await wait_until(lambda: len(fired) == 2)
+        assert invalidation.version("test_cache") == 2
+    finally:
+        invalidation.unregister("test_cache", callback)
+        await invalidation.cleanup()
+        monkeypatch.setattr(invalidation, "_versions_coll", None)
@@ -0,0 +1,88 @@
+import io
+import json
+import logging
+
+import pytest
+
+from server import logconfig
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(logconfig, "_rules", dict(logconfig._rules))
+    monkeypatch.setattr(logconfig, "_counters", {})
+    monkeypatch.setattr(logconfig, "_windows", {})
+
+
+@pytest.fixture
+def root_logger(monkeypatch):
+    monkeypatch.setattr(logconfig, "LOG_FORMAT", logconfig.LOG_FORMAT)
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    logconfig.stop()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    for h in handlers:
+        root.addHandler(h)
+    root.setLevel(level)
+
+
+def test_parse_rules():
+    assert logconfig.parse_rules("ingest=1/100, errors=10/min,debug=none") == {
+        "ingest": ("sample", 100, 0), "errors": ("rate", 10, 60.0), "debug": ("none", 0, 0),
+    }
+    for bad in ("ingest", "ingest=2/100", "ingest=1/0", "ingest=5/fortnight"):
+        with pytest.raises(ValueError):
+            logconfig.parse_rules(bad)
+
+
+def test_one_in_n_per_key():
+    logconfig.set_rules("test=1/3")
+    kept = [logconfig.sample("test", key) for key in (1, 1, 1, 1, 2)]
+    assert [bool(e) for e in kept] == [True, False, False, True, True]
+    assert kept[0] == {"category": "test", "key": 1, "sample_rate": "1/3"}
+
+
+def test_rate_limit_reports_suppressed(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(logconfig.time, "monotonic", lambda: now[0])
+    logconfig.set_rules("test=2/min")
+    assert [bool(logconfig.sample("test", 7)) for _ in range(5)] == [True, True, False, False, False]
+    now[0] += 61
+    assert logconfig.sample("test", 7) == {"category": "test", "key": 7, "suppressed": 3}
+    assert logconfig.sample("test", 7) == {"category": "test", "key": 7}
+
+
+def test_all_none_and_unknown_categories():
+    logconfig.set_rules("loud=none,quiet=all")
+    assert logconfig.sample("loud") is None
+    assert logconfig.sample("quiet") == {"category": "quiet"}
+    assert logconfig.sample("unconfigured", 3) == {"category": "unconfigured", "key": 3}
+
+
+def test_records_are_written_as_json_by_the_writer_thread(root_logger):
+    out = io.StringIO()
+    logconfig.configure(level="INFO", fmt="json", stream=out)
+    logging.getLogger("ingest").info("Inserted reading for tank %s", 3, extra={"category": "ingest", "key": 3})
+    logging.getLogger("ingest").debug("below the level")
+    logconfig.stop()
+    [line] = out.getvalue().splitlines()
+    entry = json.loads(line)
+    assert (entry["logger"], entry["level"], entry["msg"]) == ("ingest", "INFO", "Inserted reading for tank 3")
+    assert (entry["category"], entry["key"]) == ("ingest", 3)
+
+
+def test_full_queue_drops_and_counts(root_logger, monkeypatch):
+    monkeypatch.setattr(logconfig, "LOG_QUEUE_SIZE", 2)
+    monkeypatch.setattr(logconfig, "dropped", 0)
+    out = io.StringIO()
+    logconfig.configure(level="INFO", fmt="text", stream=out)
+    logconfig._listener.stop()  # a stalled writer
+    logconfig._listener = None
+    for i in range(5):
+        logging.getLogger("poll").info("record %d", i)
+    assert logconfig.stats()["dropped"] == 3
+    assert logconfig.stats()["queued"] == 2
+    logging.getLogger().removeHandler(logconfig._handler)
+    logconfig._handler = None
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from server import powerstrip_registry
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeStrip:
+    def __init__(self, host):
+        self.mac = f"mac-{host}"
+        self.alias = f"strip at {host}"
+        self.model = "HS300"
+        self.children = [object()] * 6
+
+
+@pytest.fixture
+def registry(db, monkeypatch):
+    monkeypatch.setattr(powerstrip_registry, "_db", db)
+    monkeypatch.setattr(powerstrip_registry, "_devices", {})
+    monkeypatch.setattr(powerstrip_registry, "_sessions", {})
+    return powerstrip_registry
+
+
+async def test_subnet_probes_are_bounded(registry, monkeypatch):
+    monkeypatch.setattr(registry, "DISCOVERY_CONCURRENCY", 8)
+    in_flight = peak = 0
+
+    async def connect(host, timeout):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        if host.endswith(".7"):
+            return FakeStrip(host)
+        raise OSError("no route to host")
+
+    monkeypatch.setattr(registry, "connect_device", connect)
+    devices = await registry.discover("10.0.0.0/24")
+    assert peak == 8
+    assert [d["host"] for d in devices] == ["10.0.0.7"]
+    assert devices[0]["relay_count"] == 6
+
+
+async def test_oversized_subnet_is_refused(registry, monkeypatch):
+    async def connect(host, timeout):
+        raise AssertionError("nothing should be probed")
+
+    monkeypatch.setattr(registry, "connect_device", connect)
+    with pytest.raises(ValueError):
+        await registry.discover("10.0.0.0/16")
+
+
+async def test_discover_api_rejects_wide_and_malformed_subnets(client):
+    resp = await client.post("/api/powerstrips/discover", params={"subnet": "10.0.0.0/8"})
+    assert resp.status_code == 400
+    assert "at most" in resp.json()["detail"]
+    resp = await client.post("/api/powerstrips/discover", params={"subnet": "10.0.0.300/24"})
+    assert resp.status_code == 400
@@ -0,0 +1,150 @@
+import json
+
+import pytest
+
+from server import reptiles
+
+pytestmark = pytest.mark.anyio
+
+CSV = (
+    "id,name,species,tank_id,age_years,weight\n"
+    "1,Spot,Leopard  Gecko,1,2,55.5\n"
+    "2,Rex,Bearded Dragon,1,,400\n"
+    "3,Noodle,Ball Python,2,4,1200\n"
+)
+
+
+def ndjson(rows):
+    return "".join(json.dumps(r) + "\n" for r in rows)
+
+
+def test_parse_csv_normalizes_rows():
+    docs = reptiles.parse_records(CSV.encode(), "text/csv")
+    assert [d["reptile_id"] for d in docs] == [1, 2, 3]
+    assert docs[0]["species_key"] == "leopard gecko"
+    assert docs[0]["weight"] == 55.5
+    assert "age_years" not in docs[1]  # empty cells are omitted
+
+
+@pytest.mark.parametrize("body, error", [
+    ('{"reptile_id": 1, "name": "Spot"}\n', "line 1: missing required field 'species'"),
+    ('{"reptile_id": "x", "name": "Spot", "species": "Gecko"}\n', "line 1: invalid reptile_id 'x'"),
+    ('{"reptile_id": 1, "name": "A", "species": "Gecko"}\n\n{"reptile_id": 1, "name": "B", "species": "Gecko"}\n',
+     "line 3: duplicate reptile_id 1"),
+    ('{"reptile_id": 1, "name": "Spot", "species": "Gecko", "age_years": "3.7"}\n',
+     "line 1: invalid age_years '3.7'"),
+    ('{"reptile_id": 1, "name": "Spot", "species": "Gecko", "tank_id": -2}\n', "line 1: invalid tank_id -2"),
+    ('{"reptile_id": 1, "name": "Spot", "species": "Gecko", "weight": "NaN"}\n', "line 1: invalid weight 'NaN'"),
+    ('{"reptile_id": true, "name": "Spot", "species": "Gecko"}\n', "line 1: invalid reptile_id True"),
+    ("[1, 2]\n", "line 1: expected an object"),
+    ("{oops\n", "line 1: invalid JSON"),
+])
+def test_parse_rejects_bad_rows(body, error):
+    with pytest.raises(ValueError) as exc:
+        reptiles.parse_records(body.encode(), "application/x-ndjson")
+    assert str(exc.value) == error
+
+
+async def test_import_upserts_by_reptile_id(client, api):
+    resp = await client.post("/api/reptiles/import", content=CSV, headers={"Content-Type": "text/csv"})
+    assert resp.status_code == 200
+    assert resp.json() == {"received": 3, "inserted": 3, "updated": 0, "unchanged": 0}
+
+    rows = [{"reptile_id": 1, "name": "Spot", "species": "Leopard Gecko", "tank_id": 2},
+            {"reptile_id": 4, "name": "Kiwi", "species": "Crested Gecko", "tank_id": 2}]
+    resp = await client.post("/api/reptiles/import", content=ndjson(rows),
+                             headers={"Content-Type": "application/x-ndjson"})
+    assert resp.json()["inserted"] == 1
+    assert resp.json()["updated"] == 1
+    assert await api.reptiles_collection.count_documents({}) == 4
+    # a re-imported animal is replaced, not merged
+    assert "weight" not in (await client.get("/api/reptiles/1")).json()
+
+    resp = await client.get("/api/reptiles", params={"tank_id": 2})
+    assert [r["reptile_id"] for r in resp.json()["reptiles"]] == [1, 3, 4]
+    resp = await client.get("/api/reptiles", params={"species": "leopard   GECKO"})
+    assert [r["name"] for r in resp.json()["reptiles"]] == ["Spot"]
+
+
+async def test_bad_import_writes_nothing(client, api):
+    body = CSV + "5,,Ball Python,2,,\n"
+    resp = await client.post("/api/reptiles/import", content=body, headers={"Content-Type": "text/csv"})
+    assert resp.status_code == 400
+    assert resp.json()["detail"] == "line 5: missing required field 'name'"
+    resp = await client.post("/api/reptiles/import", content=CSV, headers={"Content-Type": "text/plain"})
+    assert resp.status_code == 400
+    assert await api.reptiles_collection.count_documents({}) == 0
+
+
+async def test_import_is_batched(db, monkeypatch):
+    monkeypatch.setattr(reptiles, "IMPORT_BATCH_SIZE", 2)
+    docs = reptiles.parse_records(CSV.encode(), "text/csv")
+    coll = db["reptiles"]
+    calls = []
+    bulk_write = coll.bulk_write
+
+    async def counting_bulk_write(requests, **kwargs):
+        calls.append(len(requests))
+        return await bulk_write(requests, **kwargs)
+
+    monkeypatch.setattr(coll, "bulk_write", counting_bulk_write)
+    assert (await reptiles.bulk_upsert(coll, docs))["inserted"] == 3
+    assert calls == [2, 1]
+
+
+class AggregateOnly:
+    """Returns canned $lookup output; mongomock can't run a $lookup with a sub-pipeline."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        docs = self.docs
+
+        class Cursor:
+            async def to_list(self, length=None):
+                return docs
+
+        return Cursor()
+
+
+async def test_tank_inventory_is_one_aggregation():
+    coll = AggregateOnly([
+        {"reptile_id": 1, "species": "Leopard Gecko", "profile": {"cool_temp": 24}},
+        {"reptile_id": 2, "species": "Mystery Skink"},
+    ])
+    animals, missing = await reptiles.tank_inventory(coll, 1)
+    assert len(animals) == 2
+    assert missing == ["Mystery Skink"]
+    [pipeline] = coll.pipelines
+    assert pipeline[0] == {"$match": {"tank_id": 1}}
+    assert pipeline[1]["$lookup"]["from"] == "species_profiles"
+    assert pipeline[1]["$lookup"]["localField"] == pipeline[1]["$lookup"]["foreignField"] == "species_key"
+    # per-animal habitat copies never reach the response
+    assert all(pipeline[-2]["$project"][f] == 0 for f in ("optimal_cool_temp", "optimal_hot_temp"))
+
+
+def test_numeric_cells_are_parsed_as_numbers():
+    doc = reptiles.normalize({"id": "7", "name": "Spot", "species": "Gecko", "tank_id": "2.0",
+                              "age_months": 4.0, "weight": "55.5"})
+    assert (doc["reptile_id"], doc["tank_id"], doc["age_months"], doc["weight"]) == (7, 2, 4, 55.5)
+
+
+async def test_profiles_carry_the_same_join_key(client, api):
+    await api.species_profiles_collection.insert_one({"species_name": "Leopard  Gecko ", "cool_temp": 24})
+    assert await reptiles.key_profiles(api.species_profiles_collection) == 1
+    assert await reptiles.key_profiles(api.species_profiles_collection) == 0
+    [legacy] = await api.species_profiles_collection.find({}).to_list(length=None)
+    [animal] = reptiles.parse_records(b"id,name,species\n1,Spot,leopard gecko\n", "text/csv")
+    assert legacy["species_key"] == animal["species_key"] == "leopard gecko"
+
+
+async def test_profile_endpoints_maintain_the_join_key(client, api):
+    profile = {"species_name": "Crested  Gecko", "cool_temp": 20, "hot_temp": 25, "basking_temp": 26, "humidity": 80}
+    created = (await client.post("/api/species-profiles", json=profile)).json()
+    assert created["species_key"] == "crested gecko"
+    await client.put(f"/api/species-profiles/{created['_id']}", json={"species_name": "Gargoyle Gecko"})
+    stored = await api.species_profiles_collection.find_one({})
+    assert stored["species_key"] == "gargoyle gecko"
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import ingest
+from server import retention
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 3, 10, 12)
+DAY = datetime(2026, 3, 1)
+
+
+def reading(tank_id, ts, temp, light=True):
+    return ingest.with_dedup_key({"tank_id": tank_id, "timestamp": ts, "temp": temp, "humidity": 50.0, "light": light})
+
+
+@pytest.fixture
+async def readings(db, monkeypatch):
+    monkeypatch.setattr(retention, "RETENTION_RAW_DAYS", 3)
+    monkeypatch.setattr(retention, "RETENTION_ARCHIVE_DIR", "")
+    coll = db["sensor_readings"]
+    await ingest.ensure_indexes(coll)
+    await retention.initialize(db, coll)
+    await coll.insert_many([
+        reading(1, DAY + timedelta(hours=1), 20.0),
+        reading(1, DAY + timedelta(hours=1, minutes=30), 24.0, light=False),
+        reading(2, DAY + timedelta(hours=5), 30.0),
+    ])
+    return coll
+
+
+async def hourly(tank_id):
+    return await retention.get_rollups(tank_id, "hourly", DAY, DAY + timedelta(days=1))
+
+
+async def test_rollups_before_expiry(readings):
+    deleted = await retention.run_once(NOW)
+    assert deleted == 3
+    assert await readings.count_documents({}) == 0
+    [bucket] = await hourly(1)
+    assert bucket["bucket"] == DAY + timedelta(hours=1)
+    assert (bucket["count"], bucket["temp_avg"], bucket["temp_min"], bucket["temp_max"]) == (2, 22.0, 20.0, 24.0)
+    assert bucket["light_on_count"] == 1
+    [daily] = await retention.get_rollups(2, "daily")
+    assert daily["bucket"] == DAY and daily["count"] == 1
+
+
+async def test_archive_round_trip_with_aware_range(readings, tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, "RETENTION_ARCHIVE_DIR", str(tmp_path))
+    await retention.run_once(NOW)
+    since = datetime.fromisoformat("2026-03-01T01:15:00+00:00")
+    until = datetime.fromisoformat("2026-03-01T04:00:00+01:00")  # 03:00 UTC
+    docs = retention.read_archive(1, since, until)
+    assert [d["temp"] for d in docs] == [24.0]
+    assert len(retention.read_archive(1)) == 2
+
+
+async def test_late_reading_for_archived_day(readings, tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, "RETENTION_ARCHIVE_DIR", str(tmp_path))
+    await retention.run_once(NOW)
+    # a spool replay brings a missed reading plus a copy of an archived one
+    await readings.insert_many([reading(1, DAY + timedelta(hours=1, minutes=45), 28.0)])
+    await readings.insert_one(reading(1, DAY + timedelta(hours=1), 20.0))
+
+    await retention.run_once(NOW)
+    assert await readings.count_documents({}) == 0
+    assert [d["temp"] for d in retention.read_archive(1)] == [20.0, 24.0, 28.0]
+    [bucket] = await hourly(1)
+    assert (bucket["count"], bucket["temp_avg"], bucket["temp_max"]) == (3, 24.0, 28.0)
+    # other tanks' archives and rollups are untouched
+    assert len(retention.read_archive(2)) == 1
+    assert (await hourly(2))[0]["count"] == 1
+
+
+async def test_late_reading_without_archive_is_merged(readings):
+    await retention.run_once(NOW)
+    await readings.insert_one(reading(1, DAY + timedelta(hours=1, minutes=45), 28.0))
+    await retention.run_once(NOW)
+    assert await readings.count_documents({}) == 0
+    [bucket] = await hourly(1)
+    assert (bucket["count"], bucket["temp_avg"], bucket["temp_min"], bucket["temp_max"]) == (3, 24.0, 20.0, 28.0)
+    [daily] = await retention.get_rollups(1, "daily")
+    assert daily["count"] == 3
+
+
+async def test_history_with_aware_until_reads_archive(client, api, tmp_path, monkeypatch, db):
+    monkeypatch.setattr(retention, "RETENTION_RAW_DAYS", 3)
+    monkeypatch.setattr(retention, "RETENTION_ARCHIVE_DIR", str(tmp_path))
+    await retention.initialize(db, api.collection)
+    await api.collection.insert_many([reading(1, DAY + timedelta(hours=1), 20.0)])
+    assert await retention.run_once(NOW) == 1
+    params = {"until": "2026-03-02T00:00:00Z"}
+    resp = await client.get("/api/readings/1", params=params)
+    assert resp.status_code == 200 and len(resp.json()["readings"]) == 1
+    resp = await client.get("/api/readings", params={"tank_ids": "1,2", **params})
+    assert resp.status_code == 200 and resp.json()["count"] == 1
+
+
+@pytest.mark.parametrize("archive", [False, True])
+async def test_late_reading_for_rolled_up_day_is_counted(readings, tmp_path, monkeypatch, archive):
+    if archive:
+        monkeypatch.setattr(retention, "RETENTION_ARCHIVE_DIR", str(tmp_path))
+    # the day is rolled up while it's still within retention
+    await retention.run_once(DAY + timedelta(days=2))
+    assert (await hourly(1))[0]["count"] == 2
+    # a spool replay brings a reading the rollup missed
+    await readings.insert_one(reading(1, DAY + timedelta(hours=1, minutes=45), 28.0))
+    assert await retention.run_once(NOW) == 4
+    [bucket] = await hourly(1)
+    assert (bucket["count"], bucket["temp_avg"], bucket["temp_max"]) == (3, 24.0, 28.0)
+    assert (await retention.get_rollups(1, "daily"))[0]["count"] == 3
+
+
+async def test_interrupted_expiry_keeps_rollups(readings, monkeypatch):
+    await retention.roll_up_closed_days(NOW)
+    delete_many = readings.delete_many
+
+    async def crash(*args, **kwargs):
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(readings, "delete_many", crash)
+    with pytest.raises(RuntimeError):
+        await retention.expire_day(DAY)
+    monkeypatch.setattr(readings, "delete_many", delete_many)
+    # half the day is gone before the expiry is resumed
+    await delete_many({"temp": 20.0})
+    await retention.expire_day(DAY)
+    assert (await hourly(1))[0]["count"] == 2
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import powerstrip_registry
+from server import scheduler
+from server import sensor_interface
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 3, 1, 12, 0)
+PROFILE = {"daylight_hours": 12, "requires_basking": True, "basking_duration_minutes": 60}
+
+
+class FakeStrip:
+    def __init__(self):
+        self.commands = []
+
+    async def set_outlet_states(self, batch):
+        self.commands.append(dict(batch))
+
+
+def test_no_outlets_are_assigned_by_default():
+    assert all("outlets" not in config for config in sensor_interface.TANKS.values())
+    assert powerstrip_registry.mapped_tanks() == []
+    assert all(not scheduler.outlets_for_tank(t) for t in scheduler.scheduled_tanks())
+
+
+def test_regular_day():
+    assert scheduler.desired_state(PROFILE, "lights", NOW) == "on"
+    assert scheduler.desired_state(PROFILE, "lights", NOW.replace(hour=20)) == "off"
+    assert scheduler.desired_state(PROFILE, "basking_lamp", NOW.replace(hour=13, minute=10)) == "on"
+    assert scheduler.next_transition(PROFILE, "lights", NOW) == (NOW.replace(hour=19), "off")
+
+
+@pytest.mark.parametrize("hours", [24, 30])
+def test_full_day_of_light_stays_on(hours):
+    profile = {**PROFILE, "daylight_hours": hours, "basking_duration_minutes": 24 * 60}
+    for role in scheduler.ROLES:
+        for at in (NOW, NOW.replace(hour=7), NOW.replace(hour=6, minute=59)):
+            assert scheduler.desired_state(profile, role, at) == "on"
+        assert scheduler.next_transition(profile, role, NOW) is None
+
+
+def test_no_daylight_stays_off():
+    profile = {**PROFILE, "daylight_hours": 0}
+    assert scheduler.desired_state(profile, "lights", NOW) == "off"
+    assert scheduler.next_transition(profile, "lights", NOW) is None
+
+
+async def test_heap_switches_configured_outlets(monkeypatch):
+    monkeypatch.setitem(sensor_interface.TANKS[1], "outlets", {"lights": 2})
+    strip = FakeStrip()
+    sched = scheduler.PhotoperiodScheduler(strip)
+    assert sched.schedule_tank(1, PROFILE, NOW) == {"lights": "on"}
+    assert sched._pop_due(NOW) == []
+    due = sched._pop_due(NOW.replace(hour=19))
+    assert due == [(1, "lights", "off")]
+    await sched._apply(due)
+    assert strip.commands == [{2: "off"}]
+    # the next transition is the following morning
+    assert sched.status()[0]["at"] == NOW.replace(hour=7) + timedelta(days=1)
+
+
+async def test_heap_keeps_full_day_lights_on(monkeypatch):
+    monkeypatch.setitem(sensor_interface.TANKS[1], "outlets", {"lights": 2})
+    sched = scheduler.PhotoperiodScheduler(FakeStrip())
+    assert sched.schedule_tank(1, {**PROFILE, "daylight_hours": 24}, NOW) == {"lights": "on"}
+    assert sched.status() == []
+    assert sched._pop_due(NOW + timedelta(days=2)) == []
+
+
+async def test_nothing_fires_before_it_is_due(monkeypatch):
+    monkeypatch.setitem(sensor_interface.TANKS[1], "outlets", {"lights": 2})
+    monkeypatch.setitem(sensor_interface.TANKS[2], "outlets", {"lights": 3})
+    sched = scheduler.PhotoperiodScheduler(FakeStrip())
+    sched.schedule_tank(1, PROFILE, NOW)
+    sched.schedule_tank(2, {**PROFILE, "daylight_hours": 12.5 + 1 / 120}, NOW)  # off at 19:30:30
+    off = NOW.replace(hour=19)
+    assert sched._pop_due(off - timedelta(seconds=1)) == []
+    assert sched._pop_due(off) == [(1, "lights", "off")]
+    assert sched._pop_due(off + timedelta(minutes=30)) == []
+    assert sched._pop_due(off + timedelta(minutes=30, seconds=30)) == [(2, "lights", "off")]
+
+
+async def test_group_waits_for_its_last_transition(monkeypatch):
+    monkeypatch.setitem(sensor_interface.TANKS[1], "outlets", {"lights": 2})
+    monkeypatch.setitem(sensor_interface.TANKS[2], "outlets", {"lights": 3})
+    sched = scheduler.PhotoperiodScheduler(FakeStrip())
+    sched.schedule_tank(1, PROFILE, NOW)
+    sched.schedule_tank(2, {**PROFILE, "daylight_hours": 12 + 1 / 120}, NOW)  # off at 19:00:30
+    last = NOW.replace(hour=19, second=30)
+    assert sched._group_due_at() == last
+    assert sched._pop_due(last) == [(1, "lights", "off"), (2, "lights", "off")]
+    # a superseded entry (tank 2 unscheduled) doesn't hold the group back
+    sched.schedule_tank(1, PROFILE, NOW)
+    sched.schedule_tank(2, {**PROFILE, "daylight_hours": 12 + 1 / 120}, NOW)
+    sched.unschedule_tank(2)
+    assert sched._group_due_at() == NOW.replace(hour=19)
@@ -0,0 +1,144 @@
+import json
+import os
+
+import pytest
+import requests
+
+from server import sensor_interface
+from server.spool import DEAD_LETTER_FILE, RECORD_HEADER, Spool
+
+
+def reading(i):
+    return {"id": 1, "temp": 20.0 + i, "humidity": 50.0, "light": True, "timestamp": f"2026-03-01T00:{i:02d}:00"}
+
+
+def test_unacknowledged_readings_survive_a_restart(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=4096)
+    for i in range(5):
+        spool.append(reading(i))
+    batch, offset = spool.read_batch(3)
+    assert [r["temp"] for r in batch] == [20.0, 21.0, 22.0]
+    spool.commit(*offset)
+    batch, _ = spool.read_batch(10)  # read but never acknowledged
+    assert len(batch) == 2
+    spool.close()
+
+    reopened = Spool(str(tmp_path), segment_bytes=4096)
+    assert reopened.pending()
+    batch, offset = reopened.read_batch(10)
+    assert [r["temp"] for r in batch] == [23.0, 24.0]
+    reopened.commit(*offset)
+    assert not reopened.pending()
+    reopened.close()
+
+
+def test_segments_rotate_and_consumed_ones_are_deleted(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=512)
+    for i in range(20):
+        spool.append(reading(i))
+    assert len(spool.segments()) > 2
+    batch, offset = spool.read_batch(100)
+    assert [r["temp"] for r in batch] == [20.0 + i for i in range(20)]
+    spool.commit(*offset)
+    assert spool.segments() == [offset[0]]
+    spool.close()
+
+
+def test_size_limit_drops_oldest_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=512, max_bytes=1024)
+    for i in range(30):
+        spool.append(reading(i))
+    assert len(spool.segments()) <= 2
+    batch, _ = spool.read_batch(100)
+    assert batch[-1]["temp"] == 49.0
+    assert batch[0]["temp"] > 20.0  # the oldest readings were dropped
+    spool.close()
+
+
+def test_torn_record_is_truncated(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=4096)
+    spool.append(reading(0))
+    spool.append(reading(1))
+    end = spool._write_pos
+    spool.close()
+    # a crash mid-append: header written, payload doesn't match its crc
+    path = os.path.join(str(tmp_path), "segment-0000000000.log")
+    with open(path, "r+b") as f:
+        f.seek(end)
+        f.write(RECORD_HEADER.pack(10, 12345) + b"0123456789")
+
+    reopened = Spool(str(tmp_path), segment_bytes=4096)
+    reopened.append(reading(2))
+    batch, _ = reopened.read_batch(10)
+    assert [r["temp"] for r in batch] == [20.0, 21.0, 22.0]
+    reopened.close()
+
+
+class FakeBulkEndpoint:
+    """Rejects requests holding a reading without a temperature, like the ingest endpoints."""
+
+    def __init__(self, status=201):
+        self.status = status
+        self.stored = []
+        self.calls = 0
+
+    def post(self, url, json=None, timeout=None, **kwargs):
+        self.calls += 1
+        resp = requests.Response()
+        resp.url = url
+        if self.status != 201:
+            resp.status_code = self.status
+        elif any(r.get("temp") is None for r in (json if isinstance(json, list) else [json])):
+            resp.status_code = 422
+            resp._content = b'{"detail": "temp: field required"}'
+        else:
+            resp.status_code = 201
+            self.stored.extend(json if isinstance(json, list) else [json])
+        return resp
+
+
+@pytest.fixture
+def replay(tmp_path, monkeypatch):
+    spool = Spool(str(tmp_path), segment_bytes=4096)
+    endpoint = FakeBulkEndpoint()
+    monkeypatch.setattr(sensor_interface, "_spool", spool)
+    monkeypatch.setattr(sensor_interface.requests, "post", endpoint.post)
+    monkeypatch.setattr(sensor_interface, "SPOOL_REPLAY_BATCH", 4)
+    yield spool, endpoint
+    spool.close()
+
+
+@pytest.mark.anyio
+async def test_poison_reading_does_not_block_replay(replay, tmp_path):
+    spool, endpoint = replay
+    for i in range(6):
+        spool.append(reading(i) if i != 2 else {**reading(i), "temp": None})
+    assert await sensor_interface.replay_once()
+    assert await sensor_interface.replay_once()
+    assert not spool.pending()
+    assert sorted(r["temp"] for r in endpoint.stored) == [20.0, 21.0, 23.0, 24.0, 25.0]
+    [line] = (tmp_path / DEAD_LETTER_FILE).read_text().splitlines()
+    rejected = json.loads(line)
+    assert rejected["reading"]["timestamp"] == reading(2)["timestamp"]
+    assert rejected["reason"].startswith("422")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("status", [429, 503, 408])
+async def test_unavailable_server_keeps_batch_spooled(replay, tmp_path, status):
+    spool, endpoint = replay
+    endpoint.status = status
+    spool.append(reading(0))
+    assert not await sensor_interface.replay_once()
+    assert spool.pending()
+    assert not (tmp_path / DEAD_LETTER_FILE).exists()
+    endpoint.status = 201
+    assert await sensor_interface.replay_once()
+    assert not spool.pending()
+
+
+def test_rejected_live_reading_is_not_spooled(replay):
+    spool, endpoint = replay
+    sensor_interface.update_server({**reading(0), "temp": None})
+    assert endpoint.calls == 1  # no retry either
+    assert not spool.pending()
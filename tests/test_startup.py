@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from server import alerts
+from server import compliance
+from server import dashboard
+from server import history_cache
+from server import ingest
+from server import invalidation
+from server import tank_stats
+from server import tracing
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def quick_startup(api, monkeypatch):
+    async def nothing(*args):
+        pass
+
+    monkeypatch.setattr(api.powerstrip_module, "initialize", nothing)
+    monkeypatch.setattr(alerts, "initialize", nothing)
+    monkeypatch.setattr(api, "mongo_client", AsyncMongoMockClient())
+    monkeypatch.setattr(api, "_ready", False)
+    monkeypatch.setattr(api, "startup_failures", {})
+    sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, "sleep", lambda delay, *args: sleep(0, *args))
+    yield api
+    await dashboard.cleanup()
+    await compliance.cleanup()
+    await tank_stats.cleanup()
+    history_cache.cleanup()
+    await tracing.cleanup()
+    await invalidation.cleanup()
+
+
+async def test_ready_waits_for_required_phases(client, quick_startup, db, monkeypatch):
+    api = quick_startup
+    attempts = []
+    ensure_indexes = ingest.ensure_indexes
+    unblock = asyncio.Event()
+
+    async def flaky(collection):
+        attempts.append(1)
+        if not unblock.is_set():
+            raise ConnectionError("mongod not up yet")
+        await ensure_indexes(collection)
+
+    monkeypatch.setattr(ingest, "ensure_indexes", flaky)
+    warm_up = asyncio.create_task(api._warm_up(db, 0.0))
+    while len(attempts) < 3:
+        await asyncio.sleep(0)
+    resp = await client.get("/ready")
+    assert resp.status_code == 503
+    assert "ingest_indexes" in resp.json()["failed_phases"]
+
+    unblock.set()
+    await asyncio.wait_for(warm_up, 5)
+    resp = await client.get("/ready")
+    assert resp.status_code == 200 and resp.json()["failed_phases"] == {}
+
+
+async def test_optional_phase_failure_does_not_block(client, quick_startup, db, monkeypatch):
+    api = quick_startup
+
+    async def unreachable():
+        raise OSError("no strip on the network")
+
+    monkeypatch.setattr(api.powerstrip_module, "initialize", unreachable)
+    await asyncio.wait_for(api._warm_up(db, 0.0), 5)
+    resp = await client.get("/ready")
+    assert resp.status_code == 200
+    assert "powerstrip" in resp.json()["failed_phases"]
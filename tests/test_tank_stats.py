@@ -0,0 +1,108 @@
+import statistics
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import tank_stats
+
+START = datetime(2026, 1, 1)
+RANGES = {"temp": (20.0, 30.0), "humidity": (30.0, 50.0)}
+
+
+def feed(stats, minutes, temps, humidity=40.0):
+    for minute, temp in zip(minutes, temps):
+        stats.add({"timestamp": START + timedelta(minutes=minute), "temp": temp, "humidity": humidity}, RANGES)
+
+
+def test_mean_and_stddev_cover_only_the_window():
+    stats = tank_stats.TankStats(1)
+    window = tank_stats.WINDOW_MINUTES
+    feed(stats, range(window), [100.0] * window)  # an hour of a stuck sensor
+    recent = [24.0, 25.0, 26.0, 25.5, 24.5]
+    feed(stats, range(2 * window, 2 * window + 5), recent)
+    snap = stats.snapshot(RANGES)["temp"]
+    assert snap["count"] == window + 5
+    assert snap["window_count"] == 5
+    assert snap["mean"] == pytest.approx(statistics.mean(recent))
+    assert snap["stddev"] == pytest.approx(statistics.stdev(recent))
+    assert (snap["window_min"], snap["window_max"]) == (24.0, 26.0)
+
+
+def test_buckets_merge_exactly():
+    stats = tank_stats.TankStats(1)
+    values = [20.0 + (i * 7 % 11) / 3 for i in range(90)]
+    feed(stats, [i // 3 for i in range(90)], values)  # three readings per minute
+    snap = stats.snapshot(RANGES)["temp"]
+    assert snap["mean"] == pytest.approx(statistics.mean(values))
+    assert snap["stddev"] == pytest.approx(statistics.stdev(values))
+
+
+def test_late_readings_do_not_move_last_or_ewma():
+    stats = tank_stats.TankStats(1)
+    feed(stats, [10, 11], [25.0, 26.0])
+    before = stats.snapshot(RANGES)["temp"]
+    feed(stats, [5], [35.0])  # replayed from a spool
+    after = stats.snapshot(RANGES)["temp"]
+    assert after["last"] == 26.0
+    assert after["ewma"] == before["ewma"]
+    assert after["window_count"] == 3 and after["window_max"] == 35.0
+    assert stats.last_ts == START + timedelta(minutes=11)
+
+
+def test_time_in_range_and_drift():
+    stats = tank_stats.TankStats(1)
+    feed(stats, [0, 1, 2, 3], [25.0, 25.0, 35.0, 25.0])
+    snap = stats.snapshot(RANGES)["temp"]
+    assert snap["time_in_range_pct"] == pytest.approx(100 * 2 / 3)
+    assert tank_stats._drift(29.5, 20.0, 30.0) == "drifting_high"
+    assert tank_stats._drift(19.0, 20.0, 30.0) == "out_low"
+    assert tank_stats._drift(25.0, 20.0, 30.0) is None
+
+
+@pytest.fixture
+async def shared(db, monkeypatch):
+    monkeypatch.setattr(tank_stats, "_profiles", {})
+    monkeypatch.setattr(tank_stats, "_profiles_loaded", True)
+    tank_stats._state_collection = db[tank_stats.STATE_COLLECTION]
+    tank_stats._pending = {}
+    yield tank_stats._state_collection
+    tank_stats._state_collection = None
+    tank_stats._pending = {}
+
+
+def reading(minute, temp):
+    return {"tank_id": 1, "timestamp": START + timedelta(minutes=minute), "temp": temp, "humidity": 40.0}
+
+
+@pytest.mark.anyio
+async def test_workers_share_one_state(shared):
+    # readings of one tank land on different workers; each flushes its own queue
+    await tank_stats.observe(reading(0, 24.0))
+    await tank_stats.observe(reading(2, 26.0))
+    await tank_stats.flush()
+    await tank_stats.observe(reading(1, 25.0))  # late, from another worker
+    await tank_stats.flush()
+    snap = (await tank_stats.get_stats(1))["temp"]
+    assert (snap["count"], snap["window_count"], snap["last"]) == (3, 3, 26.0)
+    assert snap["mean"] == pytest.approx(25.0)
+
+
+@pytest.mark.anyio
+async def test_concurrent_flush_is_refolded(shared, monkeypatch):
+    store = tank_stats._store
+    raced = []
+
+    async def racing_store(tank_id, version, stats):
+        if not raced:
+            raced.append(1)
+            other = tank_stats.TankStats(tank_id)
+            other.add(reading(0, 24.0), None)
+            await shared.insert_one({"_id": tank_id, "version": 1, **other.to_doc()})
+        return await store(tank_id, version, stats)
+
+    monkeypatch.setattr(tank_stats, "_store", racing_store)
+    await tank_stats.observe(reading(1, 26.0))
+    await tank_stats.flush()
+    snap = (await tank_stats.get_stats(1))["temp"]
+    assert (snap["count"], snap["last"]) == (2, 26.0)
+    assert (await shared.find_one({"_id": 1}))["version"] == 2
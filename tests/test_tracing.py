@@ -0,0 +1,114 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from server import tracing
+
+pytestmark = pytest.mark.anyio
+
+TRACE_ID = "0af7651916cd43dd8448eb211c80319c"
+
+
+def headers(trace_id=TRACE_ID, sent_at=None):
+    out = {tracing.TRACEPARENT_HEADER: tracing.traceparent(trace_id)}
+    if sent_at is not None:
+        out[tracing.SENT_AT_HEADER] = sent_at
+    return out
+
+
+def doc(tank_id=1, age_seconds=2.0):
+    return {"tank_id": tank_id, "timestamp": datetime.utcnow() - timedelta(seconds=age_seconds)}
+
+
+class State:
+    received_at = None
+
+
+@pytest.fixture(autouse=True)
+async def empty_buffer(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(tracing, "_buffer", tracing.deque(maxlen=16))
+    monkeypatch.setattr(tracing, "_awaiting_actuation", {})
+    monkeypatch.setattr(tracing, "_withdrawn", set())
+    monkeypatch.setattr(tracing, "_collection", None)
+    yield
+    await tracing.cleanup()
+
+
+@pytest.mark.parametrize("sent_at", ["nan", "inf", "-inf", "soon"])
+async def test_unusable_sent_at_is_ignored(sent_at):
+    trace = tracing.begin(headers(sent_at=sent_at), State(), doc())
+    assert [stage for stage, _ in trace.marks] == ["sampled"]
+    tracing.finish(trace)
+    assert (await tracing.report())["traces"] == 1
+
+
+async def test_latency_endpoint_with_nan_sent_at(client):
+    body = {"id": 1, "temp": 26.0, "humidity": 40.0, "light": True, "timestamp": datetime.utcnow().isoformat()}
+    resp = await client.post("/api/readings", json=body, headers=headers(sent_at="nan"))
+    assert resp.status_code == 201
+    resp = await client.get("/api/traces/latency", params={"recent": 1})
+    assert resp.status_code == 200
+    assert "client" not in resp.json()["recent"][0]["stages"]
+
+
+async def test_actuation_recorded_by_another_process(db):
+    await tracing.initialize(db)
+    older = tracing.begin(headers("1" * 32), State(), doc(age_seconds=5))
+    newer = tracing.begin(headers("2" * 32), State(), doc(age_seconds=2))
+    tracing.finish(older)
+    tracing.finish(newer)
+    assert await db[tracing.ACTUATIONS_COLLECTION].count_documents({}) == 0  # not on the ingest path
+    await tracing.flush()
+    assert await db[tracing.ACTUATIONS_COLLECTION].count_documents({}) == 1
+
+    # the poller's scheduler only shares the database with this worker
+    await tracing.actuated([1], at=time.time())
+    await tracing.actuated([1], at=time.time())  # nothing left to claim
+    report = await tracing.report(recent=2)
+    older_record, newer_record = report["recent"]
+    assert older_record["sample_to_actuation_ms"] is None
+    assert newer_record["sample_to_actuation_ms"] >= 2000
+    assert report["sample_to_actuation_ms"]["count"] == 1
+    assert await db[tracing.ACTUATIONS_COLLECTION].count_documents({}) == 0
+
+
+async def test_in_process_actuation_without_database():
+    trace = tracing.begin(headers(), State(), doc())
+    tracing.finish(trace)
+    await tracing.actuated([2, 1])
+    [record] = (await tracing.report(recent=1))["recent"]
+    assert record["stages"]["actuate"] >= 0
+
+
+async def test_local_actuation_before_flush_withdraws_shared_trace(db):
+    await tracing.initialize(db)
+    tracing.finish(tracing.begin(headers("1" * 32), State(), doc(age_seconds=5)))
+    await tracing.flush()
+    tracing.finish(tracing.begin(headers("2" * 32), State(), doc(age_seconds=2)))
+    # a command from this worker claims the newest trace before it was shared
+    await tracing.actuated([1])
+    await tracing.flush()
+    assert await db[tracing.ACTUATIONS_COLLECTION].count_documents({}) == 0
+    older, newer = (await tracing.report(recent=2))["recent"]
+    assert older["sample_to_actuation_ms"] is None
+    assert newer["sample_to_actuation_ms"] >= 2000
+
+
+async def test_failing_trace_store_does_not_reach_ingest(db, monkeypatch):
+    await tracing.initialize(db)
+    coll = tracing._collection
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError("trace store down")
+
+    monkeypatch.setattr(coll, "bulk_write", broken)
+    tracing.finish(tracing.begin(headers(), State(), doc()))
+    await tracing.flush()  # logged, not raised
+    assert (await tracing.report())["traces"] == 1
+
+
+async def test_unsampled_readings_are_not_traced(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 0.0)
+    assert tracing.begin(headers(), State(), doc()) is None
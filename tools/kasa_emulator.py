@@ -0,0 +1,384 @@
+# Emulated Kasa powerstrips, for development and load testing without hardware.
+#
+# Two ways to use it:
+#
+#   in-process   EmulatedDiscover stands in for kasa.Discover, returning
+#                fake devices backed by EmulatedStrip state:
+#
+#                    with installed(EmulatedDiscover(strips)):
+#                        await powerstrip_interface.get_outlet_state(1)
+#
+#   network      KasaResponder answers the legacy Kasa protocol (XOR
+#                "autokey" JSON on UDP/TCP 9999) on local addresses, so the
+#                real python-kasa client can discover and drive the strips:
+#
+#                    python -m tools.kasa_emulator --strips 4 --base-ip 127.0.0.2
+#                    KASA_DEVICE_IP=127.0.0.2 uvicorn server.app:app
+#
+# Every strip has a relay count, a per-request latency with uniform jitter,
+# a failure rate (request raises, or the connection drops) and an `offline`
+# switch (requests time out).
+import argparse
+import asyncio
+import ipaddress
+import json
+import logging
+import random
+import struct
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from server import powerstrip_interface as ps
+
+logger = logging.getLogger("kasa-emulator")
+
+KASA_PORT = 9999
+# a UDP reply that would take longer than this is dropped instead
+REPLY_TIMEOUT = 1.0
+
+
+class EmulatedFailure(Exception):
+    """An injected device error."""
+
+
+class DiscoveryTimeout(TimeoutError):
+    """No emulated strip answered in time (stands in for kasa's TimeoutError)."""
+
+
+class EmulatedStrip:
+    """State and behaviour of one emulated strip, shared by both front ends."""
+
+    def __init__(self, host: str, relays: int = 6, latency: float = 0.02, jitter: float = 0.0,
+                 failure_rate: float = 0.0, alias: Optional[str] = None, seed: Optional[int] = None):
+        self.host = host
+        self.relays = [False] * relays
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.offline = False
+        self.alias = alias or f"Emulated strip {host}"
+        octets = ipaddress.ip_address(host).packed[-4:]
+        self.mac = "50:C7:BF:" + ":".join(f"{b:02X}" for b in octets[1:])
+        self.device_id = f"EMU{int.from_bytes(octets, 'big'):037X}"
+        self._random = random.Random(seed)
+        self.counters = {"requests": 0, "failures": 0}
+
+    async def round_trip(self):
+        """Wait out one request's latency, then fail it if injected."""
+        self.counters["requests"] += 1
+        if self.offline:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            self.counters["failures"] += 1
+            raise EmulatedFailure(f"injected failure on {self.host}")
+
+    def child_id(self, index: int) -> str:
+        return f"{self.device_id}{index:02d}"
+
+    def sysinfo(self) -> dict:
+        return {
+            "sw_ver": "1.0.0 Build 000000 Rel.000000",
+            "hw_ver": "1.0",
+            "model": "HS300(US)",
+            "type": "IOT.SMARTPLUGSWITCH",
+            "mic_type": "IOT.SMARTPLUGSWITCH",
+            "deviceId": self.device_id,
+            "oemId": "0" * 32,
+            "hwId": "0" * 32,
+            "mac": self.mac,
+            "alias": self.alias,
+            "rssi": -50,
+            "latitude_i": 0,
+            "longitude_i": 0,
+            "led_off": 0,
+            "updating": 0,
+            "feature": "TIM",
+            "status": "new",
+            "child_num": len(self.relays),
+            "children": [
+                {"id": self.child_id(i), "state": int(on), "alias": f"Outlet {i + 1}",
+                 "on_time": 0, "next_action": {"type": -1}}
+                for i, on in enumerate(self.relays)
+            ],
+            "err_code": 0,
+        }
+
+    def handle(self, request: dict) -> dict:
+        """Answer one decoded legacy-protocol request."""
+        context = request.pop("context", None) or {}
+        children = context.get("child_ids") or []
+        response = {}
+        for module, methods in request.items():
+            if module != "system" or not isinstance(methods, dict):
+                response[module] = {"err_code": -1, "err_msg": "module not support"}
+                continue
+            result = {}
+            for method, params in methods.items():
+                if method == "get_sysinfo":
+                    result[method] = self.sysinfo()
+                elif method == "set_relay_state":
+                    state = bool((params or {}).get("state"))
+                    targets = [cid[-2:] for cid in children] or range(len(self.relays))
+                    for idx in targets:
+                        self.relays[int(idx)] = state
+                    result[method] = {"err_code": 0}
+                else:
+                    result[method] = {"err_code": -2, "err_msg": "member not support"}
+            response[module] = result
+        return response
+
+
+# ---- in-process fake ---------------------------------------------------------
+
+class _EmulatedRelay:
+    def __init__(self, strip: EmulatedStrip, index: int):
+        self._strip = strip
+        self._index = index
+        self.alias = f"Outlet {index + 1}"
+        self.is_on = strip.relays[index]
+
+    async def update(self):
+        # children are refreshed by the parent's update, as on a real strip
+        self.is_on = self._strip.relays[self._index]
+
+    async def _set(self, state: bool):
+        await self._strip.round_trip()
+        self._strip.relays[self._index] = state
+        self.is_on = state
+
+    async def turn_on(self):
+        await self._set(True)
+
+    async def turn_off(self):
+        await self._set(False)
+
+
+class _EmulatedDevice:
+    """The subset of a kasa Device that powerstrip_interface relies on."""
+
+    def __init__(self, strip: EmulatedStrip):
+        self._strip = strip
+        self.host = strip.host
+        self.mac = strip.mac
+        self.alias = strip.alias
+        self.model = "HS300(US)"
+        self.children = [_EmulatedRelay(strip, i) for i in range(len(strip.relays))]
+
+    @property
+    def is_on(self) -> bool:
+        return any(self._strip.relays)
+
+    async def update(self):
+        await self._strip.round_trip()
+        for child in self.children:
+            await child.update()
+
+
+class EmulatedDiscover:
+    """Drop-in for kasa.Discover backed by in-process strips."""
+
+    def __init__(self, strips: Iterable[EmulatedStrip]):
+        self.strips: Dict[str, EmulatedStrip] = {s.host: s for s in strips}
+
+    async def discover_single(self, host: str, *, discovery_timeout: float = 5, **kwargs):
+        strip = self.strips.get(host)
+        if strip is None or strip.offline:
+            await asyncio.sleep(discovery_timeout)
+            raise DiscoveryTimeout(f"Timed out getting discovery response for {host}")
+        try:
+            await asyncio.wait_for(strip.round_trip(), timeout=discovery_timeout)
+        except (EmulatedFailure, asyncio.TimeoutError):
+            raise DiscoveryTimeout(f"Timed out getting discovery response for {host}") from None
+        return _EmulatedDevice(strip)
+
+    async def discover(self, *, discovery_timeout: float = 5, **kwargs) -> Dict[str, object]:
+        # like the real broadcast, listen for replies for the whole timeout
+        async def reply(strip):
+            try:
+                await strip.round_trip()
+                return _EmulatedDevice(strip)
+            except EmulatedFailure:
+                return None  # a lost reply
+
+        tasks = {host: asyncio.create_task(reply(s)) for host, s in self.strips.items()}
+        await asyncio.sleep(discovery_timeout)
+        found = {}
+        for host, task in tasks.items():
+            if task.done() and task.result() is not None:
+                found[host] = task.result()
+            else:
+                task.cancel()
+        return found
+
+
+@contextmanager
+def installed(discover: EmulatedDiscover):
+    """Route powerstrip_interface (and so the registry) to emulated strips."""
+    saved = (ps.Discover, ps.KasaTimeoutError, ps.KASA_AVAILABLE)
+    ps.Discover, ps.KasaTimeoutError, ps.KASA_AVAILABLE = discover, DiscoveryTimeout, True
+    try:
+        yield discover
+    finally:
+        ps.Discover, ps.KasaTimeoutError, ps.KASA_AVAILABLE = saved
+
+
+def make_strips(count: int, base_ip: str = "127.0.0.2", **kwargs) -> List[EmulatedStrip]:
+    base = ipaddress.ip_address(base_ip)
+    return [EmulatedStrip(str(base + i), seed=i, **kwargs) for i in range(count)]
+
+
+# ---- network responder ----------------------------------------------------------
+
+def xor_encrypt(data: bytes) -> bytes:
+    key = 171
+    out = bytearray()
+    for b in data:
+        key ^= b
+        out.append(key)
+    return bytes(out)
+
+
+def xor_decrypt(data: bytes) -> bytes:
+    key = 171
+    out = bytearray()
+    for b in data:
+        out.append(key ^ b)
+        key = b
+    return bytes(out)
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, on_datagram):
+        self.on_datagram = on_datagram
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.on_datagram(self, data, addr)
+
+
+class KasaResponder:
+    """Serves emulated strips over UDP/TCP so the real kasa client can use them.
+
+    Each strip listens on its own address (loopback aliases such as
+    127.0.0.2, 127.0.0.3, ... need no setup on Linux). Broadcast discovery is
+    emulated by a listener on `discovery_host`: pass it as Discover's
+    `target` and every strip answers from its own address.
+    """
+
+    def __init__(self, strips: Iterable[EmulatedStrip], port: int = KASA_PORT,
+                 discovery_host: Optional[str] = "127.0.0.1"):
+        self.strips = list(strips)
+        self.port = port
+        self.discovery_host = discovery_host
+        self._servers: List[asyncio.AbstractServer] = []
+        self._udp: Dict[str, _UdpProtocol] = {}
+        self._tasks = set()
+        self._connections = {}
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _udp_reply(self, strip: EmulatedStrip, request: bytes, addr):
+        try:
+            await asyncio.wait_for(strip.round_trip(), timeout=REPLY_TIMEOUT)
+        except (EmulatedFailure, asyncio.TimeoutError):
+            return  # a lost datagram
+        reply = strip.handle(json.loads(xor_decrypt(request)))
+        self._udp[strip.host].transport.sendto(xor_encrypt(json.dumps(reply).encode()), addr)
+
+    def _on_probe(self, strip: EmulatedStrip):
+        def on_datagram(proto, data, addr):
+            self._spawn(self._udp_reply(strip, data, addr))
+        return on_datagram
+
+    def _on_broadcast(self, proto, data, addr):
+        for strip in self.strips:
+            self._spawn(self._udp_reply(strip, data, addr))
+
+    def _on_connection(self, strip: EmulatedStrip):
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            self._connections[writer] = asyncio.current_task()
+            try:
+                while True:
+                    header = await reader.readexactly(4)
+                    (length,) = struct.unpack(">I", header)
+                    request = json.loads(xor_decrypt(await reader.readexactly(length)))
+                    await strip.round_trip()
+                    payload = xor_encrypt(json.dumps(strip.handle(request)).encode())
+                    writer.write(struct.pack(">I", len(payload)) + payload)
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError, EmulatedFailure, ValueError):
+                pass  # an injected failure drops the connection mid-request
+            finally:
+                self._connections.pop(writer, None)
+                writer.close()
+        return handle
+
+    async def start(self) -> "KasaResponder":
+        loop = asyncio.get_running_loop()
+        for strip in self.strips:
+            self._servers.append(await asyncio.start_server(self._on_connection(strip), strip.host, self.port))
+            _, proto = await loop.create_datagram_endpoint(
+                lambda s=strip: _UdpProtocol(self._on_probe(s)), local_addr=(strip.host, self.port))
+            self._udp[strip.host] = proto
+        if self.discovery_host:
+            _, self._broadcast = await loop.create_datagram_endpoint(
+                lambda: _UdpProtocol(self._on_broadcast), local_addr=(self.discovery_host, self.port))
+        logger.info("Serving %d emulated strip(s) on port %d", len(self.strips), self.port)
+        return self
+
+    async def stop(self):
+        handlers = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        # let open connections see EOF and finish rather than cancelling them
+        await asyncio.gather(*handlers, return_exceptions=True)
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for proto in list(self._udp.values()) + [getattr(self, "_broadcast", None)]:
+            if proto is not None and proto.transport is not None:
+                proto.transport.close()
+        for task in list(self._tasks):
+            task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulated Kasa powerstrips on local addresses")
+    parser.add_argument("--strips", type=int, default=1)
+    parser.add_argument("--relays", type=int, default=6)
+    parser.add_argument("--base-ip", default="127.0.0.2", help="first strip address; the rest follow")
+    parser.add_argument("--port", type=int, default=KASA_PORT)
+    parser.add_argument("--discovery-host", default="127.0.0.1",
+                        help="address answering broadcast-style discovery (Discover target)")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra uniform random seconds per request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests that fail")
+    args = parser.parse_args()
+
+    strips = make_strips(args.strips, args.base_ip, relays=args.relays, latency=args.latency,
+                         jitter=args.jitter, failure_rate=args.failure_rate)
+
+    async def run():
+        responder = await KasaResponder(strips, args.port, args.discovery_host).start()
+        for strip in strips:
+            print(f"{strip.host}:{args.port}  {strip.mac}  {len(strip.relays)} relays")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await responder.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()